@@ -1,7 +1,11 @@
 import argparse
 
+from src.build.aggregates import build_aggregates
+from src.build.columnar import build_columnar
+from src.build.h3index import build_h3_index
 from src.build.nodes import build_nodes
 from src.build.signals import build_signals
+from src.common.metrics import metrics
 
 
 def get_argument_parser() -> argparse.ArgumentParser:
@@ -20,18 +24,105 @@ def get_argument_parser() -> argparse.ArgumentParser:
         default=False,
         help="build base nodes table",
     )
+    parser.add_argument(
+        "--columnar",
+        dest="columnar",
+        action="store_true",
+        default=False,
+        help="export the signals table to memory-mapped column files",
+    )
+    parser.add_argument(
+        "--h3-index",
+        dest="h3_index",
+        action="store_true",
+        default=False,
+        help="build the parent H3 columns and the cell to trajectory index",
+    )
+    parser.add_argument(
+        "--aggregates",
+        dest="aggregates",
+        action="store_true",
+        default=False,
+        help="refresh the per-trajectory and per-cell aggregate tables",
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        default=1,
+        help="number of worker processes used to parse the signal files",
+    )
+    parser.add_argument(
+        "--concurrency",
+        dest="concurrency",
+        type=int,
+        default=None,
+        help="number of concurrent map-matching requests (defaults to config.toml)",
+    )
+    parser.add_argument(
+        "--resume",
+        dest="resume",
+        action="store_true",
+        default=False,
+        help="only match pending trajectories or those whose points changed",
+    )
+    parser.add_argument(
+        "--retry-errors",
+        dest="retry_errors",
+        action="store_true",
+        default=False,
+        help="only rematch trajectories that previously failed",
+    )
+    parser.add_argument(
+        "--clear-match-cache",
+        dest="clear_match_cache",
+        action="store_true",
+        default=False,
+        help="drop every cached map-match response before matching",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        default=None,
+        metavar="DIR",
+        help="write one cProfile .prof file per build stage to this folder",
+    )
+    parser.add_argument(
+        "--metrics",
+        dest="metrics",
+        default=None,
+        metavar="FILE",
+        help="write the stage timings to this .json or .csv file",
+    )
     return parser
 
 
 def main():
     parser = get_argument_parser()
     args = parser.parse_args()
+    metrics.profile_folder = args.profile
 
     if args.signals:
-        build_signals()
+        build_signals(workers=args.workers)
+
+    if args.columnar:
+        build_columnar()
 
     if args.nodes:
-        build_nodes()
+        build_nodes(concurrency=args.concurrency,
+                    resume=args.resume,
+                    retry_errors=args.retry_errors,
+                    clear_cache=args.clear_match_cache)
+
+    if args.h3_index:
+        build_h3_index()
+
+    if args.aggregates:
+        build_aggregates()
+
+    if args.metrics is not None:
+        metrics.write(args.metrics)
+    metrics.dump_profiles()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,12 @@
+CREATE TABLE IF NOT EXISTS cell_stats
+(
+    resolution      INTEGER NOT NULL,
+    h3_cell         INTEGER NOT NULL,
+    traj_count      INTEGER NOT NULL,
+    signal_count    INTEGER NOT NULL,
+    speed_sum       DOUBLE,
+    speed_count     INTEGER NOT NULL,
+    energy_sum      DOUBLE,
+    energy_count    INTEGER NOT NULL,
+    PRIMARY KEY (resolution, h3_cell)
+) WITHOUT ROWID;
\ No newline at end of file
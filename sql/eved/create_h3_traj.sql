@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS h3_traj
+(
+    h3_cell     INTEGER NOT NULL,
+    resolution  INTEGER NOT NULL,
+    traj_id     INTEGER NOT NULL,
+    PRIMARY KEY (h3_cell, resolution, traj_id)
+) WITHOUT ROWID;
\ No newline at end of file
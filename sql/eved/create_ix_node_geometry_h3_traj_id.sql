@@ -0,0 +1,3 @@
+CREATE INDEX IF NOT EXISTS ix_node_geometry_h3_traj_id ON node_geometry_h3 (
+    traj_id ASC
+);
\ No newline at end of file
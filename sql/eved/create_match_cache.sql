@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS match_cache
+(
+    request_hash    BLOB    PRIMARY KEY,
+    version         TEXT    NOT NULL,
+    shape           BLOB    NOT NULL,
+    created_at      TEXT
+);
\ No newline at end of file
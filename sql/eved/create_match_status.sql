@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS match_status
+(
+    traj_id         INTEGER PRIMARY KEY ASC,
+    status          TEXT    NOT NULL,
+    input_hash      TEXT,
+    updated_at      TEXT
+);
\ No newline at end of file
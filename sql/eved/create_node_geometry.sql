@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS node_geometry
+(
+    traj_id         INTEGER PRIMARY KEY ASC,
+    encoding        TEXT    NOT NULL,
+    point_count     INTEGER NOT NULL,
+    geometry        BLOB,
+    match_error     TEXT
+);
\ No newline at end of file
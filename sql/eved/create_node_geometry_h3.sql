@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS node_geometry_h3
+(
+    h3_12           INTEGER NOT NULL,
+    traj_id         INTEGER NOT NULL,
+    PRIMARY KEY (h3_12, traj_id)
+) WITHOUT ROWID;
\ No newline at end of file
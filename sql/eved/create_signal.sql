@@ -36,5 +36,10 @@ CREATE TABLE IF NOT EXISTS signal
     intersection       INTEGER,
     bus_stop           INTEGER,
     focus_points       TEXT,
-    h3_12              INTEGER
+    h3_12              INTEGER,
+    step_m             DOUBLE  NOT NULL,
+    cum_m              DOUBLE  NOT NULL,
+    heading_deg        DOUBLE,
+    dt_ms              INTEGER NOT NULL,
+    accel_mps2         DOUBLE
 );
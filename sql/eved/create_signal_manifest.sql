@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS signal_manifest
+(
+    member          TEXT    PRIMARY KEY,
+    file_size       INTEGER NOT NULL,
+    crc             INTEGER NOT NULL,
+    rows            INTEGER NOT NULL,
+    first_signal_id INTEGER,
+    last_signal_id  INTEGER,
+    loaded_at       TEXT
+);
\ No newline at end of file
@@ -0,0 +1,16 @@
+CREATE TABLE IF NOT EXISTS traj_stats
+(
+    traj_id         INTEGER PRIMARY KEY ASC,
+    signal_count    INTEGER NOT NULL,
+    energy_sum      DOUBLE,
+    energy_count    INTEGER NOT NULL,
+    fuel_rate_sum   DOUBLE,
+    fuel_rate_count INTEGER NOT NULL,
+    speed_sum       DOUBLE,
+    speed_count     INTEGER NOT NULL,
+    speed_max       DOUBLE,
+    soc_ini         DOUBLE,
+    soc_end         DOUBLE,
+    soc_min         DOUBLE,
+    soc_max         DOUBLE
+);
\ No newline at end of file
@@ -0,0 +1,2 @@
+INSERT OR IGNORE INTO match_status (traj_id, status)
+    SELECT traj_id, 'pending' FROM trajectory;
\ No newline at end of file
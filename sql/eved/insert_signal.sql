@@ -34,11 +34,17 @@ INSERT INTO signal (
     intersection,
     bus_stop,
     focus_points,
-    h3_12
+    h3_12,
+    step_m,
+    cum_m,
+    heading_deg,
+    dt_ms,
+    accel_mps2
     )
 VALUES (
     ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
     ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
     ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
-    ?, ?, ?, ?, ?, ?
+    ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+    ?
 );
@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from os import path
+from typing import Dict
+
+from src.bench.stub_valhalla import StubValhalla
+from src.bench.synthetic import generate_signals_zip, generate_vehicles_xlsx
+from src.build.nodes import build_nodes, decode_polyline
+from src.build.signals import SIGNALS_ZIP, import_signals, import_vehicles, update_trajectories
+from src.common import polyline
+from src.config import load_config
+from src.db.EvedDb import EvedDb
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="eVED database build benchmark")
+    parser.add_argument("--files", type=int, default=4, help="number of CSV files in the zip")
+    parser.add_argument("--vehicles", type=int, default=10, help="number of vehicles")
+    parser.add_argument("--trips", type=int, default=5, help="trips per vehicle and file")
+    parser.add_argument("--points", type=int, default=500, help="signals per trip")
+    parser.add_argument("--workers", type=int, default=1, help="signal parsing processes")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent map-matching requests")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub trace_route latency in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="random generator seed")
+    parser.add_argument("--workdir", default=None, help="keep the generated files in this folder")
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    return parser
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * scale
+
+
+def database_size(db_name: str) -> int:
+    return sum(path.getsize(f) for f in (db_name, f"{db_name}-wal") if path.exists(f))
+
+
+def write_config(workdir: str, valhalla_url: str, concurrency: int) -> str:
+    filename = path.join(workdir, "config.toml")
+    with open(filename, "w") as f:
+        f.write(f"""[database]
+folder={json.dumps(workdir)}
+eved="eved.db"
+
+[data]
+folder={json.dumps(path.join(workdir, "data"))}
+
+[valhalla]
+url={json.dumps(valhalla_url)}
+timeout=60
+retries=3
+backoff=0.1
+concurrency={concurrency}
+""")
+    return filename
+
+
+class Report:
+    def __init__(self):
+        self.stages: Dict[str, Dict] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        stats = {}
+        started = time.perf_counter()
+        yield stats
+        seconds = time.perf_counter() - started
+
+        stats["seconds"] = seconds
+        for unit in ("rows", "trajectories", "points"):
+            if unit in stats:
+                stats[f"{unit}_per_s"] = stats[unit] / seconds if seconds > 0 else None
+        stats["peak_rss_bytes"] = peak_rss_bytes()
+        self.stages[name] = stats
+
+
+def run_benchmark(args: argparse.Namespace, workdir: str) -> Dict:
+    report = Report()
+    data_folder = path.join(workdir, "data")
+    os.makedirs(data_folder, exist_ok=True)
+
+    with report.stage("generate") as stats:
+        stats["rows"] = generate_signals_zip(path.join(data_folder, SIGNALS_ZIP),
+                                             n_files=args.files,
+                                             n_vehicles=args.vehicles,
+                                             trips_per_file=args.trips,
+                                             points_per_trip=args.points,
+                                             seed=args.seed)
+        generate_vehicles_xlsx(data_folder, args.vehicles)
+
+    with StubValhalla(latency=args.latency) as stub:
+        os.environ["EVED_CONFIG"] = write_config(workdir, stub.url, args.concurrency)
+        load_config.cache_clear()
+        db = EvedDb()
+
+        with report.stage("import_signals") as stats:
+            with db.bulk_load():
+                import_vehicles(db)
+                import_signals(db, workers=args.workers)
+            stats["rows"] = db.query_scalar("SELECT COUNT(*) FROM signal")
+
+        db.create_trajectories()
+        with report.stage("update_trajectories") as stats:
+            update_trajectories()
+            stats["trajectories"] = db.query_scalar("SELECT COUNT(*) FROM trajectory")
+
+        encoded = [polyline.encode(db.get_trajectory(traj_id)[["match_latitude", "match_longitude"]].to_numpy())
+                   for traj_id in db.get_trajectories()["traj_id"].tolist()]
+        with report.stage("decode_polyline") as stats:
+            stats["points"] = sum(len(decode_polyline(shape)) for shape in encoded)
+
+        with report.stage("build_nodes") as stats:
+            build_nodes(concurrency=args.concurrency)
+            stats["trajectories"] = db.query_scalar("SELECT COUNT(DISTINCT traj_id) FROM node")
+            stats["rows"] = db.query_scalar("SELECT COUNT(*) FROM node")
+
+        db_size = database_size(db.db_name)
+
+    return {
+        "params": vars(args),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "stages": report.stages,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "db_size_bytes": db_size,
+    }
+
+
+def main():
+    args = get_argument_parser().parse_args()
+
+    if args.workdir is not None:
+        os.makedirs(args.workdir, exist_ok=True)
+        result = run_benchmark(args, path.abspath(args.workdir))
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            result = run_benchmark(args, workdir)
+
+    text = json.dumps(result, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
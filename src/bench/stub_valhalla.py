@@ -0,0 +1,66 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict
+
+from src.common import polyline
+
+
+class TraceRouteHandler(BaseHTTPRequestHandler):
+    """
+    Emulates Valhalla's trace_route by echoing the input shape back as the
+    encoded polyline of a single leg, or answers with Valhalla's 400 error
+    for the requests selected by the server's fail predicate
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length))
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+
+        if self.server.fail is not None and self.server.fail(request):
+            status = 400
+            body = json.dumps({"error_code": 442, "error": "No path could be found for input",
+                               "status_code": 400, "status": "Bad Request"}).encode("utf-8")
+        else:
+            status = 200
+            shape = polyline.encode([(p["lat"], p["lon"]) for p in request["shape"]])
+            body = json.dumps({"trip": {"legs": [{"shape": shape}]}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubValhalla:
+    """
+    Local HTTP server on a free port, usable as a context manager
+    """
+
+    def __init__(self, latency: float = 0.0, fail: Callable[[Dict], bool] | None = None):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), TraceRouteHandler)
+        self._server.daemon_threads = True
+        self._server.latency = latency
+        self._server.fail = fail
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StubValhalla":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
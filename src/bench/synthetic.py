@@ -0,0 +1,143 @@
+import io
+from os import path
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import numpy as np
+import pandas as pd
+
+
+SIGNAL_COLUMNS = [
+    "DayNum",
+    "VehId",
+    "Trip",
+    "Timestamp(ms)",
+    "Latitude[deg]",
+    "Longitude[deg]",
+    "Vehicle Speed[km/h]",
+    "MAF[g/sec]",
+    "Engine RPM[RPM]",
+    "Absolute Load[%]",
+    "OAT[DegC]",
+    "Fuel Rate[L/hr]",
+    "Air Conditioning Power[kW]",
+    "Air Conditioning Power[Watts]",
+    "Heater Power[Watts]",
+    "HV Battery Current[A]",
+    "HV Battery SOC[%]",
+    "HV Battery Voltage[V]",
+    "Short Term Fuel Trim Bank 1[%]",
+    "Short Term Fuel Trim Bank 2[%]",
+    "Long Term Fuel Trim Bank 1[%]",
+    "Long Term Fuel Trim Bank 2[%]",
+    "Elevation Raw[m]",
+    "Elevation Smoothed[m]",
+    "Gradient",
+    "Energy_Consumption",
+    "Matchted Latitude[deg]",
+    "Matched Longitude[deg]",
+    "Match Type",
+    "Class of Speed Limit",
+    "Speed Limit[km/h]",
+    "Speed Limit with Direction[km/h]",
+    "Intersection",
+    "Bus Stops",
+    "Focus Points",
+]
+
+# Ann Arbor, where the VED data was collected
+ORIGIN = (42.2808, -83.7430)
+
+
+def generate_trip(rng: np.random.Generator,
+                  vehicle_id: int,
+                  trip_id: int,
+                  day_num: float,
+                  n_points: int) -> pd.DataFrame:
+    speed = np.clip(rng.normal(45.0, 15.0, n_points), 0.0, 110.0)
+    heading = np.cumsum(rng.normal(0.0, 0.1, n_points)) + rng.uniform(0, 2 * np.pi)
+    step_deg = speed / 3.6 / 111_320.0
+    lats = ORIGIN[0] + rng.normal(0, 0.05) + np.cumsum(step_deg * np.cos(heading))
+    lngs = ORIGIN[1] + rng.normal(0, 0.05) + np.cumsum(step_deg * np.sin(heading) / np.cos(np.radians(ORIGIN[0])))
+    time_stamps = np.arange(n_points, dtype=np.int64) * 1000
+    noise = rng.normal(0, 5e-5, (2, n_points))
+
+    df = pd.DataFrame({name: np.full(n_points, np.nan) for name in SIGNAL_COLUMNS})
+    df["DayNum"] = day_num + time_stamps / 86_400_000.0
+    df["VehId"] = vehicle_id
+    df["Trip"] = trip_id
+    df["Timestamp(ms)"] = time_stamps
+    df["Latitude[deg]"] = lats + noise[0]
+    df["Longitude[deg]"] = lngs + noise[1]
+    df["Vehicle Speed[km/h]"] = speed
+    df["MAF[g/sec]"] = rng.uniform(1, 30, n_points)
+    df["Engine RPM[RPM]"] = rng.uniform(700, 3000, n_points)
+    df["Absolute Load[%]"] = rng.uniform(10, 80, n_points)
+    df["OAT[DegC]"] = rng.normal(10, 5)
+    df["Fuel Rate[L/hr]"] = rng.uniform(0, 10, n_points)
+    df["HV Battery SOC[%]"] = np.linspace(90, 90 - rng.uniform(0, 20), n_points)
+    df["Elevation Raw[m]"] = rng.normal(260, 5, n_points)
+    df["Elevation Smoothed[m]"] = df["Elevation Raw[m]"].rolling(5, min_periods=1).mean()
+    df["Gradient"] = rng.normal(0, 0.01, n_points)
+    df["Energy_Consumption"] = rng.uniform(0, 0.01, n_points)
+    df["Matchted Latitude[deg]"] = lats
+    df["Matched Longitude[deg]"] = lngs
+    df["Match Type"] = 0
+    df["Class of Speed Limit"] = rng.integers(1, 6, n_points)
+    df["Speed Limit[km/h]"] = rng.choice(["40", "56", "72", "40;56"], n_points)
+    df["Speed Limit with Direction[km/h]"] = rng.choice([40.0, 56.0, 72.0], n_points)
+    df["Intersection"] = (rng.random(n_points) < 0.02).astype(float)
+    df["Bus Stops"] = (rng.random(n_points) < 0.01).astype(float)
+    df["Focus Points"] = np.where(rng.random(n_points) < 0.01, "traffic signals", "")
+    return df
+
+
+def generate_signals_zip(filename: str,
+                         n_files: int = 4,
+                         n_vehicles: int = 10,
+                         trips_per_file: int = 5,
+                         points_per_trip: int = 500,
+                         seed: int = 0) -> int:
+    """
+    Writes a zip with eVED-formatted CSV files, one per simulated week
+    :param filename: Target zip file name
+    :param n_files: Number of CSV members
+    :param n_vehicles: Number of vehicles
+    :param trips_per_file: Number of trips per vehicle and file
+    :param points_per_trip: Number of signals per trip
+    :param seed: Random generator seed
+    :return: Total number of generated signal rows
+    """
+    rng = np.random.default_rng(seed)
+    rows = 0
+    with ZipFile(filename, "w", compression=ZIP_DEFLATED, allowZip64=True) as zf:
+        for file_num in range(n_files):
+            trips = []
+            for vehicle_id in range(1, n_vehicles + 1):
+                for trip_num in range(trips_per_file):
+                    trip_id = file_num * trips_per_file + trip_num + 1
+                    day_num = 1 + file_num * 7 + trip_num * 7 / trips_per_file
+                    trips.append(generate_trip(rng, vehicle_id, trip_id, day_num, points_per_trip))
+            signal_df = pd.concat(trips, ignore_index=True)
+            rows += len(signal_df)
+
+            # The original files end each line with a semicolon
+            with zf.open(f"eVED_{file_num:03d}_week.csv", "w", force_zip64=True) as f:
+                with io.TextIOWrapper(f, encoding="utf-8", newline="") as text:
+                    signal_df.to_csv(text, index=False, lineterminator=";\n")
+    return rows
+
+
+def generate_vehicles_xlsx(folder: str, n_vehicles: int = 10) -> None:
+    vehicle_df = pd.DataFrame({
+        "VehId": np.arange(1, n_vehicles + 1),
+        "Vehicle Type": ["ICE", "HEV", "PHEV", "EV"] * (n_vehicles // 4) + ["ICE"] * (n_vehicles % 4),
+        "Vehicle Class": "Car",
+        "Engine Configuration & Displacement": "NO DATA",
+        "Transmission": "NO DATA",
+        "Drive Wheels": "NO DATA",
+        "Generalized_Weight": 3500,
+    })
+    is_electric = vehicle_df["Vehicle Type"].isin(["PHEV", "EV"])
+    vehicle_df[~is_electric].to_excel(path.join(folder, "VED_Static_Data_ICE&HEV.xlsx"), index=False)
+    vehicle_df[is_electric].rename(columns={"Vehicle Type": "EngineType"}) \
+        .to_excel(path.join(folder, "VED_Static_Data_PHEV&EV.xlsx"), index=False)
@@ -0,0 +1,8 @@
+from src.db.EvedDb import EvedDb
+
+
+def build_aggregates() -> None:
+    db = EvedDb()
+    db.create_aggregates()
+    refreshed = db.refresh_aggregates()
+    print(f"Refreshed the aggregates of {refreshed} trajectories")
@@ -0,0 +1,6 @@
+from src.db.EvedDb import EvedDb
+
+
+def build_columnar() -> None:
+    db = EvedDb()
+    db.export_columnar()
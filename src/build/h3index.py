@@ -0,0 +1,6 @@
+from src.db.EvedDb import EvedDb
+
+
+def build_h3_index() -> None:
+    db = EvedDb()
+    db.create_h3_index()
@@ -1,43 +1,47 @@
-from typing import List, Tuple
+import hashlib
+import json
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from functools import partial
+from itertools import repeat
+from sqlite3 import Cursor
+from typing import Dict, Iterator, List, NamedTuple, Tuple
 from tqdm import tqdm as tqdm
 
+import numpy as np
 import pandas as pd
-import requests
 
+from src.build.valhalla import MatchBackend, create_backend
+from src.common import polyline
+from src.common.geocodec import ENCODINGS, encode_geometry
+from src.common.h3batch import latlng_to_cells
+from src.common.metrics import metrics
+from src.common.trace import TraceOptions, douglas_peucker, seam_points, split_ranges, stitch, thin
+from src.config import load_config
 from src.db.EvedDb import EvedDb
-import h3.api.numpy_int as h3
-
-
-# decode an encoded string
-def decode_polyline(encoded: str) -> List[Tuple[float, float]]:
-    inv = 1.0 / 1e6
-    decoded = []
-    previous = [0, 0]
-    i = 0
-    # for each byte
-    while i < len(encoded):
-        # for each coord (lat, lon)
-        ll = [0, 0]
-        for j in [0, 1]:
-            shift = 0
-            byte = 0x20
-            # keep decoding bytes until you have this coord
-            while byte >= 0x20:
-                byte = ord(encoded[i]) - 63
-                i += 1
-                ll[j] |= (byte & 0x1f) << shift
-                shift += 5
-            # get the final value adding the previous offset and remember it for the next
-            ll[j] = previous[j] + (~(ll[j] >> 1) if ll[j] & 1 else (ll[j] >> 1))
-            previous[j] = ll[j]
-        # scale by the precision and chop off long coords also flip the positions so
-        # it's the far more standard lon,lat instead of lat,lon
-        decoded.append((float('%.6f' % (ll[0] * inv)), float('%.6f' % (ll[1] * inv))))
-    # hand back the list of coordinates
-    return decoded
-
-
-def map_match(df: pd.DataFrame) -> str:
+
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+STATUS_UNCHANGED = "unchanged"
+
+
+def decode_polyline(encoded: str) -> np.ndarray:
+    return polyline.decode(encoded)
+
+
+def get_match_backend(pool_size: int | None = None) -> MatchBackend:
+    return create_backend(load_config().get("valhalla", {}), pool_size)
+
+
+def get_shape(df: pd.DataFrame) -> List[Dict]:
+    # Same records as df.to_dict(orient="records"), built from plain lists
+    columns = df.columns.tolist()
+    return [dict(zip(columns, row)) for row in zip(*(df[name].tolist() for name in columns))]
+
+
+def get_match_param(df: pd.DataFrame) -> Dict:
     param = {
         "use_timestamps": False,
         "shape_match": "map_snap",
@@ -48,7 +52,7 @@ def map_match(df: pd.DataFrame) -> str:
         # "directions_options": {
         #     "directions_type": "none"
         # },
-        "shape": df.to_dict(orient="records"),
+        "shape": get_shape(df),
         # "linear_references": True,
         "trace_options": {
             "search_radius": 100,
@@ -58,20 +62,13 @@ def map_match(df: pd.DataFrame) -> str:
             # "turn_penalty_factor": 1
         },
     }
-    url = "http://localhost:8002/trace_route"
-    headers = {'Content-type': 'application/json'}
-    r = requests.post(url, json=param, headers=headers)
-    if r.status_code != 200:
-        raise RuntimeError(
-            f"Error while calling Valhalla API: {r.status_code} - {r.text}"
-        )
-    route = r.json()
-    return route["trip"]["legs"][0]["shape"]
-
-
-def get_trajectories() -> pd.DataFrame:
-    db = EvedDb()
-    return db.get_trajectories()
+    return param
+
+
+def get_request_hash(param: Dict) -> bytes:
+    # Canonical JSON, so the same shape and options always hash the same
+    payload = json.dumps(param, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).digest()
 
 
 def load_trajectory_points(traj_id: int) -> pd.DataFrame:
@@ -90,40 +87,312 @@ def load_trajectory_points(traj_id: int) -> pd.DataFrame:
     return db.query_df(sql, [traj_id]).sort_values(by=["time"])
 
 
-def insert_nodes(traj_id: int, nodes: List[Tuple[float, float]]) -> None:
-    db = EvedDb()
-    sql = "insert into node (traj_id, latitude, longitude, h3_12) values (?, ?, ?, ?)"
-    params = [(traj_id, lat, lon, h3.latlng_to_cell(lat, lon, 12))
-              for (lat, lon) in nodes
-              if lat is not None and lon is not None]
-    db.execute_sql(sql, params, many=True)
+def get_trace_options() -> TraceOptions:
+    matching = load_config().get("matching", {})
+    options = TraceOptions(**{name: matching[name] for name in TraceOptions._fields if name in matching})
 
+    # Stitching cuts each pair of chunks inside their overlap, searching only
+    # the second half of one and the first half of the other, so the
+    # overlap must exist and fit in half a chunk
+    if options.max_points < 2:
+        raise ValueError(f"max_points must be at least 2, got {options.max_points}")
+    if not 1 <= options.overlap < options.max_points // 2:
+        raise ValueError(f"overlap must be at least 1 and less than max_points // 2 "
+                         f"({options.max_points // 2}), got {options.overlap}")
+    return options
 
-def insert_error(traj_id: int,
-                 error: str) -> None:
-    db = EvedDb()
 
-    sql = "insert into node (traj_id, match_error) values (?, ?)"
-    db.execute_sql(sql, [traj_id, error])
+def simplify_trajectory_points(points_df: pd.DataFrame, options: TraceOptions) -> pd.DataFrame:
+    if options.simplify == "none":
+        return points_df
+
+    lats = points_df["lat"].to_numpy(dtype=np.float64)
+    lons = points_df["lon"].to_numpy(dtype=np.float64)
+    if options.simplify == "thin":
+        keep = thin(lats, lons, points_df["time"].to_numpy(dtype=np.float64),
+                    options.min_distance_m, options.max_interval_s)
+    elif options.simplify == "douglas_peucker":
+        keep = douglas_peucker(lats, lons, options.tolerance_m)
+    else:
+        raise ValueError(f"Unknown simplification method: {options.simplify}")
+    return points_df.iloc[keep]
+
+
+NODE_INSERT_SQL = "insert into node (traj_id, latitude, longitude, h3_12) values (?, ?, ?, ?)"
+ERROR_INSERT_SQL = "insert into node (traj_id, match_error) values (?, ?)"
+STATUS_UPSERT_SQL = """
+insert or replace into match_status (traj_id, status, input_hash, updated_at)
+values (?, ?, ?, datetime('now'))
+"""
+GEOMETRY_UPSERT_SQL = """
+insert or replace into node_geometry (traj_id, encoding, point_count, geometry, match_error)
+values (?, ?, ?, ?, ?)
+"""
+GEOMETRY_CELL_INSERT_SQL = "insert or ignore into node_geometry_h3 (h3_12, traj_id) values (?, ?)"
+MATCH_CACHE_UPSERT_SQL = """
+insert or replace into match_cache (request_hash, version, shape, created_at)
+values (?, ?, ?, datetime('now'))
+"""
+
+
+class MatchResult(NamedTuple):
+    traj_id: int
+    status: str
+    input_hash: str | None = None
+    nodes: np.ndarray | None = None
+    error: str | None = None
+    responses: List[Tuple[bytes, str]] | None = None
+
+
+def node_rows(traj_id: int, nodes: np.ndarray) -> Iterator[Tuple[int, float, float, int]]:
+    points = np.asarray(nodes, dtype=np.float64).reshape(-1, 2)
+    points = points[~np.isnan(points).any(axis=1)]
+    h3_12 = latlng_to_cells(points[:, 0], points[:, 1], 12)
+    return zip(repeat(traj_id), points[:, 0].tolist(), points[:, 1].tolist(), h3_12.tolist())
+
+
+def write_geometry(cur: Cursor, traj_id: int, nodes: np.ndarray, encoding: str) -> None:
+    points = np.asarray(nodes, dtype=np.float64).reshape(-1, 2)
+    points = points[~np.isnan(points).any(axis=1)]
+    cells = np.unique(latlng_to_cells(points[:, 0], points[:, 1], 12))
+    cur.execute(GEOMETRY_UPSERT_SQL,
+                [traj_id, encoding, len(points), encode_geometry(points, encoding), None])
+    cur.executemany(GEOMETRY_CELL_INSERT_SQL, zip(cells.tolist(), repeat(traj_id)))
+
+
+def get_input_hash(points_df: pd.DataFrame,
+                   options: TraceOptions,
+                   cache_version: str | None = None) -> str:
+    # Also covers the trace options, the match parameters and the Valhalla
+    # version, so changing any of them re-matches unchanged points
+    settings = {
+        "options": options._asdict(),
+        "param": get_match_param(points_df.iloc[:0]),
+        "version": cache_version,
+    }
+    digest = hashlib.sha1(points_df.to_numpy().tobytes())
+    digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
 
+def match_shape(points_df: pd.DataFrame,
+                client: MatchBackend,
+                cache_version: str | None,
+                responses: List[Tuple[bytes, str]]) -> np.ndarray:
+    param = get_match_param(points_df)
+    request_hash = None
+    geometry = None
+    if cache_version is not None:
+        request_hash = get_request_hash(param)
+        geometry = EvedDb().get_cached_match(request_hash, cache_version)
+        metrics.add("match_cache_hit" if geometry is not None else "match_cache_miss")
 
-def build_nodes() -> None:
+    if geometry is None:
+        with metrics.span("http_match", rows=len(points_df)):
+            geometry = client.trace_route(param)
+        if request_hash is not None:
+            responses.append((request_hash, geometry))
+
+    with metrics.span("decode") as span:
+        nodes = decode_polyline(geometry) #[1:-1]
+        span.rows = len(nodes)
+    return nodes
+
+
+def match_trajectory(traj_id: int,
+                     client: MatchBackend,
+                     known_hash: str | None = None,
+                     cache_version: str | None = None,
+                     options: TraceOptions | None = None) -> MatchResult:
+    """
+    Map-matches one trajectory, looking the request up in the response cache
+    first when cache_version is set. New responses are returned in the
+    result, so the writer thread stores them with the nodes.
+    """
+    if options is None:
+        options = TraceOptions()
+
+    input_hash = None
+    try:
+        points_df = load_trajectory_points(traj_id)
+        with metrics.span("simplify", rows=len(points_df)):
+            points_df = simplify_trajectory_points(points_df, options)
+        input_hash = get_input_hash(points_df, options, cache_version)
+        if input_hash == known_hash:
+            return MatchResult(traj_id, STATUS_UNCHANGED, input_hash)
+
+        # Long traces are matched in overlapping chunks and stitched back
+        responses = []
+        ranges = split_ranges(len(points_df), options.max_points, options.overlap)
+        parts = [match_shape(points_df.iloc[start:end], client, cache_version, responses)
+                 for start, end in ranges]
+        if len(parts) == 1:
+            nodes = parts[0]
+        else:
+            seams = seam_points(points_df[["lat", "lon"]].to_numpy(dtype=np.float64), ranges)
+            nodes = stitch(parts, seams)
+        return MatchResult(traj_id, STATUS_DONE, input_hash, nodes=nodes, responses=responses)
+    except RuntimeError as e:
+        return MatchResult(traj_id, STATUS_ERROR, input_hash, error=str(e))
+
+
+def match_trajectories(traj_ids: List[int],
+                       known_hashes: Dict[int, str],
+                       client: MatchBackend,
+                       concurrency: int,
+                       cache_version: str | None = None,
+                       options: TraceOptions | None = None) -> Iterator[MatchResult]:
+    # Keep at most 2 * concurrency trajectories in flight, so results do not
+    # pile up in memory when the writer is slower than Valhalla.
+    max_pending = 2 * concurrency
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        for traj_id in traj_ids:
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(match_trajectory, traj_id, client,
+                                        known_hashes.get(traj_id), cache_version, options))
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def write_result(cur: Cursor,
+                 result: MatchResult,
+                 cache_version: str | None = None,
+                 encoding: str | None = None) -> None:
+    # Runs on the group writer, so the nodes and the status of a trajectory
+    # are committed together and a crash never leaves a trajectory marked
+    # done without its nodes. With an encoding, the nodes are stored as one
+    # geometry row per trajectory instead of one row per node.
+    if result.status == STATUS_UNCHANGED:
+        return
+
+    with metrics.span("node_insert", rows=1):
+        if encoding is None:
+            cur.execute("delete from node where traj_id = ?", [result.traj_id])
+            if result.error is not None:
+                cur.execute(ERROR_INSERT_SQL, [result.traj_id, result.error])
+            elif result.nodes is not None:
+                cur.executemany(NODE_INSERT_SQL, node_rows(result.traj_id, result.nodes))
+        else:
+            cur.execute("delete from node_geometry_h3 where traj_id = ?", [result.traj_id])
+            if result.error is not None:
+                cur.execute(GEOMETRY_UPSERT_SQL, [result.traj_id, encoding, 0, None, result.error])
+            elif result.nodes is not None:
+                write_geometry(cur, result.traj_id, result.nodes, encoding)
+        cur.execute(STATUS_UPSERT_SQL,
+                    [result.traj_id, result.status, result.input_hash])
+        if cache_version is not None and result.responses:
+            cur.executemany(MATCH_CACHE_UPSERT_SQL,
+                            [(request_hash, cache_version, zlib.compress(geometry.encode("ascii")))
+                             for request_hash, geometry in result.responses])
+
+
+def get_pending_trajectories(db: EvedDb,
+                             resume: bool,
+                             retry_errors: bool) -> Tuple[List[int], Dict[int, str]]:
+    status_df = db.get_match_status()
+    if retry_errors:
+        status_df = status_df[status_df["status"] == STATUS_ERROR]
+    elif resume:
+        # Done trajectories are rechecked against the hash of their input
+        # points and only rematched when the points changed
+        status_df = status_df[status_df["status"] != STATUS_ERROR]
+
+    done_df = status_df[status_df["status"] == STATUS_DONE]
+    known_hashes = dict(zip(done_df["traj_id"].tolist(), done_df["input_hash"].tolist()))
+    return status_df["traj_id"].to_list(), known_hashes
+
+
+def build_nodes(concurrency: int | None = None,
+                resume: bool = False,
+                retry_errors: bool = False,
+                checkpoint: int | None = None,
+                commit_interval: float | None = None,
+                clear_cache: bool = False) -> None:
     db = EvedDb()
+    config = load_config()
+    valhalla = config.get("valhalla", {})
 
-    if not db.table_exists("node"):
+    # Matched nodes are stored one row per node, or as one encoded geometry
+    # per trajectory
+    storage = config.get("nodes", {}).get("storage", "rows")
+    encoding = None
+    if storage == "geometry":
+        encoding = config.get("nodes", {}).get("encoding", "delta")
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown geometry encoding: {encoding}")
+        if not db.table_exists("node_geometry"):
+            db.create_node_geometry()
+    elif storage != "rows":
+        raise ValueError(f"Unknown node storage: {storage}")
+    elif not db.table_exists("node"):
         db.create_node()
-    else:
+    if not db.table_exists("match_status"):
+        db.create_match_status()
+
+    # Responses of other Valhalla versions or tile sets are never reused
+    cache_version = None
+    if valhalla.get("cache", True):
+        cache_version = str(valhalla.get("cache_version", ""))
+        if not db.table_exists("match_cache"):
+            db.create_match_cache()
+        db.invalidate_match_cache(keep_version=None if clear_cache else cache_version)
+
+    if not resume and not retry_errors:
         db.delete_node()
+        db.init_match_status(reset=True)
+    else:
+        db.prune_match_status()
+        db.init_match_status()
+
+    if concurrency is None:
+        concurrency = valhalla.get("concurrency", 4)
+    if checkpoint is None:
+        checkpoint = config.get("nodes", {}).get("checkpoint", 100)
+    if commit_interval is None:
+        commit_interval = config.get("nodes", {}).get("commit_interval", 2.0)
+    client = get_match_backend(concurrency)
+    # The metrics are process-wide, so only this run's hits are reported
+    cache_counts = get_cache_counts()
+    try:
+        traj_ids, known_hashes = get_pending_trajectories(db, resume, retry_errors)
+        results = match_trajectories(traj_ids, known_hashes, client, concurrency,
+                                     cache_version, get_trace_options())
+
+        # The group writer is the only writer; the workers only read and call
+        # Valhalla. Trajectories are committed every checkpoint results or
+        # commit_interval seconds, whichever comes first.
+        matched = []
+        with db.group_commit(max_rows=checkpoint, max_delay=commit_interval,
+                             max_pending=4 * concurrency) as writer:
+            for result in tqdm(results, total=len(traj_ids)):
+                if result.error is not None:
+                    print(result.error)
+                if result.status != STATUS_UNCHANGED:
+                    matched.append(result.traj_id)
+                writer.call(partial(write_result, result=result, cache_version=cache_version, encoding=encoding))
+    finally:
+        db.invalidate_cache(["node", "node_geometry"])
+        client.close()
+
+    # Keeps the cell and ring queries in step with the new nodes
+    db.refresh_h3_index(matched)
+
+    if cache_version is not None:
+        print_cache_stats(cache_counts)
+
+
+def get_cache_counts() -> Tuple[int, int]:
+    stages = metrics.summary()
+    return (stages.get("match_cache_hit", {}).get("calls", 0),
+            stages.get("match_cache_miss", {}).get("calls", 0))
+
 
-    traj_df = get_trajectories()
-    for traj_id in tqdm(traj_df["traj_id"].to_list()):
-        try:
-            traj_df = load_trajectory_points(traj_id)
-            geometry = map_match(traj_df)
-
-            if geometry is not None:
-                nodes = decode_polyline(geometry) #[1:-1]
-                insert_nodes(traj_id, nodes)
-        except RuntimeError as e:
-            insert_error(traj_id, str(e))
-            print(e)
+def print_cache_stats(since: Tuple[int, int] = (0, 0)) -> None:
+    hits, misses = get_cache_counts()
+    hits, misses = hits - since[0], misses - since[1]
+    if hits + misses > 0:
+        print(f"Match cache: {hits} hits, {misses} misses ({100.0 * hits / (hits + misses):.1f}% hit rate)")
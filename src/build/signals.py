@@ -1,27 +1,44 @@
-from typing import Tuple
+import json
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Sequence, Set, Tuple
 
 import numpy as np
 import pandas as pd
 
-from os import remove
+from pandas.io.parsers import TextFileReader
 from zipfile import ZipFile
 from tqdm import tqdm
 from datetime import datetime, timedelta
 from pytz import timezone
-from src.common.geomath import vec_haversine
+from src.common.geomath import cumulative_distances, segment_bearings, segment_deltas, segment_distances
+from src.common.h3batch import cells_to_parent, latlng_to_cells
+from src.common.metrics import metrics
+from src.common.streams import open_stripped
+from src.config import get_data_path
+from src.db.api import read_sql_file
 from src.db.EvedDb import EvedDb
-import h3.api.numpy_int as h3
+from src.db.h3index import get_parent_resolutions, h3_column
 
 
-def remove_semi_colon(filename: str) -> None:
-    with open(filename, "r") as f:
-        data = f.read()
-    data = data.replace(";", "")
-    with open(filename, "w") as f:
-        f.write(data)
+SIGNALS_ZIP = "eVED.zip"
+CHUNK_SIZE = 250_000
+SIGNAL_INDEXES = ["ix_signal_vehicle_trip", "ix_signal_h3_12"]
+# Appends of at least this fraction of the already loaded bytes rebuild the
+# signal indexes instead of maintaining them row by row
+INDEX_REBUILD_RATIO = 0.5
+MANIFEST_UPSERT_SQL = """
+insert or replace into signal_manifest (member, file_size, crc, rows, first_signal_id, last_signal_id, loaded_at)
+values (?, ?, ?, ?, ?, ?, datetime('now'))
+"""
+KINEMATICS_SOURCES = ["VehId", "Trip", "Timestamp(ms)",
+                      "Matchted Latitude[deg]", "Matched Longitude[deg]", "Vehicle Speed[km/h]"]
 
 
-def read_csv(filename: str) -> pd.DataFrame:
+def read_csv(filepath_or_buffer,
+             chunksize: int | None = None) -> pd.DataFrame | TextFileReader:
     columns = [
         "DayNum",
         "VehId",
@@ -94,34 +111,98 @@ def read_csv(filename: str) -> pd.DataFrame:
         "Bus Stops": float,
         "Focus Points": str,
     }
-    df = pd.read_csv(filepath_or_buffer=filename,
+    df = pd.read_csv(filepath_or_buffer=filepath_or_buffer,
                      usecols=np.array(columns),
-                     dtype=types)
+                     dtype=types,
+                     chunksize=chunksize)
     return df
 
 
-def get_trajectory_properties(traj_id: int) -> Tuple[float, float, datetime, datetime, int, int, int]:
-    db = EvedDb()
-    traj_df = db.get_trajectory(traj_id)
-    points = traj_df[["match_latitude", "match_longitude"]].values
-    length_m = vec_haversine(points[:-1, 0], points[:-1, 1],
-                             points[1:, 0], points[1:, 1]).sum()
+def signal_datetime(day_num: float, time_stamp: int) -> datetime:
     base_dt = datetime(year=2017, month=11, day=1, tzinfo=timezone("America/Detroit"))
-    day_num = traj_df["day_num"].iloc[0]
-    dt_ini = base_dt + timedelta(days=day_num - 1) + timedelta(milliseconds=int(traj_df["time_stamp"].iloc[0]))
-    dt_end = base_dt + timedelta(days=day_num - 1) + timedelta(milliseconds=int(traj_df["time_stamp"].iloc[-1]))
-    h3_ini = h3.latlng_to_cell(traj_df["match_latitude"].iloc[0], traj_df["match_longitude"].iloc[0], 12)
-    h3_end = h3.latlng_to_cell(traj_df["match_latitude"].iloc[-1], traj_df["match_longitude"].iloc[-1], 12)
-    return length_m, (dt_end - dt_ini).total_seconds(), dt_ini, dt_end, int(h3_ini), int(h3_end), traj_id
+    return base_dt + timedelta(days=day_num - 1) + timedelta(milliseconds=int(time_stamp))
+
+
+def get_trajectory_starts(vehicle_ids: np.ndarray, trip_ids: np.ndarray) -> np.ndarray:
+    is_start = np.ones(len(vehicle_ids), dtype=bool)
+    is_start[1:] = (vehicle_ids[1:] != vehicle_ids[:-1]) | (trip_ids[1:] != trip_ids[:-1])
+    return np.flatnonzero(is_start)
+
+
+def get_trajectories_properties(signals: Dict[str, np.ndarray],
+                                traj_df: pd.DataFrame) -> List[Tuple[float, float, datetime, datetime, int, int, int]]:
+    # The signals must be sorted by (vehicle_id, trip_id, time_stamp), so each
+    # trajectory is a contiguous segment of the arrays.
+    vehicle_ids = np.asarray(signals["vehicle_id"])
+    trip_ids = np.asarray(signals["trip_id"])
+    day_nums = np.asarray(signals["day_num"])
+    time_stamps = np.asarray(signals["time_stamp"])
+    lats = np.asarray(signals["match_latitude"])
+    lngs = np.asarray(signals["match_longitude"])
+
+    n = len(vehicle_ids)
+    if n == 0:
+        return []
+
+    starts = get_trajectory_starts(vehicle_ids, trip_ids)
+    ends = np.append(starts[1:], n) - 1
 
+    steps = segment_distances(lats, lngs, starts)
+    lengths = np.add.reduceat(steps, starts)
 
-def update_trajectories() -> None:
+    durations = (time_stamps[ends] - time_stamps[starts]) / 1000.0
+    h3_ini = latlng_to_cells(lats[starts], lngs[starts], 12)
+    h3_end = latlng_to_cells(lats[ends], lngs[ends], 12)
+
+    keys = pd.DataFrame({"vehicle_id": vehicle_ids[starts], "trip_id": trip_ids[starts]})
+    traj_ids = keys.merge(traj_df[["vehicle_id", "trip_id", "traj_id"]],
+                          on=["vehicle_id", "trip_id"], how="left")["traj_id"]
+
+    props = []
+    for i, traj_id in enumerate(traj_ids.tolist()):
+        if pd.isna(traj_id):
+            continue
+        start, end = starts[i], ends[i]
+        props.append((float(lengths[i]),
+                      float(durations[i]),
+                      signal_datetime(day_nums[start], time_stamps[start]),
+                      signal_datetime(day_nums[start], time_stamps[end]),
+                      int(h3_ini[i]),
+                      int(h3_end[i]),
+                      int(traj_id)))
+    return props
+
+
+def update_trajectories(pairs: Iterable[Tuple[int, int]] | None = None) -> None:
+    with metrics.span("trajectory_update") as span:
+        props = get_all_trajectories_properties(pairs)
+        span.rows = len(props)
+        write_trajectories_properties(props)
+
+
+def get_all_trajectories_properties(
+        pairs: Iterable[Tuple[int, int]] | None = None) -> List[Tuple[float, float, datetime, datetime, int, int, int]]:
     db = EvedDb()
-    df = db.get_trajectories()
-    trajectories = df["traj_id"].tolist()
+    traj_df = db.get_trajectories()
+
+    # The scan is streamed in chunks. The last trajectory of each chunk may
+    # continue in the next one, so it is carried over.
+    props = []
+    carry = None
+    for chunk in db.iter_trajectory_signals(pairs=None if pairs is None else list(pairs)):
+        if carry is not None:
+            chunk = {name: np.concatenate((carry[name], values)) for name, values in chunk.items()}
+        cut = get_trajectory_starts(chunk["vehicle_id"], chunk["trip_id"])[-1]
+        props.extend(get_trajectories_properties({name: values[:cut] for name, values in chunk.items()},
+                                                 traj_df))
+        carry = {name: values[cut:] for name, values in chunk.items()}
+    if carry is not None:
+        props.extend(get_trajectories_properties(carry, traj_df))
+    return props
 
-    props = [get_trajectory_properties(traj_id) for traj_id in tqdm(trajectories)]
 
+def write_trajectories_properties(props: List[Tuple[float, float, datetime, datetime, int, int, int]]) -> None:
+    db = EvedDb()
     sql = """
     UPDATE      trajectory
     SET         length_m = ?
@@ -133,49 +214,286 @@ def update_trajectories() -> None:
     WHERE       traj_id = ?
     """
     db.execute_sql(sql, parameters=props, many=True)
+    db.invalidate_cache(["trajectory"])
 
 
 def import_vehicles(db: EvedDb) -> None:
     if not db.table_exists("vehicle"):
         # Create vehicles
         db.ddl_script("sql/eved/create_vehicle.sql")
-        vehicle_df = pd.concat([pd.read_excel("./data/VED_Static_Data_ICE&HEV.xlsx"),
-                                pd.read_excel("./data/VED_Static_Data_PHEV&EV.xlsx") \
+        vehicle_df = pd.concat([pd.read_excel(get_data_path("VED_Static_Data_ICE&HEV.xlsx")),
+                                pd.read_excel(get_data_path("VED_Static_Data_PHEV&EV.xlsx")) \
                                .rename(columns={"EngineType": "Vehicle Type"})])
         vehicle_df.replace("NO DATA", None)
         vehicles = [tuple(row) for row in vehicle_df.itertuples(index=False)]
         db.insert_vehicles(vehicles)
 
 
-def import_signals(db: EvedDb) -> None:
-    if not db.table_exists("signal"):
-        # Create signals
-        db.ddl_script("sql/eved/create_signal.sql")
-        with ZipFile("data/eVED.zip", allowZip64=True) as zf:
-            for zip_info in tqdm(list(zf.infolist())):
-                zf.extract(zip_info, "data")
-                remove_semi_colon(f"data/{zip_info.filename}")
+def add_kinematics(signal_df: pd.DataFrame, previous: Dict | None = None) -> Dict:
+    """
+    Adds the step_m, cum_m, heading_deg, dt_ms and accel_mps2 columns, measured
+    from the previous signal of the same trajectory in file order.
+    :param signal_df: Chunk of raw signals, sorted by vehicle, trip and time
+    :param previous: Last signal of the preceding chunk, as returned by the
+        previous call, so trajectories that straddle chunks carry on
+    :return: Last signal of this chunk
+    """
+    arrays = {name: signal_df[name].to_numpy() for name in KINEMATICS_SOURCES}
+    first = 0
+    if previous is not None:
+        arrays = {name: np.concatenate(([previous[name]], array)) for name, array in arrays.items()}
+        first = 1
+
+    vehicle_ids, trip_ids, time_stamps, lats, lngs, speeds = arrays.values()
+    n = len(vehicle_ids)
+    starts = get_trajectory_starts(vehicle_ids, trip_ids)
+
+    step_m = segment_distances(lats, lngs, starts, out=np.empty(n))
+    cum_m = cumulative_distances(step_m, starts, out=np.empty(n))
+    heading_deg = segment_bearings(lats, lngs, starts, out=np.empty(n))
+    heading_deg[step_m == 0.0] = np.nan
+    dt_ms = segment_deltas(time_stamps, starts, out=np.empty(n, dtype=np.int64))
+    dv_mps = segment_deltas(speeds, starts, out=np.empty(n)) / 3.6
+    accel_mps2 = np.divide(dv_mps, dt_ms / 1000.0, out=np.full(n, np.nan), where=dt_ms > 0)
+
+    if previous is not None:
+        first_end = starts[1] if len(starts) > 1 else n
+        cum_m[:first_end] += previous["cum_m"]
+
+    signal_df["step_m"] = step_m[first:]
+    signal_df["cum_m"] = cum_m[first:]
+    signal_df["heading_deg"] = heading_deg[first:]
+    signal_df["dt_ms"] = dt_ms[first:]
+    signal_df["accel_mps2"] = accel_mps2[first:]
 
-                signal_df = read_csv(f"data/{zip_info.filename}")
-                lats = signal_df["Matchted Latitude[deg]"].to_numpy()
-                lngs = signal_df["Matched Longitude[deg]"].to_numpy()
-                h3_12 = [h3.latlng_to_cell(lat, lng, 12) for lat, lng in zip(lats, lngs)]
-                signal_df["h3_12"] = h3_12
-                signals = (row for row in signal_df.itertuples(index=False))
-                db.insert_signals(signals)
+    last = {name: array[-1] for name, array in arrays.items()}
+    last["cum_m"] = cum_m[-1]
+    return last
 
-                remove(f"data/{zip_info.filename}")
 
-        db.ddl_script("sql/eved/create_signal_trip_index.sql")
-        db.ddl_script("sql/eved/create_ix_signal_h3_12.sql")
+def read_member(zf: ZipFile,
+                member: str,
+                chunk_size: int = CHUNK_SIZE,
+                resolutions: Sequence[int] = ()) -> Iterator[pd.DataFrame]:
+    # Decompress straight from the archive and drop the semicolons on the fly,
+    # so memory is bounded by the chunk size and nothing is written to disk.
+    # The parent H3 cells of the given resolutions follow the other columns.
+    with open_stripped(zf.open(member)) as stream:
+        counters = stream.raw
+        previous = None
+        with read_csv(stream, chunksize=chunk_size) as reader:
+            while True:
+                read_seconds, strip_seconds = counters.read_seconds, counters.strip_seconds
+                bytes_read = counters.bytes_read
+                started = time.perf_counter()
+                signal_df = next(reader, None)
+                elapsed = time.perf_counter() - started
 
+                # Decompression and cleaning run inside the parser's reads
+                read_seconds = counters.read_seconds - read_seconds
+                strip_seconds = counters.strip_seconds - strip_seconds
+                bytes_read = counters.bytes_read - bytes_read
+                metrics.add("extract", read_seconds, bytes=bytes_read)
+                metrics.add("clean", strip_seconds, bytes=bytes_read)
+                if signal_df is None:
+                    break
+                metrics.add("parse", elapsed - read_seconds - strip_seconds, rows=len(signal_df))
 
-def build_signals() -> None:
+                with metrics.span("h3", rows=len(signal_df)):
+                    lats = signal_df["Matchted Latitude[deg]"].to_numpy()
+                    lngs = signal_df["Matched Longitude[deg]"].to_numpy()
+                    cells = latlng_to_cells(lats, lngs, 12)
+                    signal_df["h3_12"] = cells
+                    parents = {h3_column(res): cells_to_parent(cells, res) for res in resolutions}
+                with metrics.span("kinematics", rows=len(signal_df)):
+                    previous = add_kinematics(signal_df, previous)
+                for name, values in parents.items():
+                    signal_df[name] = values
+                yield signal_df
+
+
+def load_member(zip_filename: str,
+                member: str,
+                chunk_size: int = CHUNK_SIZE,
+                resolutions: Sequence[int] = ()) -> Tuple[List[pd.DataFrame], Dict]:
+    # Runs in a worker process, so its stage metrics are sent back with the
+    # chunks and merged by the parent
+    metrics.reset()
+    with ZipFile(zip_filename, allowZip64=True) as zf:
+        chunks = list(read_member(zf, member, chunk_size, resolutions))
+    return chunks, metrics.summary()
+
+
+def load_members_parallel(zip_filename: str,
+                          members: List[str],
+                          workers: int,
+                          max_pending: int | None = None,
+                          resolutions: Sequence[int] = ()) -> Iterator[List[pd.DataFrame]]:
+    # Results are handed back in submission order, so the single writer
+    # inserts them exactly as the serial path would (same signal_id sequence).
+    # At most max_pending parsed members are held in memory at any time.
+    if max_pending is None:
+        max_pending = 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for member in members:
+            if len(pending) >= max_pending:
+                chunks, stages = pending.popleft().result()
+                metrics.merge(stages)
+                yield chunks
+            pending.append(executor.submit(load_member, zip_filename, member, CHUNK_SIZE, resolutions))
+        while pending:
+            chunks, stages = pending.popleft().result()
+            metrics.merge(stages)
+            yield chunks
+
+
+def get_pending_members(db: EvedDb, zf: ZipFile) -> List[Tuple[str, int, int, Tuple[int, int] | None]]:
+    """
+    Lists the zip members that are new or changed since they were loaded
+    :return: List of (member, file_size, crc, stale_range) tuples, where
+        stale_range is the signal_id range of a changed member's old rows
+    """
+    manifest = {row.member: row for row in db.get_signal_manifest().itertuples(index=False)}
+    pending = []
+    for zip_info in zf.infolist():
+        loaded = manifest.get(zip_info.filename)
+        stale_range = None
+        if loaded is not None:
+            if loaded.file_size == zip_info.file_size and loaded.crc == zip_info.CRC:
+                continue
+            if loaded.rows > 0:
+                stale_range = (int(loaded.first_signal_id), int(loaded.last_signal_id))
+        pending.append((zip_info.filename, zip_info.file_size, zip_info.CRC, stale_range))
+    return pending
+
+
+def get_drop_indexes(db: EvedDb) -> List[str]:
+    """
+    Lists the signal indexes to drop for the coming load. A first load
+    creates its indexes at the end, and small appends maintain them, so only
+    large appends into an existing rowid signal table drop them.
+    """
+    if db.is_empty() or not db.table_exists("signal_manifest") or db.is_signal_compact():
+        return []
+
+    loaded_bytes = db.query_scalar("SELECT COALESCE(SUM(file_size), 0) FROM signal_manifest")
+    with ZipFile(get_data_path(SIGNALS_ZIP), allowZip64=True) as zf:
+        pending_bytes = sum(file_size for _, file_size, _, _ in get_pending_members(db, zf))
+    return SIGNAL_INDEXES if pending_bytes >= INDEX_REBUILD_RATIO * loaded_bytes else []
+
+
+def get_signal_insert_sql(resolutions: Sequence[int] = ()) -> str:
+    # The parent H3 columns follow the columns of insert_signal.sql
+    sql = read_sql_file("sql/eved/insert_signal.sql")
+    if not resolutions:
+        return sql
+    columns, values = re.fullmatch(r"(.*?)\s*\)\s*VALUES\s*\((.*?)\s*\);?\s*", sql, re.S).groups()
+    names = [h3_column(res) for res in resolutions]
+    return (f"{columns},\n    " + ",\n    ".join(names) + "\n    )\n"
+            f"VALUES (\n    {values.strip()}, {', '.join('?' * len(names))}\n);")
+
+
+def store_member(db: EvedDb,
+                 member: str,
+                 file_size: int,
+                 crc: int,
+                 stale_range: Tuple[int, int] | None,
+                 chunks: Iterable[pd.DataFrame],
+                 resolutions: Sequence[int] = ()) -> Set[Tuple[int, int]]:
+    """
+    Replaces the rows of a zip member and its manifest entry in one
+    transaction, so a crash never leaves a member half loaded
+    :param resolutions: Parent H3 resolutions of the chunks, as given to
+        read_member
+    :return: Set of the (vehicle_id, trip_id) pairs whose signals changed
+    """
+    pairs = set()
+    insert_sql = get_signal_insert_sql(resolutions)
+    with db.transaction() as cur:
+        if stale_range is not None:
+            pairs.update(cur.execute("select distinct vehicle_id, trip_id from signal "
+                                     "where signal_id between ? and ?", stale_range).fetchall())
+            cur.execute("delete from signal where signal_id between ? and ?", stale_range)
+
+        # Rows get consecutive ids past the current maximum, as this is the
+        # only writer
+        first_id = cur.execute(f"select coalesce(max(signal_id), 0) + 1 from {db.get_signal_table()}").fetchone()[0]
+        rows = 0
+        for signal_df in chunks:
+            with metrics.span("insert", rows=len(signal_df)):
+                cur.executemany(insert_sql, signal_df.itertuples(index=False))
+            trips = signal_df[["VehId", "Trip"]].drop_duplicates()
+            pairs.update(zip(trips["VehId"].tolist(), trips["Trip"].tolist()))
+            rows += len(signal_df)
+
+        if rows > 0:
+            cur.execute(MANIFEST_UPSERT_SQL, [member, file_size, crc, rows, first_id, first_id + rows - 1])
+        else:
+            cur.execute(MANIFEST_UPSERT_SQL, [member, file_size, crc, 0, None, None])
+    db.invalidate_cache(["signal"])
+    return pairs
+
+
+def import_signals(db: EvedDb, workers: int = 1) -> Set[Tuple[int, int]]:
+    """
+    Loads the new and changed members of the signals zip file. Members whose
+    size and CRC match the manifest are skipped, so an interrupted or repeated
+    run only loads what is missing.
+    :param db: Target database
+    :param workers: Number of parsing processes
+    :return: Set of the (vehicle_id, trip_id) pairs whose signals changed
+    """
+    if not db.table_exists("signal_manifest") and db.table_exists("signal") \
+            and db.query_scalar("SELECT EXISTS (SELECT 1 FROM signal)"):
+        print("The signal table predates the ingest manifest, drop it to reload the signals")
+        return set()
+
+    db.ddl_script("sql/eved/create_signal.sql")
+    db.create_signal_manifest()
+
+    # Once create_h3_index has added the parent columns, new rows fill them
+    # too. The compact layout's view computes its own.
+    resolutions = [] if db.is_signal_compact() else get_parent_resolutions(db, "signal")
+
+    pairs = set()
+    zip_filename = get_data_path(SIGNALS_ZIP)
+    with ZipFile(zip_filename, allowZip64=True) as zf:
+        pending = get_pending_members(db, zf)
+        members = [member for member, _, _, _ in pending]
+
+        if workers > 1:
+            member_chunks = load_members_parallel(zip_filename, members, workers, resolutions=resolutions)
+        else:
+            member_chunks = (read_member(zf, member, resolutions=resolutions) for member in members)
+
+        for (member, file_size, crc, stale_range), chunks in tqdm(zip(pending, member_chunks),
+                                                                   total=len(pending)):
+            pairs |= store_member(db, member, file_size, crc, stale_range, chunks, resolutions)
+
+    # The compact layout is clustered by trip and indexes its own table
+    if not db.is_signal_compact():
+        with metrics.span("index"):
+            db.ddl_script("sql/eved/create_signal_trip_index.sql")
+            db.ddl_script("sql/eved/create_ix_signal_h3_12.sql")
+    return pairs
+
+
+def build_signals(workers: int = 1) -> None:
     db = EvedDb()
 
-    import_vehicles(db)
-    import_signals(db)
+    with db.bulk_load(drop_indexes=get_drop_indexes(db)):
+        import_vehicles(db)
+        pairs = import_signals(db, workers=workers)
 
     if not db.table_exists("trajectory"):
         db.create_trajectories()
         update_trajectories()
+    elif pairs:
+        traj_ids = db.refresh_trajectories(list(pairs))
+        update_trajectories(pairs)
+        db.refresh_h3_index(traj_ids)
+
+    report = db.migrate_signal_layout()
+    if report is not None:
+        print(json.dumps(report, indent=2))
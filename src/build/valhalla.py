@@ -0,0 +1,144 @@
+import threading
+import time
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.common import polyline
+
+
+class MatchBackend:
+    """
+    Map-matching engine interface. Implementations must be thread-safe and
+    raise RuntimeError when a trace cannot be matched.
+    """
+
+    def trace_route(self, param: Dict) -> str:
+        """
+        Matches a trace
+        :param param: Valhalla trace_route request
+        :return: Encoded polyline of the matched shape
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+def get_route_shape(route: Dict) -> str:
+    return route["trip"]["legs"][0]["shape"]
+
+
+class HttpBackend(MatchBackend):
+    """
+    Thread-safe Valhalla HTTP client with keep-alive connection pooling,
+    per-request timeouts and retries with backoff on 5xx responses
+    """
+
+    def __init__(self,
+                 url: str = "http://localhost:8002",
+                 timeout: float = 60.0,
+                 retries: int = 3,
+                 backoff: float = 0.5,
+                 pool_size: int = 10):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+        retry = Retry(total=retries,
+                      backoff_factor=backoff,
+                      status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(["POST"]),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=pool_size,
+                              max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def trace_route(self, param: Dict) -> str:
+        try:
+            r = self._session.post(f"{self.url}/trace_route",
+                                   json=param,
+                                   timeout=self.timeout)
+        except requests.RequestException as e:
+            raise RuntimeError(f"Error while calling Valhalla API: {e}") from e
+
+        if r.status_code != 200:
+            raise RuntimeError(
+                f"Error while calling Valhalla API: {r.status_code} - {r.text}"
+            )
+        return get_route_shape(r.json())
+
+    def close(self) -> None:
+        self._session.close()
+
+
+class EngineBackend(MatchBackend):
+    """
+    In-process Valhalla engine through the optional pyvalhalla bindings, so
+    requests skip the socket and HTTP round trip. Actors are not thread-safe,
+    so each thread lazily builds its own.
+    """
+
+    def __init__(self, config_file: str):
+        try:
+            from valhalla import Actor
+        except ImportError as e:
+            raise RuntimeError("The engine backend needs pyvalhalla, "
+                               "install it with the 'engine' extra") from e
+
+        self._actor_class = Actor
+        self.config_file = config_file
+        self._local = threading.local()
+
+    def _get_actor(self):
+        actor = getattr(self._local, "actor", None)
+        if actor is None:
+            actor = self._local.actor = self._actor_class(self.config_file)
+        return actor
+
+    def trace_route(self, param: Dict) -> str:
+        try:
+            route = self._get_actor().trace_route(param)
+        except Exception as e:
+            raise RuntimeError(f"Error while calling Valhalla engine: {e}") from e
+        return get_route_shape(route)
+
+
+class FakeBackend(MatchBackend):
+    """
+    Echoes the input shape back as the matched shape, for tests and
+    benchmarks that need neither Valhalla nor a network
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def trace_route(self, param: Dict) -> str:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return polyline.encode([(p["lat"], p["lon"]) for p in param["shape"]])
+
+
+def create_backend(valhalla: Dict, pool_size: int | None = None) -> MatchBackend:
+    """
+    Builds the map-matching backend selected in the [valhalla] config section
+    :param valhalla: The [valhalla] config section
+    :param pool_size: Number of concurrent requests to provision for
+    :return: Backend instance
+    """
+    backend = valhalla.get("backend", "http")
+    if backend == "http":
+        return HttpBackend(url=valhalla.get("url", "http://localhost:8002"),
+                           timeout=valhalla.get("timeout", 60),
+                           retries=valhalla.get("retries", 3),
+                           backoff=valhalla.get("backoff", 0.5),
+                           pool_size=pool_size or valhalla.get("concurrency", 4))
+    if backend == "engine":
+        return EngineBackend(valhalla.get("engine_config", "./valhalla.json"))
+    if backend == "fake":
+        return FakeBackend(valhalla.get("fake_latency", 0.0))
+    raise ValueError(f"Unknown map-matching backend: {backend}")
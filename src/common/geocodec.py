@@ -0,0 +1,45 @@
+import numpy as np
+
+from src.common import polyline
+
+ENCODINGS = ("polyline", "delta")
+
+
+def encode_delta(points: np.ndarray, precision: int = 6) -> bytes:
+    """
+    Encodes a shape as little-endian int32 (lat, lon) pairs, the first one
+    absolute and the others as differences from the previous point
+    :param points: Array-like of (lat, lon) pairs
+    :param precision: Number of decimal places to keep
+    :return: Encoded bytes, eight per point
+    """
+    ints = np.round(np.asarray(points, dtype=np.float64).reshape(-1, 2) * 10.0 ** precision).astype(np.int64)
+    deltas = np.diff(ints, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return deltas.astype("<i4").tobytes()
+
+
+def decode_delta(encoded: bytes, precision: int = 6) -> np.ndarray:
+    """
+    Decodes a shape encoded by encode_delta
+    :param encoded: Encoded bytes
+    :param precision: Number of decimal places of the encoded coordinates
+    :return: Contiguous (n, 2) float64 array of (lat, lon) pairs
+    """
+    deltas = np.frombuffer(encoded, dtype="<i4").reshape(-1, 2)
+    return np.cumsum(deltas, axis=0, dtype=np.int64) / 10.0 ** precision
+
+
+def encode_geometry(points: np.ndarray, encoding: str, precision: int = 6) -> bytes:
+    if encoding == "polyline":
+        return polyline.encode(points, precision).encode("ascii")
+    if encoding == "delta":
+        return encode_delta(points, precision)
+    raise ValueError(f"Unknown geometry encoding: {encoding}")
+
+
+def decode_geometry(encoded: bytes, encoding: str, precision: int = 6) -> np.ndarray:
+    if encoding == "polyline":
+        return polyline.decode(encoded, precision)
+    if encoding == "delta":
+        return decode_delta(encoded, precision)
+    raise ValueError(f"Unknown geometry encoding: {encoding}")
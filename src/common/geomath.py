@@ -4,7 +4,8 @@ import numpy as np
 
 
 def vec_haversine(
-    lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray
+    lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray,
+    out: np.ndarray | None = None
 ) -> np.ndarray:
     """
     Vectorized haversine distance calculation
@@ -12,6 +13,7 @@ def vec_haversine(
     :param lon1: Array of initial longitudes in degrees
     :param lat2: Array of destination latitudes in degrees
     :param lon2: Array of destination longitudes in degrees
+    :param out: Optional output array for the distances
     :return: Array of distances in meters
     """
     earth_radius = 6378137.0
@@ -29,7 +31,7 @@ def vec_haversine(
     )
 
     c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1.0 - a))
-    meters = earth_radius * c
+    meters = np.multiply(c, earth_radius, out=out)
     return meters
 
 
@@ -60,3 +62,101 @@ def num_haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1.0 - a))
     meters = c * earth_radius
     return meters
+
+
+def vec_bearing(
+    lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray,
+    out: np.ndarray | None = None
+) -> np.ndarray:
+    """
+    Vectorized initial bearing calculation
+    :param lat1: Array of initial latitudes in degrees
+    :param lon1: Array of initial longitudes in degrees
+    :param lat2: Array of destination latitudes in degrees
+    :param lon2: Array of destination longitudes in degrees
+    :param out: Optional output array for the bearings
+    :return: Array of bearings in degrees, clockwise from north in [0, 360)
+    """
+    rad_lat1 = np.radians(lat1)
+    rad_lat2 = np.radians(lat2)
+    d_lon = np.radians(lon2) - np.radians(lon1)
+
+    y = np.sin(d_lon) * np.cos(rad_lat2)
+    x = np.cos(rad_lat1) * np.sin(rad_lat2) - np.sin(rad_lat1) * np.cos(rad_lat2) * np.cos(d_lon)
+    degrees = np.degrees(np.arctan2(y, x), out=out)
+    return np.mod(degrees, 360.0, out=degrees)
+
+
+# The segment kernels below work on whole arrays holding several groups
+# (trajectories) back to back. Each group starts at one of the `starts`
+# indices, which must begin with 0, and every step is measured from the
+# previous point of the same group.
+
+def _output(out: np.ndarray | None, n: int, dtype=np.float64) -> np.ndarray:
+    return np.empty(n, dtype=dtype) if out is None else out
+
+
+def segment_distances(lats: np.ndarray, lons: np.ndarray, starts: np.ndarray,
+                      out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Distance from the previous point of each group
+    :param lats: Array of latitudes in degrees
+    :param lons: Array of longitudes in degrees
+    :param starts: Indices of the first point of each group
+    :param out: Optional preallocated output array
+    :return: Array of distances in meters, zero at the group starts
+    """
+    out = _output(out, len(lats))
+    if len(out):
+        vec_haversine(lats[:-1], lons[:-1], lats[1:], lons[1:], out=out[1:])
+        out[starts] = 0.0
+    return out
+
+
+def cumulative_distances(steps: np.ndarray, starts: np.ndarray,
+                         out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Distance travelled since the start of each group
+    :param steps: Array of step distances, as from segment_distances
+    :param starts: Indices of the first point of each group
+    :param out: Optional preallocated output array
+    :return: Array of cumulative distances in meters
+    """
+    out = np.cumsum(steps, out=_output(out, len(steps)))
+    if len(out):
+        offsets = out[starts] - steps[starts]
+        out -= np.repeat(offsets, np.diff(np.append(starts, len(out))))
+    return out
+
+
+def segment_bearings(lats: np.ndarray, lons: np.ndarray, starts: np.ndarray,
+                     out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Bearing from the previous point of each group
+    :param lats: Array of latitudes in degrees
+    :param lons: Array of longitudes in degrees
+    :param starts: Indices of the first point of each group
+    :param out: Optional preallocated output array
+    :return: Array of bearings in degrees, NaN at the group starts
+    """
+    out = _output(out, len(lats))
+    if len(out):
+        vec_bearing(lats[:-1], lons[:-1], lats[1:], lons[1:], out=out[1:])
+        out[starts] = np.nan
+    return out
+
+
+def segment_deltas(values: np.ndarray, starts: np.ndarray,
+                   out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Difference to the previous value of each group
+    :param values: Array of values, such as time stamps or speeds
+    :param starts: Indices of the first point of each group
+    :param out: Optional preallocated output array
+    :return: Array of differences, zero at the group starts
+    """
+    out = _output(out, len(values), values.dtype)
+    if len(out):
+        np.subtract(values[1:], values[:-1], out=out[1:])
+        out[starts] = 0
+    return out
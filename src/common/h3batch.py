@@ -0,0 +1,103 @@
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import h3.api.numpy_int as h3
+
+
+H3_RES_OFFSET = 52
+H3_RES_MASK = np.int64(0xF << H3_RES_OFFSET)
+H3_MAX_RES = 15
+
+
+def cells_to_parent(cells: np.ndarray, res: int) -> np.ndarray:
+    """
+    Vectorized parent cell computation using the H3 index bit layout
+    :param cells: Array of H3 cells (int64) at a resolution >= res
+    :param res: Target parent resolution
+    :return: Array of parent H3 cells (int64)
+    """
+    cells = np.asarray(cells, dtype=np.int64)
+    unused_digits = np.int64((1 << ((H3_MAX_RES - res) * 3)) - 1)
+    parents = (cells & ~H3_RES_MASK) | np.int64(res << H3_RES_OFFSET)
+    return parents | unused_digits
+
+
+def _unique_cells(lats: np.ndarray, lngs: np.ndarray, res: int) -> np.ndarray:
+    # Consecutive GPS samples repeat the same location a lot (stops, map
+    # snapping), so only the distinct coordinate pairs go through H3.
+    pairs = lats + 1j * lngs
+    unique, inverse = np.unique(pairs, return_inverse=True)
+    cells = np.fromiter(
+        (h3.latlng_to_cell(lat, lng, res)
+         for lat, lng in zip(unique.real.tolist(), unique.imag.tolist())),
+        dtype=np.int64,
+        count=len(unique),
+    )
+    return cells[inverse]
+
+
+def latlng_to_cells_multi(
+    lats: np.ndarray,
+    lngs: np.ndarray,
+    resolutions: Sequence[int],
+    chunk_size: int = 1_000_000,
+) -> Dict[int, np.ndarray]:
+    """
+    Batched H3 cell computation at several resolutions at once. Coarser
+    resolutions are the parents of the finest cell, as in h3.cell_to_parent.
+    :param lats: Array of latitudes in degrees
+    :param lngs: Array of longitudes in degrees
+    :param resolutions: H3 resolutions to compute
+    :param chunk_size: Maximum number of points processed per chunk
+    :return: Dictionary of int64 cell arrays keyed by resolution
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    finest = max(resolutions)
+    result = {res: np.empty(len(lats), dtype=np.int64) for res in resolutions}
+
+    for start in range(0, len(lats), chunk_size):
+        end = start + chunk_size
+        cells = _unique_cells(lats[start:end], lngs[start:end], finest)
+        for res in resolutions:
+            if res == finest:
+                result[res][start:end] = cells
+            else:
+                result[res][start:end] = cells_to_parent(cells, res)
+    return result
+
+
+def latlng_to_cells(
+    lats: np.ndarray, lngs: np.ndarray, res: int = 12, chunk_size: int = 1_000_000
+) -> np.ndarray:
+    """
+    Batched H3 cell computation
+    :param lats: Array of latitudes in degrees
+    :param lngs: Array of longitudes in degrees
+    :param res: H3 resolution
+    :param chunk_size: Maximum number of points processed per chunk
+    :return: Array of int64 H3 cells
+    """
+    return latlng_to_cells_multi(lats, lngs, [res], chunk_size)[res]
+
+
+def grid_disk_cells(lat: float, lng: float, k: int, res: int) -> List[int]:
+    """
+    Cells within k grid steps of the cell containing a location
+    :param lat: Latitude in degrees
+    :param lng: Longitude in degrees
+    :param k: Ring distance
+    :param res: H3 resolution
+    :return: List of H3 cells
+    """
+    return [int(cell) for cell in h3.grid_disk(h3.latlng_to_cell(lat, lng, res), k)]
+
+
+def polygon_cells(points: Sequence[Tuple[float, float]], res: int) -> List[int]:
+    """
+    Cells whose centers fall inside a polygon
+    :param points: Polygon outline as (lat, lng) pairs in degrees
+    :param res: H3 resolution
+    :return: List of H3 cells
+    """
+    return [int(cell) for cell in h3.polygon_to_cells(h3.LatLngPoly(list(points)), res)]
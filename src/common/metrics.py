@@ -0,0 +1,122 @@
+import cProfile
+import csv
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+FIELDS = ["calls", "seconds", "rows", "bytes"]
+
+
+class Span:
+    """
+    Counters of a running stage, filled in by the instrumented code
+    """
+
+    def __init__(self, rows: int = 0, bytes: int = 0):
+        self.rows = rows
+        self.bytes = bytes
+
+
+class Metrics:
+    """
+    Process-wide registry of named stage timings with row and byte counts,
+    and optional per-stage cProfile capture
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._profiling = threading.local()
+        self.profile_folder = None
+
+    def add(self, name: str, seconds: float = 0.0, rows: int = 0, bytes: int = 0, calls: int = 1) -> None:
+        with self._lock:
+            stage = self._stages.setdefault(name, dict.fromkeys(FIELDS, 0))
+            stage["calls"] += calls
+            stage["seconds"] += seconds
+            stage["rows"] += rows
+            stage["bytes"] += bytes
+
+    def merge(self, stages: Dict[str, Dict[str, float]]) -> None:
+        for name, stage in stages.items():
+            self.add(name, **{field: stage[field] for field in FIELDS})
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages = {}
+            self._profiles = {}
+
+    @contextmanager
+    def span(self, name: str, rows: int = 0, bytes: int = 0) -> Iterator[Span]:
+        span = Span(rows, bytes)
+        profile = self._start_profile(name)
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            seconds = time.perf_counter() - started
+            if profile is not None:
+                profile.disable()
+                self._profiling.active = False
+            self.add(name, seconds, span.rows, span.bytes)
+
+    def profile_current_thread(self) -> None:
+        """
+        Lets the spans of the calling thread be profiled too, for long-lived
+        threads whose span names no other thread uses
+        """
+        self._profiling.allowed = True
+
+    def _start_profile(self, name: str) -> cProfile.Profile | None:
+        # Only the outermost span of the main thread, or of a thread that
+        # opted in, is profiled, as a thread can only run one profiler at a
+        # time
+        if self.profile_folder is None:
+            return None
+        if threading.current_thread() is not threading.main_thread() and not getattr(self._profiling, "allowed", False):
+            return None
+        if getattr(self._profiling, "active", False):
+            return None
+
+        with self._lock:
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+        self._profiling.active = True
+        profile.enable()
+        return profile
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            stages = {name: dict(stage) for name, stage in self._stages.items()}
+        for stage in stages.values():
+            seconds = stage["seconds"]
+            stage["rows_per_s"] = stage["rows"] / seconds if seconds > 0 else None
+            stage["bytes_per_s"] = stage["bytes"] / seconds if seconds > 0 else None
+        return stages
+
+    def write(self, filename: str) -> None:
+        stages = self.summary()
+        if filename.endswith(".csv"):
+            with open(filename, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["stage"] + FIELDS + ["rows_per_s", "bytes_per_s"])
+                for name, stage in stages.items():
+                    writer.writerow([name] + [stage[k] for k in FIELDS + ["rows_per_s", "bytes_per_s"]])
+        else:
+            with open(filename, "w") as f:
+                json.dump(stages, f, indent=2)
+
+    def dump_profiles(self) -> None:
+        if self.profile_folder is None:
+            return
+        os.makedirs(self.profile_folder, exist_ok=True)
+        with self._lock:
+            profiles = dict(self._profiles)
+        for name, profile in profiles.items():
+            profile.dump_stats(os.path.join(self.profile_folder, f"{name}.prof"))
+
+
+metrics = Metrics()
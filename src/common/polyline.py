@@ -0,0 +1,107 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+
+def _to_bytes(encoded: str | bytes) -> np.ndarray:
+    if isinstance(encoded, str):
+        encoded = encoded.encode("ascii")
+    return np.frombuffer(encoded, dtype=np.uint8)
+
+
+def _decode_values(data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Every value is a little-endian run of 5-bit chunks, where all chunks but
+    # the last carry the 0x20 continuation bit.
+    chunks = data.astype(np.int64) - 63
+    is_last = chunks < 0x20
+    ends = np.flatnonzero(is_last)
+    if len(ends) == 0:
+        return np.empty(0, dtype=np.int64), is_last
+
+    chunks = chunks[:ends[-1] + 1]
+    starts = np.empty(len(ends), dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    value_index = np.repeat(np.arange(len(ends)), np.diff(np.append(starts, len(chunks))))
+    shifts = 5 * (np.arange(len(chunks)) - starts[value_index])
+    values = np.add.reduceat((chunks & 0x1f) << shifts, starts)
+    return (values >> 1) ^ -(values & 1), is_last
+
+
+def decode(encoded: str | bytes, precision: int = 6) -> np.ndarray:
+    """
+    Vectorized polyline decoder
+    :param encoded: Encoded polyline string
+    :param precision: Number of decimal places of the encoded coordinates
+    :return: Contiguous (n, 2) float64 array of (lat, lon) pairs
+    """
+    deltas, _ = _decode_values(_to_bytes(encoded))
+    if len(deltas) % 2:
+        raise ValueError("Malformed polyline: odd number of values")
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / 10.0 ** precision
+
+
+def decode_many(encoded: Sequence[str | bytes],
+                precision: int = 6) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized decoder for a batch of polylines
+    :param encoded: Sequence of encoded polyline strings
+    :param precision: Number of decimal places of the encoded coordinates
+    :return: Tuple with the (n, 2) float64 array of all the decoded points and
+        the offsets array, so shape i is points[offsets[i]:offsets[i + 1]]
+    """
+    buffers = [e.encode("ascii") if isinstance(e, str) else e for e in encoded]
+    offsets = np.zeros(len(buffers) + 1, dtype=np.int64)
+    if len(buffers) == 0:
+        return np.empty((0, 2), dtype=np.float64), offsets
+
+    # Each polyline ends with a complete value, so they can be concatenated
+    # and decoded in one pass, then split by counting values per polyline.
+    deltas, is_last = _decode_values(_to_bytes(b"".join(buffers)))
+    byte_offsets = np.cumsum([0] + [len(b) for b in buffers])
+    values_before = np.concatenate(([0], np.cumsum(is_last)))
+    values_per_shape = np.diff(values_before[byte_offsets])
+    if np.any(values_per_shape % 2):
+        raise ValueError("Malformed polyline: odd number of values")
+    offsets[1:] = np.cumsum(values_per_shape // 2)
+
+    totals = np.cumsum(deltas.reshape(-1, 2), axis=0)
+    counts = np.diff(offsets)
+    bases = np.zeros((len(buffers), 2), dtype=np.int64)
+    has_previous = offsets[:-1] > 0
+    bases[has_previous] = totals[offsets[:-1][has_previous] - 1]
+    points = (totals - np.repeat(bases, counts, axis=0)) / 10.0 ** precision
+    return points, offsets
+
+
+def split(points: np.ndarray, offsets: np.ndarray) -> List[np.ndarray]:
+    return [points[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def encode(points: np.ndarray, precision: int = 6) -> str:
+    """
+    Vectorized polyline encoder
+    :param points: Array-like of (lat, lon) pairs
+    :param precision: Number of decimal places to encode
+    :return: Encoded polyline string
+    """
+    ints = np.round(np.asarray(points, dtype=np.float64).reshape(-1, 2) * 10.0 ** precision)
+    ints = ints.astype(np.int64)
+    if len(ints) == 0:
+        return ""
+
+    deltas = np.diff(ints, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = (deltas << 1) ^ (deltas >> 63)
+
+    n_chunks = np.ones(len(values), dtype=np.int64)
+    rest = values >> 5
+    while np.any(rest):
+        n_chunks += rest > 0
+        rest >>= 5
+
+    k = np.arange(n_chunks.max())
+    chunks = (values[:, None] >> (5 * k)) & 0x1f
+    chunks |= np.where(k < n_chunks[:, None] - 1, 0x20, 0)
+    chunks += 63
+    return chunks[k < n_chunks[:, None]].astype(np.uint8).tobytes().decode("ascii")
@@ -0,0 +1,50 @@
+import io
+import time
+from typing import BinaryIO
+
+
+class StripBytesReader(io.RawIOBase):
+    """
+    Read-only stream wrapper that drops a set of bytes on the fly
+    """
+
+    def __init__(self, raw: BinaryIO, strip: bytes = b";"):
+        self._raw = raw
+        self._strip = strip
+        self.bytes_read = 0
+        self.read_seconds = 0.0
+        self.strip_seconds = 0.0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while True:
+            started = time.perf_counter()
+            data = self._raw.read(len(buffer))
+            read = time.perf_counter()
+            self.read_seconds += read - started
+            if not data:
+                return 0
+            self.bytes_read += len(data)
+            data = data.translate(None, self._strip)
+            self.strip_seconds += time.perf_counter() - read
+            if data:
+                break
+        n = len(data)
+        buffer[:n] = data
+        return n
+
+    def close(self) -> None:
+        self._raw.close()
+        super().close()
+
+
+def open_stripped(raw: BinaryIO,
+                  strip: bytes = b";",
+                  buffer_size: int = 1 << 20) -> io.BufferedReader:
+    """
+    Buffered StripBytesReader; the underlying reader with its counters is
+    available as the .raw attribute of the result
+    """
+    return io.BufferedReader(StripBytesReader(raw, strip), buffer_size=buffer_size)
@@ -0,0 +1,148 @@
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+
+from src.common.geomath import cumulative_distances, segment_distances, vec_haversine
+
+
+class TraceOptions(NamedTuple):
+    simplify: str = "none"          # "none", "thin" or "douglas_peucker"
+    min_distance_m: float = 10.0    # thin: keep about one point per distance
+    max_interval_s: float = 30.0    # thin: keep at least one point per interval
+    tolerance_m: float = 5.0        # douglas_peucker: maximum deviation
+    max_points: int = 2000          # split traces longer than this
+    overlap: int = 50               # points shared by consecutive chunks
+
+
+def thin(lats: np.ndarray, lons: np.ndarray, times: np.ndarray,
+         min_distance_m: float, max_interval_s: float) -> np.ndarray:
+    """
+    Distance and time based thinning. A point is kept whenever the path
+    crosses another multiple of min_distance_m or the clock another multiple
+    of max_interval_s, so long stops still keep some points.
+    :param lats: Array of latitudes in degrees
+    :param lons: Array of longitudes in degrees
+    :param times: Array of time stamps in seconds
+    :param min_distance_m: Distance step in meters
+    :param max_interval_s: Time step in seconds
+    :return: Sorted indices of the kept points, always with the first and last
+    """
+    n = len(lats)
+    if n <= 2:
+        return np.arange(n)
+
+    starts = np.zeros(1, dtype=np.int64)
+    path_m = cumulative_distances(segment_distances(lats, lons, starts), starts)
+    distance_bucket = np.floor(path_m / min_distance_m)
+    time_bucket = np.floor((times - times[0]) / max_interval_s)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    keep[1:] |= (distance_bucket[1:] != distance_bucket[:-1]) | (time_bucket[1:] != time_bucket[:-1])
+    return np.flatnonzero(keep)
+
+
+def douglas_peucker(lats: np.ndarray, lons: np.ndarray, tolerance_m: float) -> np.ndarray:
+    """
+    Douglas-Peucker simplification on a local equirectangular projection,
+    which is accurate to well below GPS noise at city scale
+    :param lats: Array of latitudes in degrees
+    :param lons: Array of longitudes in degrees
+    :param tolerance_m: Maximum distance in meters of a dropped point to the
+        simplified line
+    :return: Sorted indices of the kept points, always with the first and last
+    """
+    n = len(lats)
+    if n <= 2:
+        return np.arange(n)
+
+    earth_radius = 6378137.0
+    y = np.radians(lats) * earth_radius
+    x = np.radians(lons) * earth_radius * np.cos(np.radians(np.mean(lats)))
+
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        length = np.hypot(dx, dy)
+        if length > 0.0:
+            distances = np.abs(px * dy - py * dx) / length
+        else:
+            distances = np.hypot(px, py)
+
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance_m:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.flatnonzero(keep)
+
+
+def split_ranges(n: int, max_points: int, overlap: int) -> List[Tuple[int, int]]:
+    """
+    Splits a trace into overlapping chunks
+    :param n: Number of points
+    :param max_points: Maximum number of points per chunk
+    :param overlap: Number of points shared by consecutive chunks
+    :return: List of (start, end) index ranges, end exclusive
+    """
+    if n <= max_points:
+        return [(0, n)]
+
+    step = max(max_points - overlap, 1)
+    ranges = []
+    start = 0
+    while True:
+        end = min(start + max_points, n)
+        ranges.append((start, end))
+        if end == n:
+            return ranges
+        start += step
+
+
+def seam_points(points: np.ndarray, ranges: List[Tuple[int, int]]) -> np.ndarray:
+    """
+    Middle point of the overlap between each pair of consecutive chunks
+    :param points: (n, 2) array of (lat, lon) input points
+    :param ranges: Chunk ranges, as from split_ranges
+    :return: (len(ranges) - 1, 2) array of seam points
+    """
+    middles = [(next_start + end) // 2 for (_, end), (next_start, _) in zip(ranges[:-1], ranges[1:])]
+    return points[middles].reshape(-1, 2)
+
+
+def _closest(nodes: np.ndarray, point: np.ndarray) -> int:
+    distances = vec_haversine(nodes[:, 0], nodes[:, 1], point[0], point[1])
+    return int(np.argmin(distances))
+
+
+def stitch(parts: List[np.ndarray], seams: np.ndarray) -> np.ndarray:
+    """
+    Joins the matched nodes of overlapping chunks into one sequence, cutting
+    each pair at the nodes closest to their seam point. Only the second half
+    of the previous chunk and the first half of the next one are searched,
+    so a trip that loops back over the seam is not cut short.
+    :param parts: List of (k, 2) node arrays, one per chunk
+    :param seams: Seam points between consecutive chunks
+    :return: (n, 2) array of stitched nodes
+    """
+    result = [parts[0]]
+    for part, seam in zip(parts[1:], seams):
+        previous = result[-1]
+        if len(previous) == 0 or len(part) == 0:
+            result.append(part)
+            continue
+
+        head = len(previous) // 2
+        cut = head + _closest(previous[head:], seam)
+        tail = _closest(part[:len(part) // 2 + 1], seam)
+        result[-1] = previous[:cut]
+        result.append(part[tail:])
+    return np.concatenate(result) if result else np.empty((0, 2))
@@ -1,8 +1,17 @@
+import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict
 
 import tomli
 
 
+@lru_cache(maxsize=1)
 def load_config() -> Dict:
-    return tomli.loads(Path("./config.toml").read_text(encoding="utf-8"))
+    filename = os.environ.get("EVED_CONFIG", "./config.toml")
+    return tomli.loads(Path(filename).read_text(encoding="utf-8"))
+
+
+def get_data_path(filename: str) -> str:
+    folder = load_config().get("data", {}).get("folder", "./data")
+    return os.path.join(folder, filename)
@@ -0,0 +1,72 @@
+from typing import Awaitable, Callable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.common.geocodec import decode_geometry
+from src.config import load_config
+from src.db.async_api import AsyncBaseDb
+from src.db.cache import get_cache
+from src.db.EvedDb import (GEOMETRY_SQL, NODE_POINTS_SQL, TRAJECTORIES_SQL, TRAJECTORY_NODES_SQL, TRAJECTORY_SQL,
+                           VEHICLE_TRAJECTORIES_SQL, VEHICLES_SQL, get_db_name)
+
+
+class AsyncEvedDb(AsyncBaseDb):
+    """
+    Read-only asyncio counterpart of EvedDb for the front end. It shares the
+    queries and the in-process frame cache of EvedDb, so writes through
+    EvedDb invalidate what this class has cached.
+    """
+
+    def __init__(self, cache_bytes: int | None = None, pool_size: int = 5):
+        config = load_config()
+        filename = get_db_name(config)
+        super().__init__(db_name=filename,
+                         pool_size=pool_size,
+                         pragmas=config.get("pragmas", {}).get("default"))
+
+        if cache_bytes is None:
+            cache_bytes = config.get("cache", {}).get("max_bytes", 0)
+        self._cache = get_cache(filename, cache_bytes) if cache_bytes > 0 else None
+
+    async def _cached(self, key: Tuple, tables: List[str],
+                      loader: Callable[[], Awaitable[pd.DataFrame]]) -> pd.DataFrame:
+        if self._cache is None:
+            return await loader()
+
+        df = self._cache.get(key)
+        if df is None:
+            df = await loader()
+            self._cache.put(key, df, tables)
+        # Shallow copy, so callers can add or drop columns without
+        # changing the cached frame
+        return df.copy(deep=False)
+
+    async def get_vehicles(self) -> pd.DataFrame:
+        return await self._cached(("vehicles",), ["vehicle"],
+                                  lambda: self.query_df(VEHICLES_SQL))
+
+    async def get_trajectories(self) -> pd.DataFrame:
+        return await self._cached(("trajectories",), ["trajectory"],
+                                  lambda: self.query_df(TRAJECTORIES_SQL))
+
+    async def get_vehicle_trajectories(self, vehicle_id: int) -> pd.DataFrame:
+        return await self.query_df(VEHICLE_TRAJECTORIES_SQL, parameters=[vehicle_id])
+
+    async def get_trajectory(self, traj_id: int) -> pd.DataFrame:
+        return await self._cached(("trajectory", traj_id), ["signal", "trajectory"],
+                                  lambda: self.query_df(TRAJECTORY_SQL, parameters=[traj_id]))
+
+    async def get_trajectory_nodes(self, traj_id: int) -> pd.DataFrame:
+        return await self._cached(("trajectory_nodes", traj_id), ["node"],
+                                  lambda: self.query_df(TRAJECTORY_NODES_SQL, parameters=[traj_id]))
+
+    async def get_trajectory_geometry(self, traj_id: int) -> np.ndarray:
+        if await self.table_exists("node_geometry"):
+            rows = await self.query(GEOMETRY_SQL, [traj_id])
+            if rows:
+                encoding, geometry = rows[0]
+                return decode_geometry(geometry, encoding) if geometry is not None else np.empty((0, 2))
+
+        rows = await self.query(NODE_POINTS_SQL, [traj_id]) if await self.table_exists("node") else []
+        return np.array(rows, dtype=np.float64).reshape(-1, 2)
@@ -1,28 +1,215 @@
 from os import path
+import json
+import zlib
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
 
+import numpy as np
 import pandas as pd
 
+from src.common.geocodec import decode_geometry
+from src.common.h3batch import grid_disk_cells, polygon_cells
 from src.config import load_config
+from src.db.aggregates import refresh_aggregates
 from src.db.api import BaseDb
+from src.db.cache import get_cache, invalidate_cache
+from src.db.columnar import ColumnarStore, export_columnar
+from src.db.compact import migrate_signal_compact, rebuild_signal_view
+from src.db.h3index import add_parent_columns, fill_h3_traj
+
+
+# Expands a JSON array of [vehicle_id, trip_id] pairs into rows
+PAIRS_SQL = "SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)"
+
+
+VEHICLES_SQL = "SELECT vehicle_id, vehicle_type, vehicle_class FROM vehicle"
+
+TRAJECTORIES_SQL = """
+SELECT  traj_id
+,       vehicle_id
+,       trip_id
+,       length_m
+,       duration_s
+,       dt_ini
+,       dt_end
+,       ROUND(length_m / 1000.0, 1) as km
+FROM    trajectory
+"""
+
+VEHICLE_TRAJECTORIES_SQL = "SELECT traj_id, vehicle_id, trip_id FROM trajectory WHERE vehicle_id = ?"
+
+TRAJECTORY_SQL = """
+SELECT      s.signal_id
+,           s.vehicle_id
+,           s.day_num
+,           s.time_stamp
+,           s.latitude
+,           s.longitude
+,           s.match_latitude
+,           s.match_longitude
+FROM        signal s
+INNER JOIN  trajectory t ON s.vehicle_id = t.vehicle_id AND s.trip_id = t.trip_id
+WHERE       t.traj_id = ?
+"""
+
+TRAJECTORY_NODES_SQL = """
+SELECT      node_id
+,           latitude
+,           longitude
+,           h3_12
+FROM        node
+WHERE       traj_id = ?
+ORDER BY    node_id
+"""
+
+GEOMETRY_SQL = "SELECT encoding, geometry FROM node_geometry WHERE traj_id = ?"
+
+NODE_POINTS_SQL = """
+SELECT      latitude
+,           longitude
+FROM        node
+WHERE       traj_id = ? AND latitude IS NOT NULL
+ORDER BY    node_id
+"""
+
+
+def pairs_json(pairs: Sequence[Tuple[int, int]]) -> str:
+    return json.dumps([[int(vehicle_id), int(trip_id)] for vehicle_id, trip_id in pairs])
+
+
+def get_db_name(config: Dict) -> str:
+    database = config.get("database")
+    return path.join(
+        database.get("folder", "./data/eved.db"),
+        database.get("eved", "eved.sqlite"),
+    )
 
 
 class EvedDb(BaseDb):
-    def __init__(self):
+    def __init__(self, cache_bytes: int | None = None):
         config = load_config()
         database = config.get("database")
-        filename = path.join(
+        filename = get_db_name(config)
+        self.columnar_folder = path.join(
             database.get("folder", "./data/eved.db"),
-            database.get("eved", "eved.sqlite"),
+            database.get("columnar", "columnar"),
         )
-        super().__init__(db_name=filename)
+        pragmas = config.get("pragmas", {})
+        super().__init__(db_name=filename,
+                         pragmas=pragmas.get("default"),
+                         bulk_pragmas=pragmas.get("bulk"),
+                         append_pragmas=pragmas.get("append"))
+
+        self.h3_resolutions = config.get("h3", {}).get("resolutions", [7, 9])
+        self.signal_layout = database.get("signal_layout", "rowid")
+        self.aggregate_resolution = config.get("aggregates", {}).get("resolution", 9)
+
+        if cache_bytes is None:
+            cache_bytes = config.get("cache", {}).get("max_bytes", 0)
+        self._cache = get_cache(filename, cache_bytes) if cache_bytes > 0 else None
+
+    def table_dtypes(self, table: str, columns=None, overrides=None) -> Dict[str, np.dtype]:
+        # The compact signal view reports no declared types, so they are read
+        # from the empty copy of the original table
+        if table == "signal" and self.table_exists("signal_schema"):
+            table = "signal_schema"
+        return super().table_dtypes(table, columns, overrides)
+
+    def _cached(self, key: Tuple, tables: List[str], loader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        if self._cache is None:
+            return loader()
+
+        df = self._cache.get(key)
+        if df is None:
+            df = loader()
+            self._cache.put(key, df, tables)
+        # Shallow copy, so callers can add or drop columns without
+        # changing the cached frame
+        return df.copy(deep=False)
+
+    def invalidate_cache(self, tables: List[str] | None = None):
+        invalidate_cache(self.db_name, tables)
+
+    def cache_stats(self) -> Dict[str, int]:
+        return {} if self._cache is None else self._cache.stats()
 
     def insert_vehicles(self, vehicles):
         self.insert_list("sql/eved/insert_vehicle.sql", vehicles)
+        self.invalidate_cache(["vehicle"])
 
     def insert_signals(self, signals):
         self.insert_list("sql/eved/insert_signal.sql", signals)
+        self.invalidate_cache(["signal"])
+
+    def is_signal_compact(self) -> bool:
+        return self.view_exists("signal")
+
+    def get_signal_table(self) -> str:
+        """
+        Name of the physical table holding the signal rows and ids
+        """
+        return "signal_compact" if self.is_signal_compact() else "signal"
+
+    def migrate_signal_layout(self) -> Dict | None:
+        """
+        Converts the signal table to the layout selected in the config, which
+        is currently only possible from rowid to compact
+        :return: Migration report, or None when there was nothing to do
+        """
+        if self.signal_layout != "compact" or not self.table_exists("signal"):
+            return None
+        report = migrate_signal_compact(self, self.h3_resolutions)
+        self.invalidate_cache()
+        return report
+
+    def create_signal_manifest(self):
+        self.ddl_script("sql/eved/create_signal_manifest.sql")
+
+    def get_signal_manifest(self) -> pd.DataFrame:
+        sql = """
+        SELECT  member, file_size, crc, rows, first_signal_id, last_signal_id
+        FROM    signal_manifest
+        """
+        return self.query_df(sql)
+
+    def refresh_trajectories(self, pairs: Sequence[Tuple[int, int]]) -> List[int]:
+        """
+        Adds the trajectories of new (vehicle_id, trip_id) pairs and drops
+        those left without signals
+        :return: Ids of the remaining trajectories of these pairs
+        """
+        parameters = [pairs_json(pairs)]
+        has_stats = self.table_exists("traj_stats")
+        with self.transaction() as cur:
+            if has_stats:
+                # Marks the aggregates of these trajectories as stale
+                cur.execute(f"""
+                DELETE FROM traj_stats
+                WHERE       traj_id IN (SELECT traj_id FROM trajectory
+                                        WHERE (vehicle_id, trip_id) IN ({PAIRS_SQL}))
+                """, parameters)
+            cur.execute(f"""
+            DELETE FROM trajectory
+            WHERE       (vehicle_id, trip_id) IN ({PAIRS_SQL})
+            AND         NOT EXISTS (SELECT 1 FROM signal s
+                                    WHERE s.vehicle_id = trajectory.vehicle_id
+                                    AND   s.trip_id = trajectory.trip_id)
+            """, parameters)
+            cur.execute(f"""
+            INSERT INTO trajectory (vehicle_id, trip_id)
+            SELECT DISTINCT s.vehicle_id, s.trip_id
+            FROM        signal s
+            WHERE       (s.vehicle_id, s.trip_id) IN ({PAIRS_SQL})
+            AND         NOT EXISTS (SELECT 1 FROM trajectory t
+                                    WHERE t.vehicle_id = s.vehicle_id
+                                    AND   t.trip_id = s.trip_id)
+            """, parameters)
+            traj_ids = [row[0] for row in cur.execute(
+                f"SELECT traj_id FROM trajectory WHERE (vehicle_id, trip_id) IN ({PAIRS_SQL})", parameters)]
+        self.invalidate_cache(["trajectory", "traj_stats"])
+        return traj_ids
 
     def create_trajectories(self):
+        self.invalidate_cache(["trajectory"])
         self.ddl_script("sql/eved/create_trajectory.sql")
         self.ddl_script("sql/eved/insert_trajectories.sql")
         self.ddl_script("sql/eved/create_trajectory_vehicle_index.sql")
@@ -34,44 +221,238 @@ class EvedDb(BaseDb):
         self.ddl_script("sql/eved/create_ix_node_traj_id.sql")
         self.ddl_script("sql/eved/create_ix_node_h3_12.sql")
 
+    def create_node_geometry(self):
+        self.ddl_script("sql/eved/create_node_geometry.sql")
+        self.ddl_script("sql/eved/create_node_geometry_h3.sql")
+        self.ddl_script("sql/eved/create_ix_node_geometry_h3_traj_id.sql")
+
     def delete_node(self):
-        sql = "delete from node"
-        self.execute_sql(sql)
+        for table in ["node", "node_geometry", "node_geometry_h3"]:
+            if self.table_exists(table):
+                self.execute_sql(f"delete from {table}")
+        self.invalidate_cache(["node", "node_geometry"])
 
-    def get_vehicles(self) -> pd.DataFrame:
-        sql = "SELECT vehicle_id, vehicle_type, vehicle_class FROM vehicle"
+    def create_match_status(self):
+        self.ddl_script("sql/eved/create_match_status.sql")
+
+    def init_match_status(self, reset: bool = False):
+        if reset:
+            self.execute_sql("delete from match_status")
+        self.ddl_script("sql/eved/insert_match_status.sql")
+
+    def prune_match_status(self):
+        """
+        Drops the match status and the nodes of trajectories that no longer
+        exist, such as those removed by an incremental signal load
+        """
+        orphan = "traj_id NOT IN (SELECT traj_id FROM trajectory)"
+        with self.transaction() as cur:
+            for table in ["match_status", "node", "node_geometry", "node_geometry_h3"]:
+                if self.table_exists(table):
+                    cur.execute(f"DELETE FROM {table} WHERE {orphan}")
+        self.invalidate_cache(["node", "node_geometry"])
+
+    def get_match_status(self) -> pd.DataFrame:
+        sql = "SELECT traj_id, status, input_hash FROM match_status"
         return self.query_df(sql)
 
-    def get_trajectories(self) -> pd.DataFrame:
+    def create_match_cache(self):
+        self.ddl_script("sql/eved/create_match_cache.sql")
+
+    def get_cached_match(self, request_hash: bytes, version: str) -> str | None:
+        sql = "SELECT shape FROM match_cache WHERE request_hash = ? AND version = ?"
+        rows = self.query(sql, [request_hash, version])
+        return zlib.decompress(rows[0][0]).decode("ascii") if rows else None
+
+    def invalidate_match_cache(self, keep_version: str | None = None):
+        if keep_version is None:
+            self.execute_sql("DELETE FROM match_cache")
+        else:
+            self.execute_sql("DELETE FROM match_cache WHERE version <> ?", [keep_version])
+
+    def get_match_cache_stats(self) -> pd.DataFrame:
         sql = """
-        SELECT  traj_id
-        ,       vehicle_id
-        ,       trip_id
-        ,       length_m
-        ,       duration_s
-        ,       dt_ini
-        ,       dt_end
-        ,       ROUND(length_m / 1000.0, 1) as km
-        FROM    trajectory
+        SELECT      version
+        ,           COUNT(*) AS entries
+        ,           SUM(LENGTH(shape)) AS shape_bytes
+        FROM        match_cache
+        GROUP BY    version
         """
         return self.query_df(sql)
 
+    def create_h3_index(self):
+        has_nodes = self.table_exists("node")
+        has_geometry = self.table_exists("node_geometry_h3")
+        # The compact signal view computes its parent columns, so it only
+        # has to list those of new resolutions
+        if self.is_signal_compact():
+            rebuild_signal_view(self, self.h3_resolutions)
+        else:
+            add_parent_columns(self, "signal", self.h3_resolutions)
+        if has_nodes:
+            add_parent_columns(self, "node", self.h3_resolutions)
+        self.ddl_script("sql/eved/create_h3_traj.sql")
+        fill_h3_traj(self, self.h3_resolutions, include_nodes=has_nodes, include_geometry=has_geometry)
+        self.invalidate_cache(["signal", "node"])
+
+    def refresh_h3_index(self, traj_ids: Sequence[int]) -> None:
+        """
+        Brings the node parent columns and the h3_traj rows of reloaded or
+        rematched trajectories up to date, and drops the rows of deleted
+        ones. Does nothing before create_h3_index has run.
+        """
+        if not self.table_exists("h3_traj"):
+            return
+
+        has_nodes = self.table_exists("node")
+        if has_nodes:
+            add_parent_columns(self, "node", self.h3_resolutions, traj_ids=traj_ids)
+        fill_h3_traj(self, self.h3_resolutions, include_nodes=has_nodes,
+                     include_geometry=self.table_exists("node_geometry_h3"), traj_ids=traj_ids)
+        self.invalidate_cache(["node"])
+
+    def get_cell_trajectories(self, cells: Sequence[int], resolution: int) -> pd.DataFrame:
+        if resolution not in self.h3_resolutions:
+            raise ValueError(f"Resolution {resolution} is not indexed, use one of {self.h3_resolutions}")
+
+        sql = """
+        SELECT DISTINCT traj_id
+        FROM            h3_traj
+        WHERE           resolution = ?
+        AND             h3_cell IN (SELECT value FROM json_each(?))
+        ORDER BY        traj_id
+        """
+        return self.query_df(sql, parameters=[resolution, json.dumps([int(cell) for cell in cells])])
+
+    def get_ring_trajectories(self, lat: float, lng: float, k: int, resolution: int) -> pd.DataFrame:
+        return self.get_cell_trajectories(grid_disk_cells(lat, lng, k, resolution), resolution)
+
+    def get_polygon_trajectories(self, points: Sequence[Tuple[float, float]], resolution: int) -> pd.DataFrame:
+        return self.get_cell_trajectories(polygon_cells(points, resolution), resolution)
+
+    def create_aggregates(self):
+        self.ddl_script("sql/eved/create_traj_stats.sql")
+        self.ddl_script("sql/eved/create_cell_traj_stats.sql")
+        self.ddl_script("sql/eved/create_cell_stats.sql")
+
+    def refresh_aggregates(self) -> int:
+        refreshed = refresh_aggregates(self, self.aggregate_resolution)
+        self.invalidate_cache(["traj_stats", "cell_stats"])
+        return refreshed
+
+    def get_traj_stats(self) -> pd.DataFrame:
+        sql = """
+        SELECT      a.traj_id
+        ,           t.vehicle_id
+        ,           t.trip_id
+        ,           t.length_m
+        ,           a.signal_count
+        ,           a.energy_sum
+        ,           a.energy_sum / NULLIF(t.length_m / 1000.0, 0) AS energy_per_km
+        ,           a.fuel_rate_sum / NULLIF(a.fuel_rate_count, 0) AS fuel_rate_mean
+        ,           a.speed_sum / NULLIF(a.speed_count, 0) AS speed_mean
+        ,           a.speed_max
+        ,           a.soc_ini
+        ,           a.soc_end
+        ,           a.soc_min
+        ,           a.soc_max
+        FROM        traj_stats a
+        INNER JOIN  trajectory t ON t.traj_id = a.traj_id
+        """
+        return self._cached(("traj_stats",), ["traj_stats", "trajectory"],
+                            lambda: self.query_df(sql))
+
+    def get_cell_stats(self) -> pd.DataFrame:
+        sql = """
+        SELECT      resolution
+        ,           h3_cell
+        ,           traj_count
+        ,           signal_count
+        ,           speed_sum / NULLIF(speed_count, 0) AS speed_mean
+        ,           energy_sum
+        ,           energy_sum / NULLIF(energy_count, 0) AS energy_mean
+        FROM        cell_stats
+        """
+        return self._cached(("cell_stats",), ["cell_stats"],
+                            lambda: self.query_df(sql))
+
+    def get_vehicle_class_stats(self) -> pd.DataFrame:
+        sql = """
+        SELECT      v.vehicle_class
+        ,           COUNT(*) AS traj_count
+        ,           SUM(t.length_m) / 1000.0 AS km
+        ,           SUM(a.energy_sum) / NULLIF(SUM(t.length_m) / 1000.0, 0) AS energy_per_km
+        ,           SUM(a.fuel_rate_sum) / NULLIF(SUM(a.fuel_rate_count), 0) AS fuel_rate_mean
+        ,           SUM(a.speed_sum) / NULLIF(SUM(a.speed_count), 0) AS speed_mean
+        FROM        traj_stats a
+        INNER JOIN  trajectory t ON t.traj_id = a.traj_id
+        INNER JOIN  vehicle v ON v.vehicle_id = t.vehicle_id
+        GROUP BY    v.vehicle_class
+        """
+        return self._cached(("vehicle_class_stats",), ["traj_stats", "trajectory", "vehicle"],
+                            lambda: self.query_df(sql))
+
+    def export_columnar(self):
+        export_columnar(self, self.columnar_folder)
+
+    def get_columnar_store(self) -> ColumnarStore:
+        return ColumnarStore(self.columnar_folder)
+
+    def get_vehicles(self) -> pd.DataFrame:
+        return self._cached(("vehicles",), ["vehicle"],
+                            lambda: self.query_df(VEHICLES_SQL))
+
+    def get_trajectories(self) -> pd.DataFrame:
+        return self._cached(("trajectories",), ["trajectory"],
+                            lambda: self.query_df(TRAJECTORIES_SQL))
+
     def get_vehicle_trajectories(self, vehicle_id: int) -> pd.DataFrame:
-        sql = "SELECT traj_id, vehicle_id, trip_id"
-        return self.query_df(sql, parameters=[vehicle_id])
+        return self.query_df(VEHICLE_TRAJECTORIES_SQL, parameters=[vehicle_id])
 
     def get_trajectory(self, traj_id: int) -> pd.DataFrame:
-        sql = """
-        SELECT      s.signal_id
-        ,           s.vehicle_id
-        ,           s.day_num
-        ,           s.time_stamp
-        ,           s.latitude
-        ,           s.longitude   
-        ,           s.match_latitude
-        ,           s.match_longitude
-        FROM        signal s
-        INNER JOIN  trajectory t ON s.vehicle_id = t.vehicle_id AND s.trip_id = t.trip_id
-        WHERE       t.traj_id = ?
-        """
-        return self.query_df(sql, parameters=[traj_id])
+        return self._cached(("trajectory", traj_id), ["signal", "trajectory"],
+                            lambda: self.query_df(TRAJECTORY_SQL, parameters=[traj_id]))
+
+    def get_trajectory_nodes(self, traj_id: int) -> pd.DataFrame:
+        return self._cached(("trajectory_nodes", traj_id), ["node"],
+                            lambda: self.query_df(TRAJECTORY_NODES_SQL, parameters=[traj_id]))
+
+    def get_trajectory_geometry(self, traj_id: int) -> np.ndarray:
+        """
+        Reads the map-matched route of a trajectory from the geometry table,
+        or from the node table when the trajectory has no stored geometry
+        :param traj_id: Trajectory identifier
+        :return: Contiguous (n, 2) float64 array of (lat, lon) pairs
+        """
+        if self.table_exists("node_geometry"):
+            rows = self.query(GEOMETRY_SQL, [traj_id])
+            if rows:
+                encoding, geometry = rows[0]
+                return decode_geometry(geometry, encoding) if geometry is not None else np.empty((0, 2))
+
+        rows = self.query(NODE_POINTS_SQL, [traj_id]) if self.table_exists("node") else []
+        return np.array(rows, dtype=np.float64).reshape(-1, 2)
+
+    def iter_trajectory_signals(self,
+                                chunk_size: int = 1_000_000,
+                                pairs: Sequence[Tuple[int, int]] | None = None) -> Iterator[Dict[str, np.ndarray]]:
+        where = ""
+        parameters = None
+        if pairs is not None:
+            where = f"WHERE       (vehicle_id, trip_id) IN ({PAIRS_SQL})"
+            parameters = [pairs_json(pairs)]
+
+        sql = f"""
+        SELECT      vehicle_id
+        ,           trip_id
+        ,           day_num
+        ,           time_stamp
+        ,           match_latitude
+        ,           match_longitude
+        FROM        signal
+        {where}
+        ORDER BY    vehicle_id, trip_id, time_stamp
+        """
+        dtypes = self.table_dtypes("signal", columns=["vehicle_id", "trip_id", "day_num", "time_stamp",
+                                                      "match_latitude", "match_longitude"])
+        return self.query_chunks(sql, dtypes, parameters=parameters, chunk_size=chunk_size, as_columns=True)
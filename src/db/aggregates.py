@@ -0,0 +1,116 @@
+from src.db.api import BaseDb
+from src.db.h3index import parent_sql
+
+TRAJ_STATS_SQL = """
+INSERT INTO traj_stats
+SELECT      t.traj_id
+,           COUNT(*)
+,           SUM(s.energy_consumption)
+,           COUNT(s.energy_consumption)
+,           SUM(s.fuel_rate)
+,           COUNT(s.fuel_rate)
+,           SUM(s.speed)
+,           COUNT(s.speed)
+,           MAX(s.speed)
+,           (SELECT f.hv_bat_soc FROM signal f
+             WHERE f.vehicle_id = t.vehicle_id AND f.trip_id = t.trip_id AND f.hv_bat_soc IS NOT NULL
+             ORDER BY f.time_stamp LIMIT 1)
+,           (SELECT f.hv_bat_soc FROM signal f
+             WHERE f.vehicle_id = t.vehicle_id AND f.trip_id = t.trip_id AND f.hv_bat_soc IS NOT NULL
+             ORDER BY f.time_stamp DESC LIMIT 1)
+,           MIN(s.hv_bat_soc)
+,           MAX(s.hv_bat_soc)
+FROM        agg_traj a
+INNER JOIN  trajectory t ON t.traj_id = a.traj_id
+INNER JOIN  signal s ON s.vehicle_id = t.vehicle_id AND s.trip_id = t.trip_id
+GROUP BY    t.traj_id
+"""
+
+CELL_TRAJ_STATS_SQL = """
+INSERT INTO cell_traj_stats
+SELECT      ? AS resolution
+,           {parent} AS h3_cell
+,           t.traj_id
+,           COUNT(*)
+,           SUM(s.speed)
+,           COUNT(s.speed)
+,           SUM(s.energy_consumption)
+,           COUNT(s.energy_consumption)
+FROM        agg_traj a
+INNER JOIN  trajectory t ON t.traj_id = a.traj_id
+INNER JOIN  signal s ON s.vehicle_id = t.vehicle_id AND s.trip_id = t.trip_id
+WHERE       s.h3_12 IS NOT NULL
+GROUP BY    h3_cell, t.traj_id
+"""
+
+CELL_STATS_SQL = """
+INSERT INTO cell_stats
+SELECT      resolution
+,           h3_cell
+,           COUNT(*)
+,           SUM(signal_count)
+,           SUM(speed_sum)
+,           SUM(speed_count)
+,           SUM(energy_sum)
+,           SUM(energy_count)
+FROM        cell_traj_stats
+WHERE       resolution = ?
+AND         h3_cell IN (SELECT h3_cell FROM agg_cell)
+GROUP BY    resolution, h3_cell
+"""
+
+
+def refresh_aggregates(db: BaseDb, resolution: int) -> int:
+    """
+    Brings the aggregate tables up to date. Trajectories without stats are
+    (re)computed and those that no longer exist are dropped, then only the
+    cells they touch, before and after, are rolled up again. Trajectory
+    rewrites must delete their traj_stats row to be picked up.
+    :param db: Target database
+    :param resolution: H3 resolution of the cell aggregates
+    :return: Number of refreshed trajectories
+    """
+    with db.transaction() as cur:
+        # A different cell resolution invalidates every cell aggregate
+        stored = cur.execute("SELECT DISTINCT resolution FROM cell_traj_stats").fetchall()
+        if stored and stored != [(resolution,)]:
+            cur.execute("DELETE FROM cell_traj_stats")
+            cur.execute("DELETE FROM cell_stats")
+            cur.execute("DELETE FROM traj_stats")
+
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS agg_traj (traj_id INTEGER PRIMARY KEY)")
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS agg_cell (h3_cell INTEGER PRIMARY KEY)")
+        cur.execute("DELETE FROM agg_traj")
+        cur.execute("DELETE FROM agg_cell")
+
+        cur.execute("""
+        INSERT INTO agg_traj
+        SELECT traj_id FROM trajectory WHERE traj_id NOT IN (SELECT traj_id FROM traj_stats)
+        """)
+        cur.execute("""
+        INSERT OR IGNORE INTO agg_traj
+        SELECT traj_id FROM traj_stats WHERE traj_id NOT IN (SELECT traj_id FROM trajectory)
+        """)
+        cur.execute("""
+        INSERT OR IGNORE INTO agg_traj
+        SELECT DISTINCT traj_id FROM cell_traj_stats WHERE traj_id NOT IN (SELECT traj_id FROM traj_stats)
+        """)
+        refreshed = cur.execute("SELECT COUNT(*) FROM agg_traj").fetchone()[0]
+
+        cur.execute("""
+        INSERT OR IGNORE INTO agg_cell
+        SELECT h3_cell FROM cell_traj_stats WHERE traj_id IN (SELECT traj_id FROM agg_traj)
+        """)
+        cur.execute("DELETE FROM cell_traj_stats WHERE traj_id IN (SELECT traj_id FROM agg_traj)")
+        cur.execute("DELETE FROM traj_stats WHERE traj_id IN (SELECT traj_id FROM agg_traj)")
+
+        cur.execute(TRAJ_STATS_SQL)
+        cur.execute(CELL_TRAJ_STATS_SQL.format(parent=parent_sql("s.h3_12", resolution)), [resolution])
+        cur.execute("""
+        INSERT OR IGNORE INTO agg_cell
+        SELECT h3_cell FROM cell_traj_stats WHERE traj_id IN (SELECT traj_id FROM agg_traj)
+        """)
+
+        cur.execute("DELETE FROM cell_stats WHERE h3_cell IN (SELECT h3_cell FROM agg_cell)")
+        cur.execute(CELL_STATS_SQL, [resolution])
+    return refreshed
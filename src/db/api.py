@@ -1,62 +1,499 @@
 import contextlib
+import functools
+import queue
+import re
 import sqlite3
-from queue import Queue
-from sqlite3 import Connection
-from typing import List
+import threading
+import time
+from os import path
+from sqlite3 import Connection, Cursor
+from typing import Callable, Dict, Iterable, Iterator, List
 
+import numpy as np
 import pandas as pd
 import pandas.io.sql as sqlio
 
+from src.common.metrics import metrics
+
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": 10000,
+    "temp_store": "MEMORY",
+}
+
+BULK_PRAGMAS = {
+    "journal_mode": "OFF",
+    "synchronous": "OFF",
+    "locking_mode": "EXCLUSIVE",
+    "cache_size": -1048576,
+    "page_size": 65536,
+    "mmap_size": 1073741824,
+    "temp_store": "MEMORY",
+}
+
+# Appends to an existing database keep the journal, so a failed load rolls
+# back instead of corrupting what was already loaded
+APPEND_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "locking_mode": "EXCLUSIVE",
+    "cache_size": -1048576,
+    "mmap_size": 1073741824,
+    "temp_store": "MEMORY",
+}
+
+
+def apply_pragmas(conn: Connection, pragmas: Dict) -> None:
+    # page_size goes first, as switching to WAL freezes it
+    for name, value in sorted(pragmas.items(), key=lambda item: item[0] != "page_size"):
+        conn.execute(f"PRAGMA {name}={value}")
+
+
+# Statements that the group writer may batch; everything else, such as DDL,
+# runs directly once the queued writes are committed
+GROUPED_STATEMENT = re.compile(r"\s*(INSERT|REPLACE|UPDATE|DELETE)\b", re.IGNORECASE)
+
+
+# Pragmas that change the database file or its locking and only make sense
+# on the writer connection
+WRITER_PRAGMAS = {"journal_mode", "page_size", "locking_mode"}
+
 
 class ConnectionPool:
-    def __init__(self, db_name: str, pool_size: int = 5):
+    """
+    Lazily opened SQLite connections for one database file. Reads are served
+    by up to pool_size query-only connections, while all writes go through a
+    single writer connection, as SQLite only allows one writer at a time.
+    """
+
+    def __init__(self, db_name: str, pool_size: int = 5, pragmas: Dict | None = None):
         self.db_name = db_name
         self.pool_size = pool_size
-        self._pool = Queue(maxsize=pool_size)
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self._idle = []
+        self._readers = 0
+        self._readers_in_use = 0
+        self._writer_in_use = 0
+        self._writer = None
+        self._writer_lock = threading.RLock()
+        # Guards only the creation of the writer connection, so opening a
+        # reader never waits for a write in progress
+        self._init_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._pinned = None
+        self.group_writer = None
+
+        self._checkouts = 0
+        self._wait_time = 0.0
+        self._max_in_use = 0
+
+    def _connect(self, readonly: bool) -> Connection:
+        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        if readonly:
+            pragmas = {k: v for k, v in self.pragmas.items() if k not in WRITER_PRAGMAS}
+            pragmas["query_only"] = 1
+        else:
+            pragmas = self.pragmas
+        apply_pragmas(conn, pragmas)
+        return conn
 
-        # Initialize pool with connections
-        for _ in range(pool_size):
-            conn = sqlite3.connect(db_name, check_same_thread=False)
-            conn.execute("PRAGMA journal_mode=WAL")
-            conn.execute("PRAGMA synchronous=NORMAL")
-            conn.execute("PRAGMA cache_size=10000")
-            conn.execute("PRAGMA temp_store=MEMORY")
-            self._pool.put(conn)
+    def _get_writer(self) -> Connection:
+        with self._init_lock:
+            if self._writer is None:
+                self._writer = self._connect(readonly=False)
+            return self._writer
+
+    def _record_checkout(self, started: float) -> None:
+        with self._cond:
+            self._checkouts += 1
+            self._wait_time += time.perf_counter() - started
+            in_use = self._readers_in_use + self._writer_in_use
+            self._max_in_use = max(self._max_in_use, in_use)
 
     @contextlib.contextmanager
-    def get_connection(self):
-        conn = self._pool.get()
+    def get_connection(self, readonly: bool = False):
+        if self._pinned is not None:
+            yield self._pinned
+            return
+
+        started = time.perf_counter()
+        if not readonly:
+            with self._writer_lock:
+                self._writer_in_use += 1
+                self._record_checkout(started)
+                try:
+                    yield self._get_writer()
+                finally:
+                    self._writer_in_use -= 1
+            return
+
+        with self._cond:
+            while not self._idle and self._readers >= self.pool_size:
+                self._cond.wait()
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                # Make sure the writer has created the file and set the
+                # journal mode before any reader opens it
+                self._get_writer()
+                conn = self._connect(readonly=True)
+                self._readers += 1
+            self._readers_in_use += 1
+        self._record_checkout(started)
+
         try:
             yield conn
         finally:
-            self._pool.put(conn)
+            with self._cond:
+                self._readers_in_use -= 1
+                self._idle.append(conn)
+                self._cond.notify()
+
+    @contextlib.contextmanager
+    def pinned(self, pragmas: Dict):
+        """
+        Routes every checkout to a single connection configured with the given
+        pragmas. The pooled connections are closed while pinned, so settings
+        such as journal_mode or locking_mode=EXCLUSIVE can take effect.
+        """
+        with self._writer_lock:
+            with self._cond:
+                while self._readers_in_use > 0:
+                    self._cond.wait()
+            self.close_all()
+
+            conn = sqlite3.connect(self.db_name, check_same_thread=False)
+            apply_pragmas(conn, pragmas)
+            self._pinned = conn
+            try:
+                yield conn
+            finally:
+                self._pinned = None
+                conn.close()
+
+    def metrics(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                "checkouts": self._checkouts,
+                "wait_time_s": self._wait_time,
+                "readers_open": self._readers,
+                "readers_in_use": self._readers_in_use,
+                "writer_open": self._writer is not None,
+                "writer_in_use": self._writer_in_use,
+                "max_in_use": self._max_in_use,
+            }
 
     def close_all(self):
-        while not self._pool.empty():
-            conn = self._pool.get()
-            conn.close()
+        with self._cond:
+            while self._idle:
+                self._idle.pop().close()
+                self._readers -= 1
+        with self._writer_lock, self._init_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+class _Barrier:
+    def __init__(self, stop: bool = False):
+        self.stop = stop
+        self.done = threading.Event()
+
+
+class GroupWriter:
+    """
+    Background thread that runs write jobs submitted from any thread on the
+    pool's writer connection, grouping them into one transaction until
+    max_rows rows are written or max_delay seconds have passed. Each job runs
+    in its own savepoint, so a failing job is rolled back alone and its
+    error is raised by the next flush or close. If a whole batch fails, the
+    writer drops every queued job and call, flush and close raise from then
+    on. The job queue holds at most max_pending jobs, so producers block
+    when the writer falls behind.
+    """
+
+    def __init__(self, pool: ConnectionPool, max_rows: int = 10_000, max_delay: float = 1.0,
+                 max_pending: int = 1000):
+        self._pool = pool
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._errors = []
+        self._failure: BaseException | None = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="group-writer", daemon=True)
+        self._thread.start()
+
+    def in_writer_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def call(self, fn: Callable[[Cursor], None], rows: int = 1, block: bool = True) -> None:
+        """
+        Queues a job that writes through the given cursor
+        :param fn: Job, called on the writer thread inside the open transaction
+        :param rows: Weight of the job in the max_rows count
+        :param block: Wait for room in the queue, otherwise raise queue.Full
+        """
+        if self._closed:
+            raise RuntimeError("The group writer is closed")
+        self._raise_failure()
+        try:
+            self._queue.put_nowait((fn, rows))
+        except queue.Full:
+            if not block:
+                raise
+            started = time.perf_counter()
+            self._queue.put((fn, rows))
+            metrics.add("group_commit_wait", time.perf_counter() - started)
+
+    def execute(self, sql: str, parameters=None, many: bool = False, block: bool = True) -> None:
+        if parameters is None:
+            parameters = []
+        if many:
+            parameters = list(parameters)
+            self.call(lambda cur: cur.executemany(sql, parameters), len(parameters), block)
+        else:
+            self.call(lambda cur: cur.execute(sql, parameters), 1, block)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def flush(self) -> None:
+        """
+        Waits until every job queued so far is committed
+        """
+        self._wait(_Barrier())
+
+    def close(self) -> None:
+        """
+        Commits the queued jobs and stops the writer thread
+        """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._wait(_Barrier(stop=True))
+        finally:
+            self._thread.join()
+
+    def _wait(self, barrier: _Barrier) -> None:
+        if self.in_writer_thread():
+            raise RuntimeError("The group writer cannot wait for itself")
+        self._queue.put((barrier, 0))
+        barrier.done.wait()
+        self._raise_failure()
+        if self._errors:
+            errors, self._errors = self._errors, []
+            raise errors[0]
+
+    def _raise_failure(self) -> None:
+        if self._failure is not None:
+            raise RuntimeError("The group writer failed") from self._failure
+
+    def _run(self) -> None:
+        # The jobs of a build stage, such as node_insert, only run here
+        metrics.profile_current_thread()
+        while True:
+            job, rows = self._queue.get()
+            barriers = [job] if isinstance(job, _Barrier) else []
+            if not barriers and self._failure is None:
+                try:
+                    self._run_batch(job, rows, barriers)
+                except BaseException as e:
+                    # The writer connection is unusable, so the jobs still
+                    # queued are dropped and every waiter gets this error
+                    self._failure = e
+
+            for barrier in barriers:
+                barrier.done.set()
+                if barrier.stop:
+                    return
+
+    def _run_batch(self, job: Callable[[Cursor], None], rows: int, barriers: List[_Barrier]) -> None:
+        started = time.perf_counter()
+        total = 0
+        with self._pool.get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                conn.execute("BEGIN TRANSACTION")
+                total = self._run_job(cur, job, rows)
+                deadline = time.monotonic() + self.max_delay
+                while total < self.max_rows:
+                    try:
+                        job, rows = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if isinstance(job, _Barrier):
+                        barriers.append(job)
+                        break
+                    total += self._run_job(cur, job, rows)
+                try:
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    self._errors.append(e)
+            except BaseException:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            finally:
+                cur.close()
+                metrics.add("group_commit", time.perf_counter() - started, rows=total)
+
+    def _run_job(self, cur: Cursor, job: Callable[[Cursor], None], rows: int) -> int:
+        cur.execute("SAVEPOINT job")
+        try:
+            job(cur)
+            cur.execute("RELEASE job")
+        except Exception as e:
+            cur.execute("ROLLBACK TO job")
+            cur.execute("RELEASE job")
+            self._errors.append(e)
+        return rows
+
+
+# One pool per database file, shared by every BaseDb instance in the process
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name: str, pool_size: int = 5, pragmas: Dict | None = None) -> ConnectionPool:
+    key = path.abspath(db_name)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_name, pool_size, pragmas)
+        return pool
+
+
+@functools.lru_cache(maxsize=None)
+def read_sql_file(filename: str) -> str:
+    with open(filename, "r") as f:
+        return f.read()
 
 
 class BaseDb(object):
-    def __init__(self, db_name):
+    def __init__(self, db_name, pragmas: Dict | None = None, bulk_pragmas: Dict | None = None,
+                 append_pragmas: Dict | None = None):
         self.db_name = db_name
-        self._pool = ConnectionPool(db_name)
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.bulk_pragmas = BULK_PRAGMAS if bulk_pragmas is None else bulk_pragmas
+        self.append_pragmas = APPEND_PRAGMAS if append_pragmas is None else append_pragmas
+        self._pool = get_pool(db_name, pragmas=self.pragmas)
 
     def connect(self) -> Connection:
         conn = sqlite3.connect(self.db_name, check_same_thread=False)
         # Optimize SQLite settings
-        conn.execute("PRAGMA journal_mode=WAL")
-        conn.execute("PRAGMA synchronous=NORMAL")
-        conn.execute("PRAGMA cache_size=10000")
-        conn.execute("PRAGMA temp_store=MEMORY")
+        apply_pragmas(conn, self.pragmas)
         return conn
 
+    @contextlib.contextmanager
+    def bulk_load(self, drop_indexes: Iterable[str] = ()):
+        """
+        Runs the enclosed block with ingest-optimized pragmas on a single
+        exclusive connection. An empty database gets the bulk pragmas, which
+        turn the journal off, so a failed first load must be restarted from
+        an empty file. Loads into an existing database use the append
+        pragmas instead. The listed indexes are dropped up front and rebuilt
+        on exit, then the safe settings are restored and ANALYZE runs.
+        """
+        fresh = self.is_empty()
+        pragmas = self.bulk_pragmas if fresh else self.append_pragmas
+        with self._pool.pinned(pragmas) as conn:
+            if fresh and pragmas.get("page_size") is not None:
+                # page_size only applies to an empty database after a VACUUM,
+                # which also works on a file already in WAL mode once the
+                # journal is off
+                conn.execute("VACUUM")
+
+            indexes = {}
+            for name in drop_indexes:
+                row = conn.execute(
+                    "SELECT sql FROM sqlite_master WHERE type='index' AND name=?", [name]
+                ).fetchone()
+                if row is not None:
+                    indexes[name] = row[0]
+                    conn.execute(f"DROP INDEX {name}")
+            try:
+                yield self
+            finally:
+                # The enclosed block may already have rebuilt some of them
+                for name, sql in indexes.items():
+                    if not self._index_exists(conn, name):
+                        conn.execute(sql)
+
+        with self._pool.get_connection() as conn:
+            conn.execute("ANALYZE")
+
+    def pool_metrics(self) -> Dict[str, float]:
+        return self._pool.metrics()
+
+    @contextlib.contextmanager
+    def group_commit(self, max_rows: int = 10_000, max_delay: float = 1.0, max_pending: int = 1000):
+        """
+        Routes the INSERT, REPLACE, UPDATE and DELETE statements of
+        execute_sql and insert_list, from every BaseDb of this database,
+        through a background GroupWriter until the block exits, then waits
+        for all the queued writes to commit. Other statements, such as DDL,
+        flush the writer and run directly, so their errors are raised to the
+        caller. Writes are not visible to readers until their group commits;
+        call flush on the yielded writer to wait for them. Nested blocks
+        share the outer writer.
+        """
+        writer = self._pool.group_writer
+        if writer is not None:
+            yield writer
+            return
+
+        writer = self._pool.group_writer = GroupWriter(self._pool, max_rows, max_delay, max_pending)
+        try:
+            yield writer
+        finally:
+            self._pool.group_writer = None
+            writer.close()
+
+    def _get_group_writer(self, sql: str) -> GroupWriter | None:
+        writer = self._pool.group_writer
+        if writer is None or writer.in_writer_thread():
+            return None
+        if GROUPED_STATEMENT.match(sql) is None:
+            writer.flush()
+            return None
+        return writer
+
+    @staticmethod
+    def _is_empty(conn: Connection) -> bool:
+        return conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+
+    @staticmethod
+    def _index_exists(conn: Connection, name: str) -> bool:
+        sql = "SELECT 1 FROM sqlite_master WHERE type='index' AND name=?"
+        return conn.execute(sql, [name]).fetchone() is not None
+
+    def is_empty(self) -> bool:
+        # A plain connection, so that checking does not set the journal mode
+        # or the page size of a new database file
+        if not path.exists(self.db_name):
+            return True
+        conn = sqlite3.connect(self.db_name)
+        try:
+            return self._is_empty(conn)
+        finally:
+            conn.close()
+
     def execute_sql(
         self, sql, parameters=None, many=False, batch_size: int = 1000
     ) -> None:
         if parameters is None:
             parameters = []
 
+        writer = self._get_group_writer(sql)
+        if writer is not None:
+            writer.execute(sql, parameters, many)
+            return
+
         with self._pool.get_connection() as conn:
             cur = conn.cursor()
             try:
@@ -78,8 +515,28 @@ class BaseDb(object):
             finally:
                 cur.close()
 
-    def query_df(self, sql: str, parameters=None) -> pd.DataFrame:
+    @contextlib.contextmanager
+    def transaction(self):
+        # Writes queued on a group writer were issued first, so they must
+        # commit first
+        writer = self._pool.group_writer
+        if writer is not None and not writer.in_writer_thread():
+            writer.flush()
+
         with self._pool.get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                conn.execute("BEGIN TRANSACTION")
+                yield cur
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+
+    def query_df(self, sql: str, parameters=None) -> pd.DataFrame:
+        with self._pool.get_connection(readonly=True) as conn:
             return sqlio.read_sql_query(sql, conn, params=parameters)
 
     def query_json(self, sql, parameters=None) -> str:
@@ -89,7 +546,7 @@ class BaseDb(object):
     def query(self, sql, parameters=None):
         if parameters is None:
             parameters = []
-        with self._pool.get_connection() as conn:
+        with self._pool.get_connection(readonly=True) as conn:
             cur = conn.cursor()
             result = list(cur.execute(sql, parameters))
             cur.close()
@@ -99,13 +556,74 @@ class BaseDb(object):
     def query_iterator(self, sql, parameters=None):
         if parameters is None:
             parameters = []
-        with self._pool.get_connection() as conn:
+        with self._pool.get_connection(readonly=True) as conn:
             cur = conn.cursor()
             try:
                 yield cur.execute(sql, parameters)
             finally:
                 cur.close()
 
+    def query_chunks(
+        self,
+        sql: str,
+        dtype: Dict[str, np.dtype] | np.dtype,
+        parameters=None,
+        chunk_size: int = 100_000,
+        as_columns: bool = False,
+    ) -> Iterator[np.ndarray | Dict[str, np.ndarray]]:
+        """
+        Streams a query result as typed NumPy chunks without going through
+        pandas, so large scans run in memory bounded by the chunk size
+        :param sql: Query text
+        :param dtype: Structured dtype, or mapping of column name to dtype,
+            in the order of the query's columns
+        :param parameters: Query parameters
+        :param chunk_size: Maximum number of rows per chunk
+        :param as_columns: Yield dictionaries of contiguous column arrays
+            instead of structured arrays
+        :return: Iterator over the result chunks
+        """
+        if not isinstance(dtype, np.dtype):
+            dtype = np.dtype(list(dtype.items()))
+
+        with self.query_iterator(sql, parameters) as cursor:
+            while rows := cursor.fetchmany(chunk_size):
+                chunk = np.array(rows, dtype=dtype)
+                if as_columns:
+                    yield {name: np.ascontiguousarray(chunk[name]) for name in dtype.names}
+                else:
+                    yield chunk
+
+    def table_dtypes(
+        self,
+        table: str,
+        columns: Iterable[str] | None = None,
+        overrides: Dict[str, np.dtype] | None = None,
+    ) -> Dict[str, np.dtype]:
+        """
+        Maps the declared column types of a table to NumPy dtypes. Nullable
+        INTEGER columns map to float64, so that NULL values become NaN.
+        :param table: Table name
+        :param columns: Columns to include, in order (defaults to all)
+        :param overrides: Explicit dtypes for some columns
+        :return: Ordered mapping of column name to dtype
+        """
+        declared = {}
+        for _, name, col_type, not_null, _, pk in self.query(f"PRAGMA table_info ('{table}')"):
+            col_type = col_type.upper()
+            if col_type == "INTEGER" and (not_null or pk):
+                declared[name] = np.dtype(np.int64)
+            elif col_type in ("INTEGER", "DOUBLE", "FLOAT", "REAL"):
+                declared[name] = np.dtype(np.float64)
+            else:
+                declared[name] = np.dtype(object)
+
+        if overrides is not None:
+            declared.update({name: np.dtype(dtype) for name, dtype in overrides.items()})
+        if columns is None:
+            return declared
+        return {name: declared[name] for name in columns}
+
     def query_scalar(self, sql, parameters=None):
         if parameters is None:
             parameters = []
@@ -125,18 +643,27 @@ class BaseDb(object):
         tables = set([table[0] for table in self.query(sql)])
         return table_name in tables
 
+    def view_exists(self, view_name: str) -> bool:
+        sql = "SELECT name FROM sqlite_master WHERE type='view' AND name=?"
+        return len(self.query(sql, [view_name])) > 0
+
+    def vacuum(self) -> None:
+        with self._pool.get_connection() as conn:
+            conn.execute("VACUUM")
+
     def ddl_script(self, filename: str) -> None:
-        with open(filename, "r") as f:
-            sql = f.read()
-            self.execute_sql(sql)
+        self.execute_sql(read_sql_file(filename))
 
     def insert_list(self, filename: str, values: List, batch_size: int = 1000) -> None:
+        sql = read_sql_file(filename)
+        writer = self._get_group_writer(sql)
+        if writer is not None:
+            writer.execute(sql, values, many=True)
+            return
+
         with self._pool.get_connection() as conn:
             cur = conn.cursor()
             try:
-                with open(filename, "r") as f:
-                    sql = f.read()
-
                 conn.execute("BEGIN TRANSACTION")
 
                 # Process in batches for better performance
@@ -0,0 +1,188 @@
+import asyncio
+import contextlib
+import time
+import weakref
+from os import path
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+import aiosqlite
+import pandas as pd
+
+from src.db.api import DEFAULT_PRAGMAS, WRITER_PRAGMAS
+
+
+class SharedTask:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncConnectionPool:
+    """
+    Lazily opened read-only aiosqlite connections for one database file.
+    Each connection runs on its own thread, so up to pool_size queries run
+    at the same time without blocking the event loop. The queries in flight
+    are tracked here, so every AsyncBaseDb of the pool shares them.
+    """
+
+    def __init__(self, db_name: str, pool_size: int = 5, pragmas: Dict | None = None):
+        self.db_name = db_name
+        self.pool_size = pool_size
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self._idle: List[aiosqlite.Connection] = []
+        self._readers = 0
+        self._readers_in_use = 0
+        self._cond = asyncio.Condition()
+        self.inflight: Dict[Hashable, SharedTask] = {}
+
+        self._checkouts = 0
+        self.coalesced = 0
+        self._wait_time = 0.0
+        self._max_in_use = 0
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(f"file:{path.abspath(self.db_name)}?mode=ro", uri=True)
+        pragmas = {k: v for k, v in self.pragmas.items() if k not in WRITER_PRAGMAS}
+        pragmas["query_only"] = 1
+        for name, value in pragmas.items():
+            await conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    @contextlib.asynccontextmanager
+    async def get_connection(self):
+        started = time.perf_counter()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._idle or self._readers < self.pool_size)
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                # Reserve the slot before the await, so concurrent callers
+                # cannot open more than pool_size connections
+                self._readers += 1
+                conn = None
+            self._readers_in_use += 1
+
+        if conn is None:
+            try:
+                conn = await self._connect()
+            except BaseException:
+                async with self._cond:
+                    self._readers -= 1
+                    self._readers_in_use -= 1
+                    self._cond.notify()
+                raise
+
+        self._checkouts += 1
+        self._wait_time += time.perf_counter() - started
+        self._max_in_use = max(self._max_in_use, self._readers_in_use)
+        try:
+            yield conn
+        finally:
+            async with self._cond:
+                self._readers_in_use -= 1
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "checkouts": self._checkouts,
+            "wait_time_s": self._wait_time,
+            "readers_open": self._readers,
+            "readers_in_use": self._readers_in_use,
+            "max_in_use": self._max_in_use,
+            "coalesced": self.coalesced,
+        }
+
+    async def close_all(self):
+        async with self._cond:
+            while self._idle:
+                await self._idle.pop().close()
+                self._readers -= 1
+
+
+# Pools belong to the event loop that opened them, then to the database file
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncConnectionPool]]" = \
+    weakref.WeakKeyDictionary()
+
+
+def get_async_pool(db_name: str, pool_size: int = 5, pragmas: Dict | None = None) -> AsyncConnectionPool:
+    pools = _pools.setdefault(asyncio.get_running_loop(), {})
+    key = path.abspath(db_name)
+    pool = pools.get(key)
+    if pool is None:
+        pool = pools[key] = AsyncConnectionPool(db_name, pool_size, pragmas)
+    return pool
+
+
+class AsyncBaseDb:
+    """
+    Read-only asyncio counterpart of BaseDb. Identical queries that are in
+    flight at the same time, from any AsyncBaseDb on the same pool, share
+    one execution, and a query is interrupted once every caller waiting on
+    it has been cancelled.
+    """
+
+    def __init__(self, db_name: str, pool_size: int = 5, pragmas: Dict | None = None):
+        self.db_name = db_name
+        self.pool_size = pool_size
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+
+    @property
+    def _pool(self) -> AsyncConnectionPool:
+        return get_async_pool(self.db_name, self.pool_size, self.pragmas)
+
+    async def _coalesce(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        pool = self._pool
+        shared = pool.inflight.get(key)
+        if shared is None:
+            shared = pool.inflight[key] = SharedTask(asyncio.ensure_future(factory()))
+            shared.task.add_done_callback(lambda _: pool.inflight.pop(key, None))
+        else:
+            pool.coalesced += 1
+
+        shared.waiters += 1
+        try:
+            # The shield keeps one caller's cancellation from cancelling the
+            # query for the others
+            return await asyncio.shield(shared.task)
+        finally:
+            shared.waiters -= 1
+            if shared.waiters == 0 and not shared.task.done():
+                shared.task.cancel()
+
+    async def _fetch(self, sql: str, parameters) -> Tuple[List[str], List[Tuple]]:
+        async with self._pool.get_connection() as conn:
+            try:
+                async with conn.execute(sql, parameters) as cur:
+                    rows = await cur.fetchall()
+                    columns = [column[0] for column in cur.description]
+            except asyncio.CancelledError:
+                # Stops the statement on the connection's thread, so it is
+                # free for the next caller
+                await conn.interrupt()
+                raise
+        return columns, rows
+
+    async def query(self, sql: str, parameters=None) -> List[Tuple]:
+        parameters = [] if parameters is None else list(parameters)
+        _, rows = await self._coalesce((sql, tuple(parameters)), lambda: self._fetch(sql, parameters))
+        return rows
+
+    async def query_df(self, sql: str, parameters=None) -> pd.DataFrame:
+        parameters = [] if parameters is None else list(parameters)
+        columns, rows = await self._coalesce((sql, tuple(parameters)), lambda: self._fetch(sql, parameters))
+        return pd.DataFrame.from_records(rows, columns=columns)
+
+    async def query_scalar(self, sql: str, parameters=None):
+        rows = await self.query(sql, parameters)
+        return rows[0][0]
+
+    async def table_exists(self, table_name: str) -> bool:
+        sql = "SELECT name FROM sqlite_master WHERE type='table' AND name=?"
+        return len(await self.query(sql, [table_name])) > 0
+
+    def pool_metrics(self) -> Dict[str, float]:
+        return self._pool.metrics()
+
+    async def close(self):
+        await self._pool.close_all()
@@ -0,0 +1,101 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable
+
+import numpy as np
+import pandas as pd
+
+
+def estimate_size(value: Any) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+
+class ByteLRUCache:
+    """
+    Thread-safe LRU cache bounded by the approximate size of its values in
+    bytes. Entries are tagged with the tables they were read from, so writes
+    to a table can invalidate them.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, tables: Iterable[str]) -> None:
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, frozenset(tables))
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tables: Iterable[str] | None = None) -> None:
+        with self._lock:
+            if tables is None:
+                keys = list(self._entries)
+            else:
+                tables = set(tables)
+                keys = [key for key, entry in self._entries.items() if entry[2] & tables]
+            for key in keys:
+                self._remove(key)
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.size_bytes -= size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# One cache per database file, shared by every EvedDb instance in the process
+_caches: Dict[str, ByteLRUCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(db_name: str, max_bytes: int) -> ByteLRUCache:
+    with _caches_lock:
+        cache = _caches.get(db_name)
+        if cache is None:
+            cache = _caches[db_name] = ByteLRUCache(max_bytes)
+        return cache
+
+
+def invalidate_cache(db_name: str, tables: Iterable[str] | None = None) -> None:
+    with _caches_lock:
+        cache = _caches.get(db_name)
+    if cache is not None:
+        cache.invalidate(tables)
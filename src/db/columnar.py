@@ -0,0 +1,106 @@
+import json
+import re
+from os import makedirs, path
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from src.db.api import BaseDb
+
+
+def is_h3_column(name: str) -> bool:
+    return re.fullmatch(r"h3_\d+", name) is not None
+
+
+def export_columnar(db: BaseDb, folder: str, chunk_size: int = 1_000_000) -> None:
+    """
+    Writes the signal table as one .npy file per column, sorted by trajectory
+    and time stamp, plus the traj_id and offsets index arrays.
+    :param db: Source database
+    :param folder: Target folder
+    :param chunk_size: Number of rows fetched at a time
+    """
+    makedirs(folder, exist_ok=True)
+
+    # Nullable integer columns are stored as float64, so NULL becomes NaN,
+    # except the H3 cells, which float64 cannot hold exactly. Their NULLs
+    # are exported as 0, the H3 null cell.
+    declared = db.table_dtypes("signal")
+    h3_columns = [name for name in declared if is_h3_column(name)]
+    dtypes = {"traj_id": np.dtype(np.int64)}
+    dtypes.update({name: np.dtype(np.int64) if name in h3_columns else dtype
+                   for name, dtype in declared.items()
+                   if dtype != np.dtype(object)})
+    columns = ", ".join(["t.traj_id"] + [f"COALESCE(s.{name}, 0)" if name in h3_columns else f"s.{name}"
+                                         for name in dtypes if name != "traj_id"])
+
+    count_sql = """
+    SELECT      COUNT(*)
+    FROM        signal s
+    INNER JOIN  trajectory t ON s.vehicle_id = t.vehicle_id AND s.trip_id = t.trip_id
+    """
+    sql = f"""
+    SELECT      {columns}
+    FROM        trajectory t
+    INNER JOIN  signal s ON s.vehicle_id = t.vehicle_id AND s.trip_id = t.trip_id
+    ORDER BY    t.traj_id, s.time_stamp
+    """
+    n = db.query_scalar(count_sql)
+
+    arrays = {name: np.lib.format.open_memmap(path.join(folder, f"{name}.npy"),
+                                               mode="w+", dtype=dtype, shape=(n,))
+              for name, dtype in dtypes.items()}
+
+    start = 0
+    for chunk in db.query_chunks(sql, dtypes, chunk_size=chunk_size):
+        for name, array in arrays.items():
+            array[start:start + len(chunk)] = chunk[name]
+        start += len(chunk)
+
+    for array in arrays.values():
+        array.flush()
+
+    traj_ids, starts = np.unique(arrays["traj_id"], return_index=True)
+    np.save(path.join(folder, "index_traj_id.npy"), traj_ids)
+    np.save(path.join(folder, "index_offsets.npy"), np.append(starts, n).astype(np.int64))
+
+    with open(path.join(folder, "columns.json"), "w") as f:
+        json.dump(list(dtypes), f)
+
+
+class ColumnarStore:
+    """
+    Read-only access to the columnar signal export. Trajectories are returned
+    as zero-copy slices of memory-mapped column files.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        with open(path.join(folder, "columns.json"), "r") as f:
+            self.columns = json.load(f)
+        self._traj_ids = np.load(path.join(folder, "index_traj_id.npy"))
+        self._offsets = np.load(path.join(folder, "index_offsets.npy"))
+        self._arrays = {}
+
+    def _column(self, name: str) -> np.ndarray:
+        if name not in self._arrays:
+            self._arrays[name] = np.load(path.join(self.folder, f"{name}.npy"), mmap_mode="r")
+        return self._arrays[name]
+
+    def _bounds(self, traj_id: int) -> slice:
+        i = np.searchsorted(self._traj_ids, traj_id)
+        if i == len(self._traj_ids) or self._traj_ids[i] != traj_id:
+            raise KeyError(traj_id)
+        return slice(int(self._offsets[i]), int(self._offsets[i + 1]))
+
+    def get_traj_ids(self) -> np.ndarray:
+        return self._traj_ids
+
+    def get_trajectory(self, traj_id: int, columns: List[str] | None = None) -> Dict[str, np.ndarray]:
+        bounds = self._bounds(traj_id)
+        return {name: self._column(name)[bounds] for name in (columns or self.columns)}
+
+    def get_trajectories(self,
+                         traj_ids: Iterable[int],
+                         columns: List[str] | None = None) -> Dict[int, Dict[str, np.ndarray]]:
+        return {traj_id: self.get_trajectory(traj_id, columns) for traj_id in traj_ids}
@@ -0,0 +1,268 @@
+import re
+import time
+from sqlite3 import Cursor
+from typing import Dict, List, Sequence
+
+from src.db.api import BaseDb
+from src.db.h3index import parent_sql
+
+KEY_COLUMNS = ["vehicle_id", "trip_id", "time_stamp", "signal_id"]
+FIXED_POINT_COLUMNS = ["latitude", "longitude", "match_latitude", "match_longitude"]
+CODED_COLUMNS = ["speed_limit", "focus_points"]
+# Columns with at least this share of NULLs move to the signal_sensor table
+SENSOR_NULL_RATIO = 0.5
+FIXED_POINT_SCALE = 10_000_000
+
+COMPACT_TABLES = ["signal_compact", "signal_sensor", "speed_limit_code", "focus_points_code"]
+COMPACT_INDEXES = ["ix_signal_compact_signal_id", "ix_signal_compact_h3_12"]
+COMPACT_INDEX_SQL = [
+    "CREATE INDEX ix_signal_compact_signal_id ON signal_compact (signal_id)",
+    "CREATE INDEX ix_signal_compact_h3_12 ON signal_compact (h3_12)",
+]
+
+
+def is_parent_column(name: str) -> bool:
+    return re.fullmatch(r"h3_\d+", name) is not None and name != "h3_12"
+
+
+def get_object_bytes(db: BaseDb, names: Sequence[str]) -> int:
+    sql = f"SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN ({', '.join('?' * len(names))})"
+    return db.query_scalar(sql, list(names))
+
+
+def get_signal_objects(db: BaseDb) -> List[str]:
+    sql = "SELECT name FROM sqlite_master WHERE tbl_name = 'signal' AND type IN ('table', 'index')"
+    return [row[0] for row in db.query(sql)]
+
+
+def time_trip_scans(db: BaseDb, pairs: Sequence[Sequence[int]]) -> float:
+    # Reads the columns of a typical trajectory query, as in get_trajectory
+    sql = """
+    SELECT      signal_id, day_num, time_stamp, match_latitude, match_longitude, speed
+    FROM        signal
+    WHERE       vehicle_id = ? AND trip_id = ?
+    ORDER BY    time_stamp
+    """
+    started = time.perf_counter()
+    for vehicle_id, trip_id in pairs:
+        db.query(sql, [vehicle_id, trip_id])
+    return time.perf_counter() - started
+
+
+def get_sparse_columns(db: BaseDb, columns: List[Sequence]) -> List[str]:
+    """
+    Measures the NULL ratio of the nullable numeric columns of the rowid
+    signal table, outside the key, coordinate, coded and H3 columns
+    :param db: Source database
+    :param columns: PRAGMA table_info rows of the signal table
+    :return: Columns that are NULL in at least SENSOR_NULL_RATIO of the rows
+    """
+    candidates = [column[1] for column in columns
+                  if column[1] not in KEY_COLUMNS + FIXED_POINT_COLUMNS + CODED_COLUMNS
+                  and not re.fullmatch(r"h3_\d+", column[1])
+                  and column[2].upper() in ("DOUBLE", "FLOAT", "REAL", "INTEGER")
+                  and not column[3] and not column[5]]
+    if not candidates:
+        return []
+
+    counts = db.query(f"SELECT COUNT(*), {', '.join(f'COUNT({name})' for name in candidates)} FROM signal")[0]
+    total = counts[0]
+    if total == 0:
+        return []
+    return [name for name, filled in zip(candidates, counts[1:]) if 1.0 - filled / total >= SENSOR_NULL_RATIO]
+
+
+def any_not_null(prefix: str, names: Sequence[str]) -> str:
+    return " OR ".join(f"{prefix}{name} IS NOT NULL" for name in names)
+
+
+def get_plain_columns(names: Sequence[str], sensors: Sequence[str]) -> List[str]:
+    # Columns kept as they are in signal_compact
+    return [name for name in names if name not in KEY_COLUMNS + FIXED_POINT_COLUMNS + CODED_COLUMNS
+            and name not in sensors and not is_parent_column(name)]
+
+
+def get_insert_columns(plain: Sequence[str]) -> List[str]:
+    return (KEY_COLUMNS + [f"{name}_e7" for name in FIXED_POINT_COLUMNS] +
+            [f"{name}_code" for name in CODED_COLUMNS] + list(plain))
+
+
+def compact_table_ddl(columns: List[Sequence], sensors: Sequence[str]) -> List[str]:
+    """
+    Builds the compact table statements from the PRAGMA table_info rows of
+    the rowid signal table. Columns outside the known groups are kept as they
+    are in signal_compact.
+    :param columns: PRAGMA table_info rows of the signal table
+    :param sensors: Columns moved to the signal_sensor side table
+    :return: List of statements
+    """
+    names = [column[1] for column in columns]
+    types = {column[1]: column[2] for column in columns}
+    not_null = {column[1]: " NOT NULL" if column[3] or column[5] else "" for column in columns}
+
+    main_columns = ([f"{name} INTEGER NOT NULL" for name in KEY_COLUMNS] +
+                    [f"{name}_e7 INTEGER{not_null[name]}" for name in FIXED_POINT_COLUMNS] +
+                    [f"{name}_code INTEGER" for name in CODED_COLUMNS] +
+                    [f"{name} {types[name]}{not_null[name]}" for name in get_plain_columns(names, sensors)])
+    statements = [
+        "CREATE TABLE signal_compact (\n    " + ",\n    ".join(main_columns) +
+        f",\n    PRIMARY KEY ({', '.join(KEY_COLUMNS)})\n) WITHOUT ROWID",
+        "CREATE TABLE signal_sensor (\n    " +
+        ",\n    ".join(["signal_id INTEGER PRIMARY KEY"] + [f"{name} {types[name]}" for name in sensors]) + "\n)",
+    ]
+    statements += [f"CREATE TABLE {name}_code (code INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)"
+                   for name in CODED_COLUMNS]
+    return statements
+
+
+def signal_view_ddl(names: Sequence[str], sensors: Sequence[str]) -> List[str]:
+    """
+    Builds the signal view and its INSTEAD OF triggers over the compact
+    tables
+    :param names: Columns of the view, in order, as in signal_schema
+    :param sensors: Columns of the signal_sensor side table
+    :return: List of statements
+    """
+    expressions = []
+    for name in names:
+        if name in FIXED_POINT_COLUMNS:
+            expressions.append(f"c.{name}_e7 / {FIXED_POINT_SCALE}.0 AS {name}")
+        elif name in CODED_COLUMNS:
+            expressions.append(f"k_{name}.value AS {name}")
+        elif name in sensors:
+            expressions.append(f"x.{name}")
+        elif is_parent_column(name):
+            expressions.append(f"{parent_sql('c.h3_12', int(name[3:]))} AS {name}")
+        else:
+            expressions.append(f"c.{name}")
+    statements = [
+        "CREATE VIEW signal AS\nSELECT  " + "\n,       ".join(expressions) +
+        "\nFROM    signal_compact c\nLEFT JOIN signal_sensor x ON x.signal_id = c.signal_id\n" +
+        "\n".join(f"LEFT JOIN {name}_code k_{name} ON k_{name}.code = c.{name}_code" for name in CODED_COLUMNS)]
+
+    # Writes through the view keep the incremental ingest working. A row
+    # without a signal_id gets the next one, so its sensor row takes the new
+    # maximum; any other row keeps its own key in both tables.
+    plain = get_plain_columns(names, sensors)
+    values = []
+    for name in KEY_COLUMNS + FIXED_POINT_COLUMNS + CODED_COLUMNS + plain:
+        if name == "signal_id":
+            values.append("COALESCE(NEW.signal_id, (SELECT COALESCE(MAX(signal_id), 0) + 1 FROM signal_compact))")
+        elif name in FIXED_POINT_COLUMNS:
+            values.append(f"CAST(ROUND(NEW.{name} * {FIXED_POINT_SCALE}) AS INTEGER)")
+        elif name in CODED_COLUMNS:
+            values.append(f"(SELECT code FROM {name}_code WHERE value = NEW.{name})")
+        else:
+            values.append(f"NEW.{name}")
+    sensor_insert = ""
+    if sensors:
+        sensor_insert = (
+            f"    INSERT INTO signal_sensor (signal_id, {', '.join(sensors)})\n"
+            f"    SELECT COALESCE(NEW.signal_id, (SELECT MAX(signal_id) FROM signal_compact)), "
+            f"{', '.join(f'NEW.{name}' for name in sensors)}\n"
+            f"    WHERE {any_not_null('NEW.', sensors)};\n")
+    statements.append(
+        "CREATE TRIGGER signal_insert INSTEAD OF INSERT ON signal\nBEGIN\n" +
+        "".join(f"    INSERT OR IGNORE INTO {name}_code (value) SELECT NEW.{name} WHERE NEW.{name} IS NOT NULL;\n"
+                for name in CODED_COLUMNS) +
+        f"    INSERT INTO signal_compact ({', '.join(get_insert_columns(plain))})\n"
+        f"    VALUES ({', '.join(values)});\n" +
+        sensor_insert +
+        "END")
+    statements.append(
+        "CREATE TRIGGER signal_delete INSTEAD OF DELETE ON signal\nBEGIN\n"
+        "    DELETE FROM signal_sensor WHERE signal_id = OLD.signal_id;\n"
+        "    DELETE FROM signal_compact WHERE vehicle_id = OLD.vehicle_id AND trip_id = OLD.trip_id\n"
+        "        AND time_stamp = OLD.time_stamp AND signal_id = OLD.signal_id;\n"
+        "END")
+    return statements
+
+
+def create_signal_view(cur: Cursor, resolutions: Sequence[int]) -> None:
+    """
+    Creates the signal view from the columns of signal_schema and
+    signal_sensor. The parent H3 columns of the given resolutions are added
+    to signal_schema first, so that the view and the declared types both
+    list them.
+    """
+    names = [row[1] for row in cur.execute("PRAGMA table_info ('signal_schema')").fetchall()]
+    sensors = [row[1] for row in cur.execute("PRAGMA table_info ('signal_sensor')").fetchall()
+               if row[1] != "signal_id"]
+    for name in [f"h3_{res}" for res in sorted(resolutions) if res < 12]:
+        if name not in names:
+            cur.execute(f"ALTER TABLE signal_schema ADD COLUMN {name} INTEGER")
+            names.append(name)
+    for statement in signal_view_ddl(names, sensors):
+        cur.execute(statement)
+
+
+def rebuild_signal_view(db: BaseDb, resolutions: Sequence[int]) -> None:
+    """
+    Recreates the signal view of the compact layout and its triggers, so it
+    exposes the parent H3 columns of new resolutions
+    """
+    with db.transaction() as cur:
+        cur.execute("DROP VIEW IF EXISTS signal")
+        create_signal_view(cur, resolutions)
+
+
+def migrate_signal_compact(db: BaseDb, resolutions: Sequence[int] = (), sample_trips: int = 50) -> Dict:
+    """
+    Converts the rowid signal table to the compact layout: a WITHOUT ROWID
+    table clustered on (vehicle_id, trip_id, time_stamp, signal_id), with
+    fixed-point coordinates (1e-7 degrees), integer-coded text columns and,
+    in a side table, the columns that are NULL in at least SENSOR_NULL_RATIO
+    of the rows, as measured before the migration. A view named signal keeps
+    the original columns and accepts inserts and deletes. An empty copy of
+    the original table, signal_schema, keeps its declared types.
+    :param db: Target database
+    :param resolutions: Parent H3 resolutions exposed by the view
+    :param sample_trips: Number of trips read to time the trip scans
+    :return: Report with the sizes and trip-scan times before and after
+    """
+    pairs = db.query("SELECT vehicle_id, trip_id FROM trajectory ORDER BY RANDOM() LIMIT ?", [sample_trips]) \
+        if db.table_exists("trajectory") else []
+    objects = get_signal_objects(db)
+    report = {
+        "rowid_bytes": get_object_bytes(db, objects),
+        "rowid_trip_scan_s": time_trip_scans(db, pairs),
+    }
+
+    columns = db.query("PRAGMA table_info ('signal')")
+    schema_sql = db.query_scalar("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'signal'")
+    sensors = get_sparse_columns(db, columns)
+    plain = get_plain_columns([column[1] for column in columns], sensors)
+
+    with db.transaction() as cur:
+        cur.execute(re.sub(r"\bsignal\b", "signal_schema", schema_sql, count=1))
+        for statement in compact_table_ddl(columns, sensors):
+            cur.execute(statement)
+        for name in CODED_COLUMNS:
+            cur.execute(f"INSERT INTO {name}_code (value) "
+                        f"SELECT DISTINCT {name} FROM signal WHERE {name} IS NOT NULL ORDER BY {name}")
+
+        selects = (KEY_COLUMNS +
+                   [f"CAST(ROUND(s.{name} * {FIXED_POINT_SCALE}) AS INTEGER)" for name in FIXED_POINT_COLUMNS] +
+                   [f"(SELECT code FROM {name}_code WHERE value = s.{name})" for name in CODED_COLUMNS] + plain)
+        cur.execute(f"INSERT INTO signal_compact ({', '.join(get_insert_columns(plain))}) "
+                    f"SELECT {', '.join(selects)} FROM signal s "
+                    f"ORDER BY {', '.join(KEY_COLUMNS)}")
+        if sensors:
+            cur.execute(f"INSERT INTO signal_sensor (signal_id, {', '.join(sensors)}) "
+                        f"SELECT signal_id, {', '.join(sensors)} FROM signal "
+                        f"WHERE {any_not_null('', sensors)}")
+
+        cur.execute("DROP TABLE signal")
+        create_signal_view(cur, resolutions)
+        for statement in COMPACT_INDEX_SQL:
+            cur.execute(statement)
+
+    db.vacuum()
+    report["sensor_columns"] = sensors
+    report["compact_bytes"] = get_object_bytes(db, COMPACT_TABLES + COMPACT_INDEXES)
+    report["compact_trip_scan_s"] = time_trip_scans(db, pairs)
+    report["size_ratio"] = report["compact_bytes"] / report["rowid_bytes"] if report["rowid_bytes"] else None
+    report["trip_scan_speedup"] = report["rowid_trip_scan_s"] / report["compact_trip_scan_s"] \
+        if report["compact_trip_scan_s"] > 0 else None
+    report["sample_trips"] = len(pairs)
+    return report
@@ -0,0 +1,109 @@
+import json
+import re
+from typing import List, Sequence
+
+from src.common.h3batch import H3_MAX_RES, H3_RES_OFFSET
+from src.db.api import BaseDb
+
+BASE_RESOLUTION = 12
+
+
+def h3_column(res: int) -> str:
+    return f"h3_{res}"
+
+
+def parent_sql(column: str, res: int) -> str:
+    # Same bit arithmetic as h3batch.cells_to_parent, evaluated by SQLite
+    unused_digits = (1 << ((H3_MAX_RES - res) * 3)) - 1
+    return (f"(({column} & ~(15 << {H3_RES_OFFSET})) | ({res} << {H3_RES_OFFSET}) "
+            f"| {unused_digits})")
+
+
+def get_parent_resolutions(db: BaseDb, table: str) -> List[int]:
+    """
+    Lists the resolutions of the h3_<res> parent columns a table already has
+    """
+    names = [column[1] for column in db.query(f"PRAGMA table_info ('{table}')")]
+    return sorted(int(name[3:]) for name in names
+                  if re.fullmatch(r"h3_\d+", name) and int(name[3:]) < BASE_RESOLUTION)
+
+
+def traj_ids_json(traj_ids: Sequence[int]) -> str:
+    return json.dumps([int(traj_id) for traj_id in traj_ids])
+
+
+def add_parent_columns(db: BaseDb, table: str, resolutions: Sequence[int],
+                       traj_ids: Sequence[int] | None = None) -> None:
+    """
+    Adds and fills the h3_<res> parent columns of the h3_12 column.
+    :param db: Target database
+    :param table: Table with an h3_12 column
+    :param resolutions: Parent resolutions, coarser than 12
+    :param traj_ids: Only fill the rows of these trajectories, in a table
+        with a traj_id column
+    """
+    resolutions = [res for res in resolutions if res < BASE_RESOLUTION]
+    if not resolutions:
+        return
+
+    with db.transaction() as cur:
+        for res in resolutions:
+            if db.table_has_column(table, h3_column(res)) is None:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN {h3_column(res)} INTEGER")
+        assignments = ", ".join(f"{h3_column(res)} = {parent_sql(h3_column(BASE_RESOLUTION), res)}"
+                                for res in resolutions)
+        if traj_ids is None:
+            cur.execute(f"UPDATE {table} SET {assignments}")
+        else:
+            cur.execute(f"UPDATE {table} SET {assignments} WHERE traj_id IN (SELECT value FROM json_each(?))",
+                        [traj_ids_json(traj_ids)])
+
+
+def fill_h3_traj(db: BaseDb, resolutions: Sequence[int], include_nodes: bool = True,
+                 include_geometry: bool = False, traj_ids: Sequence[int] | None = None) -> None:
+    """
+    Rebuilds the deduplicated (h3_cell, resolution, traj_id) inverted index
+    from the signal and, optionally, the node tables. The parent columns must
+    already exist.
+    :param db: Target database
+    :param resolutions: Indexed resolutions
+    :param include_nodes: Also index the map-matched nodes
+    :param include_geometry: Also index the cells of the map-matched
+        geometries, from the node_geometry_h3 side table
+    :param traj_ids: Only rebuild the rows of these trajectories, and drop
+        those of trajectories that no longer exist
+    """
+    if traj_ids is None:
+        scope, parameters = "", []
+    else:
+        scope, parameters = "AND {} IN (SELECT value FROM json_each(?))", [traj_ids_json(traj_ids)]
+
+    with db.transaction() as cur:
+        if traj_ids is None:
+            cur.execute("DELETE FROM h3_traj")
+        else:
+            cur.execute("DELETE FROM h3_traj WHERE traj_id IN (SELECT value FROM json_each(?))", parameters)
+            cur.execute("DELETE FROM h3_traj WHERE traj_id NOT IN (SELECT traj_id FROM trajectory)")
+        for res in resolutions:
+            column = h3_column(res)
+            cur.execute(f"""
+            INSERT OR IGNORE INTO h3_traj (h3_cell, resolution, traj_id)
+            SELECT DISTINCT s.{column}, {res}, t.traj_id
+            FROM        signal s
+            INNER JOIN  trajectory t ON s.vehicle_id = t.vehicle_id AND s.trip_id = t.trip_id
+            WHERE       s.{column} IS NOT NULL {scope.format("t.traj_id")}
+            """, parameters)
+            if include_nodes:
+                cur.execute(f"""
+                INSERT OR IGNORE INTO h3_traj (h3_cell, resolution, traj_id)
+                SELECT DISTINCT {column}, {res}, traj_id
+                FROM        node
+                WHERE       {column} IS NOT NULL {scope.format("traj_id")}
+                """, parameters)
+            if include_geometry:
+                cur.execute(f"""
+                INSERT OR IGNORE INTO h3_traj (h3_cell, resolution, traj_id)
+                SELECT DISTINCT {parent_sql(h3_column(BASE_RESOLUTION), res)}, {res}, traj_id
+                FROM        node_geometry_h3
+                WHERE       h3_12 IS NOT NULL {scope.format("traj_id")}
+                """, parameters)
@@ -0,0 +1,90 @@
+import json
+from os import path
+
+import numpy as np
+import pytest
+
+from src.bench.synthetic import generate_signals_zip, generate_vehicles_xlsx
+from src.build.signals import SIGNALS_ZIP
+from src.config import load_config
+from src.db.EvedDb import EvedDb
+
+REPO_FOLDER = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+def trajectory_points(traj_id: int, n: int = 30) -> np.ndarray:
+    # A straight drive, one point every ~11 m, away from every other trajectory
+    lats = 42.2 + 0.01 * traj_id + 0.0001 * np.arange(n)
+    lons = np.full(n, -83.7 - 0.01 * traj_id)
+    return np.column_stack([lats, lons])
+
+
+def write_config(folder, monkeypatch, **sections) -> None:
+    """
+    Writes a config.toml for a database in folder, with the given sections,
+    and makes it the current config
+    """
+    sections = {"database": {"folder": str(folder), "eved": "eved.db", **sections.get("database", {})},
+                **{name: section for name, section in sections.items() if name != "database"}}
+    lines = []
+    for name, section in sections.items():
+        lines.append(f"[{name}]")
+        lines.extend(f"{key}={json.dumps(value)}" for key, value in section.items())
+        lines.append("")
+    filename = folder / "config.toml"
+    filename.write_text("\n".join(lines))
+    monkeypatch.setenv("EVED_CONFIG", str(filename))
+    load_config.cache_clear()
+
+
+@pytest.fixture
+def eved_db(tmp_path, monkeypatch):
+    """
+    Points the config at a fresh database in tmp_path, with a signal and a
+    trajectory table holding five trajectories. The config sections are
+    written by the returned function, which then returns the EvedDb.
+    """
+    monkeypatch.chdir(REPO_FOLDER)
+
+    def make(valhalla: dict, nodes: dict | None = None) -> EvedDb:
+        write_config(tmp_path, monkeypatch, valhalla=valhalla, nodes=nodes or {})
+
+        db = EvedDb()
+        db.execute_sql("""
+        CREATE TABLE signal (signal_id INTEGER PRIMARY KEY, vehicle_id INTEGER NOT NULL, trip_id INTEGER NOT NULL,
+                             time_stamp INTEGER NOT NULL, latitude DOUBLE, longitude DOUBLE)
+        """)
+        db.execute_sql("CREATE TABLE trajectory (traj_id INTEGER PRIMARY KEY, vehicle_id INTEGER, trip_id INTEGER)")
+        for traj_id in range(1, 6):
+            db.execute_sql("INSERT INTO trajectory VALUES (?, ?, ?)", [traj_id, traj_id, 100 + traj_id])
+            rows = [(traj_id, 100 + traj_id, 1000 * i, lat, lon)
+                    for i, (lat, lon) in enumerate(trajectory_points(traj_id).tolist())]
+            db.execute_sql("INSERT INTO signal (vehicle_id, trip_id, time_stamp, latitude, longitude) "
+                           "VALUES (?, ?, ?, ?, ?)", rows, many=True)
+        return db
+
+    yield make
+    load_config.cache_clear()
+
+
+@pytest.fixture
+def eved_dataset(tmp_path, monkeypatch):
+    """
+    Points the config at an empty database and a small synthetic eVED
+    dataset in tmp_path. The returned function rewrites the signals zip with
+    the given number of members; with the same seed, the first members stay
+    the same.
+    """
+    monkeypatch.chdir(REPO_FOLDER)
+    data_folder = tmp_path / "data"
+    data_folder.mkdir()
+    generate_vehicles_xlsx(str(data_folder), 4)
+
+    def make(n_files: int, seed: int = 0, **sections) -> str:
+        generate_signals_zip(str(data_folder / SIGNALS_ZIP), n_files=n_files, n_vehicles=4,
+                             trips_per_file=2, points_per_trip=60, seed=seed)
+        write_config(tmp_path, monkeypatch, data={"folder": str(data_folder)}, **sections)
+        return str(data_folder / SIGNALS_ZIP)
+
+    yield make
+    load_config.cache_clear()
@@ -0,0 +1,49 @@
+import pytest
+
+from src.build.signals import build_signals
+from src.db.EvedDb import EvedDb
+
+TABLES = {
+    "traj_stats": "traj_id",
+    "cell_traj_stats": "resolution, h3_cell, traj_id",
+    "cell_stats": "resolution, h3_cell",
+}
+
+
+def snapshot(db: EvedDb):
+    return {table: db.query(f"SELECT * FROM {table} ORDER BY {key}") for table, key in TABLES.items()}
+
+
+def assert_snapshots_equal(actual, expected):
+    for table in TABLES:
+        assert len(actual[table]) == len(expected[table]), table
+        for got, want in zip(actual[table], expected[table]):
+            assert got == pytest.approx(want), table
+
+
+def test_incremental_refresh_matches_a_full_rebuild(eved_dataset):
+    eved_dataset(2)
+    build_signals()
+    db = EvedDb()
+    db.create_aggregates()
+    assert db.refresh_aggregates() == 16
+    assert db.refresh_aggregates() == 0
+
+    # Stats of the loaded trajectories are left alone by the next refresh
+    old_ids = db.get_trajectories()["traj_id"].tolist()
+    original = db.query_scalar("SELECT speed_max FROM traj_stats WHERE traj_id = ?", [old_ids[0]])
+    db.execute_sql("UPDATE traj_stats SET speed_max = -1 WHERE traj_id = ?", [old_ids[0]])
+
+    eved_dataset(3)
+    build_signals()
+    assert db.refresh_aggregates() == 8
+    assert db.query_scalar("SELECT speed_max FROM traj_stats WHERE traj_id = ?", [old_ids[0]]) == -1
+    new_ids = set(db.get_trajectories()["traj_id"].tolist()) - set(old_ids)
+    assert {row[0] for row in db.query("SELECT traj_id FROM traj_stats")} == set(old_ids) | new_ids
+
+    db.execute_sql("UPDATE traj_stats SET speed_max = ? WHERE traj_id = ?", [original, old_ids[0]])
+    incremental = snapshot(db)
+    for table in TABLES:
+        db.execute_sql(f"DELETE FROM {table}")
+    assert db.refresh_aggregates() == 24
+    assert_snapshots_equal(incremental, snapshot(db))
@@ -0,0 +1,208 @@
+import contextlib
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from src.db.api import BaseDb
+
+
+def test_bulk_load_sets_page_size_on_fresh_database(tmp_path):
+    db = BaseDb(str(tmp_path / "eved.sqlite"))
+    # Opens the pooled writer, which puts the new file in WAL mode first
+    assert not db.table_exists("signal")
+    assert db.is_empty()
+
+    with db.bulk_load() as bulk:
+        assert bulk.query_scalar("PRAGMA journal_mode") == "off"
+        bulk.execute_sql("CREATE TABLE signal (signal_id INTEGER PRIMARY KEY, value INTEGER)")
+        bulk.execute_sql("INSERT INTO signal (value) VALUES (?)", [[i] for i in range(1000)], many=True)
+
+    assert db.query_scalar("PRAGMA page_size") == 65536
+    assert db.query_scalar("PRAGMA journal_mode") == "wal"
+    assert not db.is_empty()
+
+
+def test_bulk_load_appends_with_journal(tmp_path):
+    db = BaseDb(str(tmp_path / "eved.sqlite"))
+    db.execute_sql("CREATE TABLE signal (signal_id INTEGER PRIMARY KEY, value INTEGER NOT NULL)")
+    db.execute_sql("INSERT INTO signal (value) VALUES (1)")
+
+    with db.bulk_load() as bulk:
+        assert bulk.query_scalar("PRAGMA journal_mode") == "wal"
+        with pytest.raises(sqlite3.IntegrityError), bulk.transaction() as cur:
+            cur.execute("INSERT INTO signal (value) VALUES (2)")
+            cur.execute("INSERT INTO signal (value) VALUES (NULL)")
+
+    assert db.query("SELECT value FROM signal") == [(1,)]
+
+
+def test_bulk_load_restores_dropped_indexes(tmp_path):
+    db = BaseDb(str(tmp_path / "eved.sqlite"))
+    db.execute_sql("CREATE TABLE signal (signal_id INTEGER PRIMARY KEY, trip_id INTEGER, h3_12 INTEGER)")
+    db.execute_sql("CREATE INDEX ix_signal_trip ON signal (trip_id)")
+    db.execute_sql("CREATE INDEX ix_signal_h3_12 ON signal (h3_12)")
+    index_sql = "SELECT name FROM sqlite_master WHERE type='index' ORDER BY name"
+
+    with db.bulk_load(drop_indexes=["ix_signal_trip", "ix_signal_h3_12", "ix_missing"]) as bulk:
+        assert bulk.query(index_sql) == []
+        bulk.execute_sql("INSERT INTO signal (trip_id, h3_12) VALUES (?, ?)", [[i, i] for i in range(100)], many=True)
+        # Rebuilt by the loader itself, so it is not created twice on exit
+        bulk.execute_sql("CREATE INDEX IF NOT EXISTS ix_signal_trip ON signal (trip_id)")
+
+    assert db.query(index_sql) == [("ix_signal_h3_12",), ("ix_signal_trip",)]
+
+
+def test_group_commit_batches_and_isolates_errors(tmp_path):
+    db = BaseDb(str(tmp_path / "eved.sqlite"))
+    db.execute_sql("CREATE TABLE node (node_id INTEGER PRIMARY KEY, traj_id INTEGER NOT NULL)")
+
+    def insert(first: int):
+        other = BaseDb(db.db_name)
+        for traj_id in range(first, first + 100):
+            other.execute_sql("INSERT INTO node (traj_id) VALUES (?)", [traj_id])
+
+    with db.group_commit(max_rows=50, max_delay=0.1, max_pending=10) as writer:
+        threads = [threading.Thread(target=insert, args=(i * 100,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.flush()
+        assert db.query_scalar("SELECT COUNT(*) FROM node") == 400
+
+        db.execute_sql("INSERT INTO node (traj_id) VALUES (NULL)")
+        db.execute_sql("INSERT INTO node (traj_id) VALUES (?)", [400])
+        with pytest.raises(sqlite3.IntegrityError):
+            writer.flush()
+
+        # DDL is not batched: it runs at once and raises on this thread
+        db.execute_sql("CREATE INDEX ix_node_traj_id ON node (traj_id)")
+        assert db.query_scalar("SELECT COUNT(*) FROM node") == 401
+        with pytest.raises(sqlite3.OperationalError):
+            db.execute_sql("CREATE INDEX ix_node_traj_id ON node (traj_id)")
+
+    assert db.query_scalar("SELECT COUNT(*) FROM node") == 401
+    assert db.query_scalar("SELECT COUNT(*) FROM sqlite_master WHERE name = 'ix_node_traj_id'") == 1
+
+
+def test_group_commit_does_not_block_new_readers(tmp_path):
+    db = BaseDb(str(tmp_path / "eved.sqlite"))
+    db.execute_sql("CREATE TABLE node (node_id INTEGER PRIMARY KEY, traj_id INTEGER NOT NULL)")
+
+    with db.group_commit(max_rows=1000, max_delay=2.0) as writer:
+        db.execute_sql("INSERT INTO node (traj_id) VALUES (1)")
+        time.sleep(0.1)
+        # Every reader is busy, so the query has to open a new one while the
+        # writer holds its batch open
+        with contextlib.ExitStack() as stack:
+            for _ in range(db._pool._readers):
+                stack.enter_context(db._pool.get_connection(readonly=True))
+            started = time.perf_counter()
+            assert db.query_scalar("SELECT COUNT(*) FROM node") == 0
+            assert time.perf_counter() - started < 1.0
+        writer.flush()
+
+
+def test_transaction_commits_after_queued_group_writes(tmp_path):
+    db = BaseDb(str(tmp_path / "eved.sqlite"))
+    db.execute_sql("CREATE TABLE node (node_id INTEGER PRIMARY KEY, traj_id INTEGER NOT NULL)")
+
+    with db.group_commit(max_rows=1000, max_delay=2.0):
+        db.execute_sql("INSERT INTO node (traj_id) VALUES (1)")
+        with db.transaction() as cur:
+            cur.execute("DELETE FROM node WHERE traj_id = 1")
+
+    assert db.query_scalar("SELECT COUNT(*) FROM node") == 0
+
+
+def test_group_writer_failure_is_raised(tmp_path):
+    db = BaseDb(str(tmp_path / "eved.sqlite"))
+    db.execute_sql("CREATE TABLE node (node_id INTEGER PRIMARY KEY, traj_id INTEGER NOT NULL)")
+
+    raised = []
+
+    def fail():
+        with pytest.raises(RuntimeError), db.group_commit(max_rows=1000, max_delay=1.0, max_pending=2) as writer:
+            db.execute_sql("INSERT INTO node (traj_id) VALUES (1)")
+            # Ends the batch's transaction, so its savepoint cannot be released
+            writer.call(lambda cur: cur.execute("ROLLBACK"))
+            for traj_id in range(2, 10):
+                db.execute_sql("INSERT INTO node (traj_id) VALUES (?)", [traj_id])
+            with pytest.raises(RuntimeError, match="group writer failed"):
+                writer.flush()
+            with pytest.raises(RuntimeError, match="group writer failed"):
+                db.execute_sql("INSERT INTO node (traj_id) VALUES (10)")
+        # Closing the writer raises too
+        raised.append(True)
+
+    # Run aside, so a hung writer fails the test instead of blocking it
+    thread = threading.Thread(target=fail, daemon=True)
+    thread.start()
+    thread.join(timeout=5.0)
+    assert raised == [True]
+    assert db.query_scalar("SELECT COUNT(*) FROM node") == 0
+    assert db.execute_sql("INSERT INTO node (traj_id) VALUES (11)") is None
+
+
+@pytest.fixture
+def chunk_db(tmp_path):
+    db = BaseDb(str(tmp_path / "eved.sqlite"))
+    db.execute_sql("CREATE TABLE signal (signal_id INTEGER PRIMARY KEY, trip_id INTEGER NOT NULL, "
+                   "time_stamp INTEGER, speed DOUBLE, latitude REAL, label TEXT)")
+    db.execute_sql("INSERT INTO signal (trip_id, time_stamp, speed, latitude, label) VALUES (?, ?, ?, ?, ?)",
+                   [[i // 10, 1000 * i, 0.5 * i, 42.0 + i / 1000, str(i)] for i in range(100)], many=True)
+    return db
+
+
+@pytest.mark.parametrize("limit, chunk_size, sizes", [
+    (0, 25, []),
+    (100, 25, [25, 25, 25, 25]),
+    (100, 30, [30, 30, 30, 10]),
+    (7, 100, [7]),
+])
+def test_query_chunks_boundaries(chunk_db, limit, chunk_size, sizes):
+    dtypes = chunk_db.table_dtypes("signal", ["signal_id", "speed"])
+    sql = "SELECT signal_id, speed FROM signal ORDER BY signal_id LIMIT ?"
+    chunks = list(chunk_db.query_chunks(sql, dtypes, parameters=[limit], chunk_size=chunk_size))
+    assert [len(chunk) for chunk in chunks] == sizes
+    if chunks:
+        rows = np.concatenate(chunks)
+        assert rows.dtype.names == ("signal_id", "speed")
+        assert rows["signal_id"].tolist() == list(range(1, limit + 1))
+        assert rows["speed"].tolist() == [0.5 * i for i in range(limit)]
+
+
+def test_query_chunks_as_columns(chunk_db):
+    dtypes = chunk_db.table_dtypes("signal", ["trip_id", "time_stamp"])
+    chunks = list(chunk_db.query_chunks("SELECT trip_id, time_stamp FROM signal ORDER BY signal_id", dtypes,
+                                        chunk_size=40, as_columns=True))
+    assert [len(chunk["trip_id"]) for chunk in chunks] == [40, 40, 20]
+    last = chunks[-1]
+    assert last["trip_id"].dtype == np.int64 and last["trip_id"].flags["C_CONTIGUOUS"]
+    assert last["trip_id"].tolist() == [i // 10 for i in range(80, 100)]
+    assert last["time_stamp"].dtype == np.float64
+
+
+def test_query_chunks_nulls_in_nullable_columns(chunk_db):
+    chunk_db.execute_sql("UPDATE signal SET time_stamp = NULL WHERE signal_id = 2")
+    dtypes = chunk_db.table_dtypes("signal", ["time_stamp"])
+    (chunk,) = chunk_db.query_chunks("SELECT time_stamp FROM signal WHERE signal_id <= 3", dtypes)
+    assert chunk["time_stamp"][0] == 0.0 and np.isnan(chunk["time_stamp"][1])
+
+
+def test_table_dtypes(chunk_db):
+    assert chunk_db.table_dtypes("signal") == {
+        "signal_id": np.dtype(np.int64),
+        "trip_id": np.dtype(np.int64),
+        # Nullable integers become floats, so NULL reads as NaN
+        "time_stamp": np.dtype(np.float64),
+        "speed": np.dtype(np.float64),
+        "latitude": np.dtype(np.float64),
+        "label": np.dtype(object),
+    }
+    assert list(chunk_db.table_dtypes("signal", ["label", "trip_id"])) == ["label", "trip_id"]
+    assert chunk_db.table_dtypes("signal", ["time_stamp"], overrides={"time_stamp": np.int64}) == {
+        "time_stamp": np.dtype(np.int64)}
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import aiosqlite
+import pytest
+
+from src.db.api import BaseDb
+from src.db.async_api import AsyncBaseDb
+
+# Runs for minutes unless interrupted
+SLOW_SQL = """
+WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000000000)
+SELECT COUNT(*) FROM n
+"""
+
+
+@pytest.fixture
+def db_name(tmp_path):
+    db = BaseDb(str(tmp_path / "eved.sqlite"))
+    db.execute_sql("CREATE TABLE signal (signal_id INTEGER PRIMARY KEY, value INTEGER)")
+    db.execute_sql("INSERT INTO signal (value) VALUES (?)", [[i] for i in range(1000)], many=True)
+    return db.db_name
+
+
+def count_fetches(monkeypatch):
+    calls = []
+    fetch = AsyncBaseDb._fetch
+
+    async def counting_fetch(self, sql, parameters):
+        calls.append(sql)
+        return await fetch(self, sql, parameters)
+
+    monkeypatch.setattr(AsyncBaseDb, "_fetch", counting_fetch)
+    return calls
+
+
+def test_identical_queries_run_once_across_instances(db_name, monkeypatch):
+    calls = count_fetches(monkeypatch)
+    sql = "SELECT SUM(value) FROM signal WHERE value >= ?"
+
+    async def run():
+        first, second = AsyncBaseDb(db_name), AsyncBaseDb(db_name)
+        results = await asyncio.gather(*[db.query_scalar(sql, [10]) for db in [first, second] * 10],
+                                       first.query_scalar(sql, [20]))
+        metrics = first.pool_metrics()
+        await first.close()
+        return results, metrics
+
+    results, metrics = asyncio.run(run())
+    assert results == [sum(range(10, 1000))] * 20 + [sum(range(20, 1000))]
+    assert len(calls) == 2
+    assert metrics["coalesced"] == 19
+
+
+def test_cancelled_query_is_interrupted(db_name, monkeypatch):
+    interrupted = []
+    interrupt = aiosqlite.Connection.interrupt
+
+    async def recording_interrupt(self):
+        interrupted.append(True)
+        await interrupt(self)
+
+    monkeypatch.setattr(aiosqlite.Connection, "interrupt", recording_interrupt)
+
+    async def run():
+        db = AsyncBaseDb(db_name)
+        first = asyncio.ensure_future(db.query_scalar(SLOW_SQL))
+        second = asyncio.ensure_future(AsyncBaseDb(db_name).query_scalar(SLOW_SQL))
+        await asyncio.sleep(0.2)
+
+        # The query keeps running while another caller waits on it
+        first.cancel()
+        await asyncio.sleep(0.1)
+        shared = not second.done() and interrupted == []
+
+        started = time.perf_counter()
+        second.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        # Let the shared task finish its interrupt and return the connection
+        while db.pool_metrics()["readers_in_use"] > 0:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        count = await db.query_scalar("SELECT COUNT(*) FROM signal")
+        await db.close()
+        return shared, elapsed, count
+
+    shared, elapsed, count = asyncio.run(run())
+    assert shared
+    assert interrupted == [True]
+    assert elapsed < 2.0
+    assert count == 1000
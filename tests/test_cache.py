@@ -0,0 +1,62 @@
+import numpy as np
+
+from src.build.signals import build_signals
+from src.db.cache import ByteLRUCache
+from src.db.EvedDb import EvedDb
+
+
+def block(value: int) -> np.ndarray:
+    # 800 bytes
+    return np.full(100, value, dtype=np.int64)
+
+
+def test_oldest_entries_are_evicted_over_the_budget():
+    cache = ByteLRUCache(2000)
+    cache.put("a", block(1), ["signal"])
+    cache.put("b", block(2), ["signal"])
+    assert cache.stats()["size_bytes"] == 1600
+
+    # Reading a refreshes it, so b is now the oldest
+    assert cache.get("a")[0] == 1
+    cache.put("c", block(3), ["node"])
+    assert cache.get("b") is None
+    assert cache.get("a")[0] == 1 and cache.get("c")[0] == 3
+
+    cache.put("d", np.zeros(200, dtype=np.int64), ["node"])
+    assert [key for key in "abcd" if cache.get(key) is not None] == ["d"]
+    stats = cache.stats()
+    assert (stats["entries"], stats["size_bytes"], stats["evictions"]) == (1, 1600, 3)
+
+
+def test_entries_larger_than_the_budget_are_not_kept():
+    cache = ByteLRUCache(2000)
+    cache.put("a", block(1), ["signal"])
+    cache.put("big", np.zeros(300, dtype=np.int64), ["signal"])
+    assert cache.get("big") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 0
+
+
+def test_invalidation_by_table():
+    cache = ByteLRUCache(10_000)
+    cache.put("a", block(1), ["signal", "trajectory"])
+    cache.put("b", block(2), ["node"])
+    cache.invalidate(["trajectory"])
+    assert cache.get("a") is None and cache.get("b") is not None
+    cache.invalidate()
+    assert cache.stats()["entries"] == 0 and cache.stats()["size_bytes"] == 0
+
+
+def test_writes_clear_cached_results(eved_dataset):
+    eved_dataset(1)
+    build_signals()
+    db = EvedDb(cache_bytes=10_000_000)
+    first = db.get_trajectories()
+    assert len(db.get_trajectories()) == len(first) == 8
+    assert db.cache_stats()["hits"] == 1
+
+    # Another instance appends a member, which invalidates the shared cache
+    eved_dataset(2)
+    build_signals()
+    assert len(db.get_trajectories()) == 16
+    assert db.cache_stats()["misses"] == 2
@@ -0,0 +1,38 @@
+import h3
+import numpy as np
+
+from src.db.api import BaseDb
+from src.db.columnar import ColumnarStore, export_columnar
+from src.db.h3index import add_parent_columns
+
+
+def test_export_keeps_h3_cells(tmp_path):
+    db = BaseDb(str(tmp_path / "eved.sqlite"))
+    db.execute_sql("CREATE TABLE trajectory (traj_id INTEGER PRIMARY KEY, vehicle_id INTEGER, trip_id INTEGER)")
+    db.execute_sql("""
+    CREATE TABLE signal (vehicle_id INTEGER NOT NULL, trip_id INTEGER NOT NULL, time_stamp INTEGER NOT NULL,
+                         latitude DOUBLE, longitude DOUBLE, h3_12 INTEGER)
+    """)
+    db.execute_sql("INSERT INTO trajectory VALUES (1, 10, 100), (2, 11, 200)")
+
+    rng = np.random.default_rng(7)
+    rows = []
+    for vehicle_id, trip_id in [(10, 100), (11, 200)]:
+        for time_stamp in range(50):
+            lat, lng = 42.2 + rng.random() * 0.2, -83.8 + rng.random() * 0.2
+            rows.append((vehicle_id, trip_id, time_stamp, lat, lng, h3.str_to_int(h3.latlng_to_cell(lat, lng, 12))))
+    rows.append((11, 200, 50, None, None, None))
+    db.execute_sql("INSERT INTO signal VALUES (?, ?, ?, ?, ?, ?)", rows, many=True)
+    add_parent_columns(db, "signal", [7, 9])
+
+    folder = tmp_path / "columnar"
+    export_columnar(db, str(folder))
+    store = ColumnarStore(str(folder))
+
+    for traj_id, vehicle_id, trip_id in [(1, 10, 100), (2, 11, 200)]:
+        exported = store.get_trajectory(traj_id, ["h3_12", "h3_7", "h3_9"])
+        expected = db.query("SELECT COALESCE(h3_12, 0), COALESCE(h3_7, 0), COALESCE(h3_9, 0) FROM signal "
+                            "WHERE vehicle_id = ? AND trip_id = ? ORDER BY time_stamp", [vehicle_id, trip_id])
+        for i, name in enumerate(["h3_12", "h3_7", "h3_9"]):
+            assert exported[name].dtype == np.int64
+            assert exported[name].tolist() == [row[i] for row in expected]
@@ -0,0 +1,166 @@
+import h3
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.build.signals import store_member
+from src.db.columnar import ColumnarStore, export_columnar
+from src.db.compact import is_parent_column, rebuild_signal_view
+from src.db.EvedDb import EvedDb
+from tests.conftest import REPO_FOLDER, write_config
+
+SPARSE = ["maf", "rpm", "fuel_rate"]
+
+
+@pytest.fixture
+def signal_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO_FOLDER)
+    write_config(tmp_path, monkeypatch, database={"signal_layout": "compact"}, h3={"resolutions": [7, 9]})
+    db = EvedDb()
+    db.ddl_script("sql/eved/create_signal.sql")
+    db.create_signal_manifest()
+    db.execute_sql("CREATE TABLE trajectory (traj_id INTEGER PRIMARY KEY, vehicle_id INTEGER, trip_id INTEGER)")
+    db.execute_sql("INSERT INTO trajectory VALUES (1, 10, 100), (2, 10, 101), (3, 11, 200)")
+    yield db
+
+
+def get_columns(db: EvedDb):
+    return [name for name in db.table_dtypes("signal") if name != "signal_id" and not is_parent_column(name)]
+
+
+def signal_frame(db: EvedDb, vehicle_id: int, trip_id: int, n: int, seed: int) -> pd.DataFrame:
+    # Rows in the column order of insert_signal.sql, as read_member yields them
+    rng = np.random.default_rng(seed)
+    data = {}
+    for name, dtype in db.table_dtypes("signal").items():
+        if name == "signal_id" or is_parent_column(name):
+            continue
+        data[name] = rng.normal(10.0, 3.0, n) if dtype == np.float64 else rng.integers(0, 5, n)
+    data["day_num"] = np.full(n, 3.25)
+    data["vehicle_id"] = np.full(n, vehicle_id)
+    data["trip_id"] = np.full(n, trip_id)
+    data["time_stamp"] = 1000 * np.arange(n)
+    data["latitude"] = 42.2 + 0.1 * rng.random(n)
+    data["longitude"] = -83.8 + 0.1 * rng.random(n)
+    data["match_latitude"] = data["latitude"] + 1e-5
+    data["match_longitude"] = data["longitude"] - 1e-5
+    data["speed_limit"] = rng.choice(["40", "56;72", None], n)
+    data["focus_points"] = rng.choice(["traffic signals", None, None], n)
+    data["h3_12"] = [h3.str_to_int(h3.latlng_to_cell(lat, lng, 12))
+                     for lat, lng in zip(data["match_latitude"], data["match_longitude"])]
+    df = pd.DataFrame(data)
+    # Sensors of one powertrain, reported together by a fifth of the rows
+    reported = rng.random(n) < 0.2
+    for name in SPARSE:
+        df[name] = df[name].where(reported, None)
+    df["elevation"] = df["elevation"].where(rng.random(n) < 0.9, None)
+    return df.rename(columns={"vehicle_id": "VehId", "trip_id": "Trip"})
+
+
+def load(db: EvedDb, member: str, frames, stale_range=None, crc: int = 1):
+    return store_member(db, member, 100, crc, stale_range, frames)
+
+
+def assert_rows_equal(actual, expected):
+    assert len(actual) == len(expected)
+    for got, want in zip(actual, expected):
+        for a, b in zip(got, want):
+            if isinstance(b, float):
+                # Coordinates are stored to 1e-7 degrees
+                assert a == pytest.approx(b, abs=1e-7)
+            else:
+                assert a == b
+
+
+def test_migration_round_trip(signal_db):
+    db = signal_db
+    load(db, "a.csv", [signal_frame(db, 10, 100, 200, 1), signal_frame(db, 10, 101, 150, 2)])
+    load(db, "b.csv", [signal_frame(db, 11, 200, 250, 3)])
+    columns = get_columns(db)
+    sql = f"SELECT signal_id, {', '.join(columns)} FROM signal ORDER BY signal_id"
+    before = db.query(sql)
+
+    report = db.migrate_signal_layout()
+    assert db.is_signal_compact()
+    # Only the columns that are mostly NULL move to the side table
+    assert report["sensor_columns"] == SPARSE
+    assert db.query_scalar("SELECT COUNT(*) FROM signal_sensor") < 0.5 * len(before)
+    assert_rows_equal(db.query(sql), before)
+
+    # The view also exposes the parent cells, and the declared types list them
+    assert {"h3_7", "h3_9"} <= set(db.table_dtypes("signal"))
+    for h3_12, h3_7, h3_9 in db.query("SELECT h3_12, h3_7, h3_9 FROM signal LIMIT 20"):
+        assert h3_7 == h3.str_to_int(h3.cell_to_parent(h3.int_to_str(h3_12), 7))
+        assert h3_9 == h3.str_to_int(h3.cell_to_parent(h3.int_to_str(h3_12), 9))
+
+
+def test_incremental_ingest_through_the_view(signal_db):
+    db = signal_db
+    load(db, "a.csv", [signal_frame(db, 10, 100, 200, 1)])
+    db.migrate_signal_layout()
+    columns = get_columns(db)
+
+    # New rows get ids past the maximum, with their sensor values
+    frame = signal_frame(db, 11, 200, 50, 4)
+    load(db, "b.csv", [frame])
+    added = db.query(f"SELECT {', '.join(columns)} FROM signal WHERE signal_id > 200 ORDER BY signal_id")
+    assert_rows_equal(added, [tuple(None if pd.isna(v) else v for v in row)
+                              for row in frame.itertuples(index=False)])
+
+    # A row with an explicit id below the maximum keeps its own sensor values
+    db.execute_sql("DELETE FROM signal WHERE signal_id = 10")
+    db.execute_sql("INSERT INTO signal (signal_id, day_num, vehicle_id, trip_id, time_stamp, latitude, longitude, "
+                   "match_latitude, match_longitude, match_type, step_m, cum_m, dt_ms, maf, rpm) "
+                   "VALUES (10, 3.25, 10, 100, 9500, 42.25, -83.75, 42.25, -83.75, 1, 0.0, 0.0, 0, 1.5, 2.5)")
+    assert db.query("SELECT maf, rpm FROM signal WHERE signal_id = 10") == [(1.5, 2.5)]
+    last = db.query("SELECT maf, rpm FROM signal WHERE signal_id = 250")
+    assert last == [tuple(None if pd.isna(v) else v for v in frame[["maf", "rpm"]].iloc[-1])]
+    assert db.query_scalar("SELECT COUNT(*) FROM signal_sensor WHERE signal_id NOT IN "
+                           "(SELECT signal_id FROM signal_compact)") == 0
+
+
+def test_changed_member_reload(signal_db):
+    db = signal_db
+    load(db, "a.csv", [signal_frame(db, 10, 100, 200, 1)])
+    load(db, "b.csv", [signal_frame(db, 11, 200, 100, 2)])
+    db.migrate_signal_layout()
+    columns = get_columns(db)
+    sql = f"SELECT {', '.join(columns)} FROM signal WHERE vehicle_id = ? ORDER BY time_stamp"
+    untouched = db.query(sql, [11])
+
+    frame = signal_frame(db, 10, 100, 120, 5)
+    pairs = load(db, "a.csv", [frame], stale_range=(1, 200), crc=2)
+    assert pairs == {(10, 100)}
+    assert db.query_scalar("SELECT COUNT(*) FROM signal") == 220
+    assert db.query("SELECT MIN(signal_id), MAX(signal_id) FROM signal WHERE vehicle_id = 10") == [(301, 420)]
+    assert db.query("SELECT rows, first_signal_id, last_signal_id FROM signal_manifest WHERE member = 'a.csv'") == [
+        (120, 301, 420)]
+    assert_rows_equal(db.query(sql, [10]), [tuple(None if pd.isna(v) else v for v in row)
+                                            for row in frame.itertuples(index=False)])
+    assert db.query(sql, [11]) == untouched
+    assert db.query_scalar("SELECT COUNT(*) FROM signal_sensor WHERE signal_id <= 200") == 0
+
+
+def test_view_follows_new_resolutions(signal_db, tmp_path):
+    db = signal_db
+    load(db, "a.csv", [signal_frame(db, 10, 100, 80, 1), signal_frame(db, 10, 101, 40, 2)])
+    db.migrate_signal_layout()
+
+    rebuild_signal_view(db, [5, 7, 9])
+    assert "h3_5" in db.table_dtypes("signal")
+    for h3_12, h3_5 in db.query("SELECT h3_12, h3_5 FROM signal LIMIT 20"):
+        assert h3_5 == h3.str_to_int(h3.cell_to_parent(h3.int_to_str(h3_12), 5))
+    # The triggers are recreated with the view
+    load(db, "b.csv", [signal_frame(db, 11, 200, 10, 3)])
+    assert db.query_scalar("SELECT COUNT(*) FROM signal") == 130
+
+    folder = tmp_path / "columnar"
+    export_columnar(db, str(folder))
+    store = ColumnarStore(str(folder))
+    assert {"h3_5", "h3_7", "h3_9", "h3_12"} <= set(store.columns)
+    exported = store.get_trajectory(1, ["h3_12", "h3_5", "h3_7"])
+    expected = db.query("SELECT h3_12, h3_5, h3_7 FROM signal WHERE vehicle_id = 10 AND trip_id = 100 "
+                        "ORDER BY time_stamp")
+    for i, name in enumerate(["h3_12", "h3_5", "h3_7"]):
+        assert exported[name].dtype == np.int64
+        assert exported[name].tolist() == [row[i] for row in expected]
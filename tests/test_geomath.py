@@ -0,0 +1,95 @@
+import math
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.bench.synthetic import generate_signals_zip
+from src.build.signals import KINEMATICS_SOURCES, add_kinematics, read_member
+from src.common.geomath import (cumulative_distances, num_haversine, segment_bearings, segment_deltas,
+                                segment_distances, vec_haversine)
+
+# One degree of a great circle on the sphere used by the kernels
+DEGREE_M = 6378137.0 * math.pi / 180.0
+KINEMATICS = ["step_m", "cum_m", "heading_deg", "dt_ms", "accel_mps2"]
+
+
+def test_haversine_known_distances():
+    assert num_haversine(0.0, 0.0, 1.0, 0.0) == pytest.approx(DEGREE_M)
+    assert num_haversine(0.0, 0.0, 0.0, 1.0) == pytest.approx(DEGREE_M)
+    assert num_haversine(60.0, 10.0, 60.0, 11.0) == pytest.approx(
+        2 * 6378137.0 * math.asin(0.5 * math.sin(math.radians(0.5))), rel=1e-12)
+    distances = vec_haversine(np.array([0.0, 0.0, 42.3]), np.array([0.0, 0.0, -83.7]),
+                              np.array([1.0, 0.0, 42.3]), np.array([0.0, 90.0, -83.7]))
+    np.testing.assert_allclose(distances, [DEGREE_M, 90 * DEGREE_M, 0.0])
+
+
+def test_segment_distances_restart_at_each_group():
+    lats = np.array([0.0, 1.0, 3.0, 10.0, 10.0, 12.0])
+    lons = np.zeros(6)
+    starts = np.array([0, 3])
+    steps = segment_distances(lats, lons, starts)
+    np.testing.assert_allclose(steps, np.array([0.0, 1.0, 2.0, 0.0, 0.0, 2.0]) * DEGREE_M)
+    np.testing.assert_allclose(cumulative_distances(steps, starts),
+                               np.array([0.0, 1.0, 3.0, 0.0, 0.0, 2.0]) * DEGREE_M)
+    assert len(segment_distances(np.empty(0), np.empty(0), np.empty(0, dtype=np.int64))) == 0
+
+
+def test_cumulative_distances():
+    steps = np.array([0.0, 1.0, 2.0, 0.0, 4.0, 5.0, 0.0])
+    out = np.empty(7)
+    result = cumulative_distances(steps, np.array([0, 3, 6]), out=out)
+    assert result is out
+    assert result.tolist() == [0.0, 1.0, 3.0, 0.0, 4.0, 9.0, 0.0]
+
+
+def test_segment_bearings():
+    lats = np.array([0.0, 1.0, 1.0, 0.0, 0.0])
+    lons = np.array([0.0, 0.0, 1.0, 1.0, 0.0])
+    bearings = segment_bearings(lats, lons, np.array([0]))
+    assert math.isnan(bearings[0])
+    np.testing.assert_allclose(bearings[1:], [0.0, 90.0, 180.0, 270.0], atol=0.01)
+
+
+def test_segment_deltas_keep_the_dtype():
+    time_stamps = np.array([0, 1000, 3000, 500, 1500], dtype=np.int64)
+    deltas = segment_deltas(time_stamps, np.array([0, 3]))
+    assert deltas.dtype == np.int64
+    assert deltas.tolist() == [0, 1000, 2000, 0, 1000]
+
+
+def test_add_kinematics_known_values():
+    # North along a meridian, 0.001 degrees per second, speeding up 36 km/h a second
+    df = pd.DataFrame({
+        "VehId": [1, 1, 1, 2],
+        "Trip": [5, 5, 5, 7],
+        "Timestamp(ms)": [0, 1000, 2000, 0],
+        "Matchted Latitude[deg]": [0.0, 0.001, 0.002, 5.0],
+        "Matched Longitude[deg]": [0.0, 0.0, 0.0, 5.0],
+        "Vehicle Speed[km/h]": [0.0, 36.0, 72.0, 50.0],
+    })
+    last = add_kinematics(df)
+    step = 0.001 * DEGREE_M
+    np.testing.assert_allclose(df["step_m"], [0.0, step, step, 0.0])
+    np.testing.assert_allclose(df["cum_m"], [0.0, step, 2 * step, 0.0])
+    np.testing.assert_allclose(df["heading_deg"], [np.nan, 0.0, 0.0, np.nan], atol=1e-9)
+    assert df["dt_ms"].tolist() == [0, 1000, 1000, 0]
+    np.testing.assert_allclose(df["accel_mps2"], [np.nan, 10.0, 10.0, np.nan])
+    assert last["cum_m"] == 0.0
+
+
+@pytest.mark.parametrize("chunk_size", [7, 60, 113])
+def test_kinematics_do_not_depend_on_the_chunk_size(tmp_path, chunk_size):
+    filename = str(tmp_path / "eVED.zip")
+    generate_signals_zip(filename, n_files=1, n_vehicles=3, trips_per_file=2, points_per_trip=60, seed=3)
+    with ZipFile(filename) as zf:
+        member = zf.namelist()[0]
+        whole = pd.concat(read_member(zf, member, chunk_size=10_000), ignore_index=True)
+        chunks = list(read_member(zf, member, chunk_size=chunk_size))
+    assert len(chunks) == math.ceil(len(whole) / chunk_size)
+
+    chunked = pd.concat(chunks, ignore_index=True)
+    pd.testing.assert_frame_equal(chunked[KINEMATICS_SOURCES], whole[KINEMATICS_SOURCES])
+    for name in KINEMATICS:
+        np.testing.assert_allclose(chunked[name], whole[name], rtol=1e-12, err_msg=name)
@@ -0,0 +1,53 @@
+import sqlite3
+
+import h3
+import numpy as np
+import pytest
+
+from src.common.h3batch import cells_to_parent, latlng_to_cells, latlng_to_cells_multi
+from src.db.h3index import parent_sql
+
+
+def random_points(seed: int, n: int = 2000):
+    rng = np.random.default_rng(seed)
+    lats = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, n)))
+    lngs = rng.uniform(-180.0, 180.0, n)
+    return lats, lngs
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("base", [12, 15])
+def test_cells_to_parent_matches_h3(seed, base):
+    lats, lngs = random_points(seed)
+    cells = np.array([h3.str_to_int(h3.latlng_to_cell(lat, lng, base)) for lat, lng in zip(lats, lngs)],
+                     dtype=np.int64)
+    for res in [0, 1, 5, 7, 9, 11, base]:
+        expected = [h3.str_to_int(h3.cell_to_parent(h3.int_to_str(int(cell)), res)) for cell in cells]
+        assert cells_to_parent(cells, res).tolist() == expected
+
+
+def test_parent_sql_matches_cells_to_parent():
+    lats, lngs = random_points(7, 200)
+    cells = latlng_to_cells(lats, lngs, 12)
+    conn = sqlite3.connect(":memory:")
+    for res in [5, 7, 9, 12]:
+        parents = [conn.execute(f"SELECT {parent_sql('?', res)}", [int(cell)]).fetchone()[0] for cell in cells]
+        assert parents == cells_to_parent(cells, res).tolist()
+
+
+def test_latlng_to_cells_matches_h3():
+    lats, lngs = random_points(3)
+    result = latlng_to_cells_multi(lats, lngs, [7, 9, 12], chunk_size=300)
+    finest = [h3.latlng_to_cell(lat, lng, 12) for lat, lng in zip(lats, lngs)]
+    # Coarser cells are the parents of the finest one, which is not always
+    # the cell that contains the point
+    for res, cells in result.items():
+        assert cells.dtype == np.int64
+        assert cells.tolist() == [h3.str_to_int(h3.cell_to_parent(cell, res)) for cell in finest]
+
+
+def test_empty_arrays():
+    empty = np.empty(0, dtype=np.int64)
+    assert cells_to_parent(empty, 7).shape == (0,)
+    assert cells_to_parent(empty, 7).dtype == np.int64
+    assert latlng_to_cells(np.empty(0), np.empty(0), 12).shape == (0,)
@@ -0,0 +1,62 @@
+from src.build import nodes
+from src.build.nodes import build_nodes
+from src.build.signals import build_signals
+from src.build.valhalla import FakeBackend
+from src.db.EvedDb import EvedDb
+from src.db.h3index import parent_sql
+
+H3_TRAJ_SQL = "SELECT h3_cell, resolution, traj_id FROM h3_traj ORDER BY h3_cell, resolution, traj_id"
+
+
+def assert_index_is_current(db: EvedDb) -> None:
+    # A full rebuild must not change anything
+    refreshed = db.query(H3_TRAJ_SQL)
+    db.create_h3_index()
+    assert refreshed == db.query(H3_TRAJ_SQL)
+
+
+def test_appended_signals_fill_the_h3_index(eved_dataset):
+    eved_dataset(2)
+    build_signals()
+    db = EvedDb()
+    db.create_h3_index()
+    first_ids = set(db.get_trajectories()["traj_id"].tolist())
+
+    eved_dataset(3)
+    build_signals()
+    new_ids = set(db.get_trajectories()["traj_id"].tolist()) - first_ids
+    assert len(new_ids) == 8
+    assert db.query_scalar("SELECT COUNT(*) FROM signal WHERE h3_7 IS NULL OR h3_9 IS NULL") == 0
+    assert db.query_scalar(f"SELECT COUNT(*) FROM signal WHERE h3_9 IS NOT {parent_sql('h3_12', 9)}") == 0
+
+    cell = db.query_scalar("SELECT s.h3_9 FROM signal s INNER JOIN trajectory t "
+                           "ON s.vehicle_id = t.vehicle_id AND s.trip_id = t.trip_id WHERE t.traj_id = ?",
+                           [min(new_ids)])
+    assert min(new_ids) in db.get_cell_trajectories([cell], 9)["traj_id"].tolist()
+    assert_index_is_current(db)
+
+
+def test_matched_nodes_fill_the_h3_index(eved_dataset, monkeypatch):
+    eved_dataset(1, valhalla={"backend": "fake"})
+    build_signals()
+    db = EvedDb()
+    build_nodes(concurrency=2)
+    db.create_h3_index()
+
+    # Rematching a trajectory puts its nodes somewhere else
+    moved = db.get_trajectories()["traj_id"].tolist()[0]
+
+    class MovingBackend(FakeBackend):
+        def trace_route(self, param):
+            for point in param["shape"]:
+                point["lat"] += 0.5
+            return super().trace_route(param)
+
+    monkeypatch.setattr(nodes, "get_match_backend", lambda pool_size=None: MovingBackend())
+    db.execute_sql("UPDATE match_status SET status = 'error' WHERE traj_id = ?", [moved])
+    build_nodes(concurrency=2, retry_errors=True)
+
+    assert db.query_scalar("SELECT COUNT(*) FROM node WHERE latitude IS NOT NULL AND h3_9 IS NULL") == 0
+    cell = db.query_scalar("SELECT h3_9 FROM node WHERE traj_id = ? LIMIT 1", [moved])
+    assert db.get_cell_trajectories([cell], 9)["traj_id"].tolist() == [moved]
+    assert_index_is_current(db)
@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+from src.build import nodes
+from src.build.nodes import build_nodes
+from src.build.valhalla import FakeBackend
+from src.common.metrics import metrics
+from tests.conftest import trajectory_points, write_config
+
+
+class RecordingBackend(FakeBackend):
+    """
+    Fake backend that records which trajectories it matched and fails the
+    selected ones
+    """
+
+    def __init__(self, fail=()):
+        super().__init__()
+        self.fail = set(fail)
+        self.calls = []
+
+    def trace_route(self, param):
+        traj_id = round((param["shape"][0]["lat"] - 42.2) / 0.01)
+        self.calls.append(traj_id)
+        if traj_id in self.fail:
+            raise RuntimeError("Error while calling Valhalla engine: no route")
+        return super().trace_route(param)
+
+
+def use_backend(monkeypatch, backend: FakeBackend) -> FakeBackend:
+    monkeypatch.setattr(nodes, "get_match_backend", lambda pool_size=None: backend)
+    return backend
+
+
+def get_status(db):
+    return dict(db.query("SELECT traj_id, status FROM match_status"))
+
+
+@pytest.mark.parametrize("storage", ["rows", "geometry"])
+def test_build_nodes_on_fake_backend(eved_db, storage):
+    db = eved_db({"backend": "fake"}, {"storage": storage})
+    build_nodes(concurrency=3)
+
+    assert get_status(db) == {traj_id: "done" for traj_id in range(1, 6)}
+    for traj_id in range(1, 6):
+        np.testing.assert_allclose(db.get_trajectory_geometry(traj_id), trajectory_points(traj_id), atol=1e-6)
+
+
+def test_match_status_transitions(eved_db, monkeypatch):
+    db = eved_db({"backend": "fake"})
+    db.create_match_status()
+    db.init_match_status()
+    assert get_status(db) == {traj_id: "pending" for traj_id in range(1, 6)}
+
+    backend = use_backend(monkeypatch, RecordingBackend(fail=[4]))
+    build_nodes(concurrency=2)
+    assert sorted(backend.calls) == [1, 2, 3, 4, 5]
+    assert get_status(db) == {1: "done", 2: "done", 3: "done", 4: "error", 5: "done"}
+    assert db.query("SELECT match_error FROM node WHERE traj_id = 4") == [
+        ("Error while calling Valhalla engine: no route",)]
+
+    # A plain run starts over, reusing the cached responses
+    backend = use_backend(monkeypatch, RecordingBackend())
+    build_nodes(concurrency=2)
+    assert backend.calls == [4]
+    assert get_status(db) == {traj_id: "done" for traj_id in range(1, 6)}
+
+
+def test_resume_rematches_only_changed_trajectories(eved_db, monkeypatch):
+    db = eved_db({"backend": "fake"})
+    use_backend(monkeypatch, RecordingBackend(fail=[4]))
+    build_nodes(concurrency=2)
+
+    # Errors are left for retry_errors, unchanged trajectories are skipped
+    backend = use_backend(monkeypatch, RecordingBackend())
+    build_nodes(concurrency=2, resume=True)
+    assert backend.calls == []
+    assert get_status(db)[4] == "error"
+
+    db.execute_sql("UPDATE signal SET latitude = latitude + 0.00001 WHERE vehicle_id = 2")
+    backend = use_backend(monkeypatch, RecordingBackend())
+    build_nodes(concurrency=2, resume=True)
+    assert backend.calls == [2]
+    np.testing.assert_allclose(db.get_trajectory_geometry(2), trajectory_points(2) + [0.00001, 0.0], atol=1e-6)
+    assert get_status(db) == {1: "done", 2: "done", 3: "done", 4: "error", 5: "done"}
+
+
+def test_resume_rematches_after_a_settings_change(eved_db, monkeypatch, tmp_path):
+    db = eved_db({"backend": "fake"})
+    use_backend(monkeypatch, RecordingBackend())
+    build_nodes(concurrency=2)
+
+    # Same points, but now matched in chunks
+    write_config(tmp_path, monkeypatch, valhalla={"backend": "fake", "cache": False},
+                 matching={"max_points": 20, "overlap": 5})
+    backend = use_backend(monkeypatch, RecordingBackend())
+    build_nodes(concurrency=2, resume=True)
+    assert sorted(set(backend.calls)) == [1, 2, 3, 4, 5]
+    assert get_status(db) == {traj_id: "done" for traj_id in range(1, 6)}
+
+    backend = use_backend(monkeypatch, RecordingBackend())
+    build_nodes(concurrency=2, resume=True)
+    assert backend.calls == []
+
+
+def test_resume_prunes_deleted_trajectories(eved_db, monkeypatch):
+    db = eved_db({"backend": "fake"})
+    use_backend(monkeypatch, RecordingBackend())
+    build_nodes(concurrency=2)
+
+    db.execute_sql("DELETE FROM trajectory WHERE traj_id = 3")
+    db.execute_sql("DELETE FROM signal WHERE vehicle_id = 3")
+    backend = use_backend(monkeypatch, RecordingBackend())
+    build_nodes(concurrency=2, resume=True)
+    assert backend.calls == []
+    assert get_status(db) == {1: "done", 2: "done", 4: "done", 5: "done"}
+    assert db.query("SELECT COUNT(*) FROM node WHERE traj_id = 3") == [(0,)]
+
+
+def test_retry_errors_rematches_only_failed_trajectories(eved_db, monkeypatch):
+    db = eved_db({"backend": "fake"})
+    use_backend(monkeypatch, RecordingBackend(fail=[2, 4]))
+    build_nodes(concurrency=2)
+    nodes_before = db.query("SELECT traj_id, latitude, longitude FROM node WHERE traj_id IN (1, 3, 5)")
+
+    backend = use_backend(monkeypatch, RecordingBackend())
+    build_nodes(concurrency=2, retry_errors=True)
+    assert sorted(backend.calls) == [2, 4]
+    assert get_status(db) == {traj_id: "done" for traj_id in range(1, 6)}
+    assert db.query("SELECT COUNT(*) FROM node WHERE match_error IS NOT NULL") == [(0,)]
+    assert db.query("SELECT traj_id, latitude, longitude FROM node WHERE traj_id IN (1, 3, 5)") == nodes_before
+    for traj_id in [2, 4]:
+        np.testing.assert_allclose(db.get_trajectory_geometry(traj_id), trajectory_points(traj_id), atol=1e-6)
+
+
+def test_cache_stats_are_per_run(eved_db, monkeypatch, capsys):
+    eved_db({"backend": "fake"})
+    use_backend(monkeypatch, RecordingBackend())
+    build_nodes(concurrency=2)
+    assert "Match cache: 0 hits, 5 misses" in capsys.readouterr().out
+
+    use_backend(monkeypatch, RecordingBackend())
+    build_nodes(concurrency=2)
+    assert "Match cache: 5 hits, 0 misses (100.0% hit rate)" in capsys.readouterr().out
+
+
+def test_node_insert_is_timed_on_the_writer(eved_db, monkeypatch):
+    eved_db({"backend": "fake"})
+    before = metrics.summary().get("node_insert", {}).get("rows", 0)
+    use_backend(monkeypatch, RecordingBackend())
+    build_nodes(concurrency=2)
+    assert metrics.summary()["node_insert"]["rows"] - before == 5
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from src.bench.stub_valhalla import StubValhalla
+from src.build import nodes
+from src.build.nodes import build_nodes
+from src.build.valhalla import FakeBackend
+from tests.conftest import trajectory_points
+
+
+def fails_trajectory_3(request) -> bool:
+    return abs(request["shape"][0]["lat"] - trajectory_points(3)[0, 0]) < 1e-9
+
+
+def test_build_nodes_against_stub_valhalla(eved_db):
+    with StubValhalla(fail=fails_trajectory_3) as stub:
+        db = eved_db({"url": stub.url, "retries": 0, "cache": False})
+        build_nodes(concurrency=2)
+
+    status = dict(db.query("SELECT traj_id, status FROM match_status"))
+    assert status == {1: "done", 2: "done", 3: "error", 4: "done", 5: "done"}
+
+    for traj_id in [1, 2, 4, 5]:
+        matched = np.array(db.query("SELECT latitude, longitude FROM node WHERE traj_id = ? ORDER BY node_id",
+                                    [traj_id]))
+        np.testing.assert_allclose(matched, trajectory_points(traj_id), atol=1e-6)
+
+    errors = db.query("SELECT latitude, match_error FROM node WHERE traj_id = 3")
+    assert len(errors) == 1
+    assert errors[0][0] is None
+    assert "400" in errors[0][1] and "No path could be found" in errors[0][1]
+
+
+def test_build_nodes_closes_the_client_on_failure(eved_db, monkeypatch):
+    eved_db({"backend": "fake"})
+    client = FakeBackend()
+    closed = []
+    monkeypatch.setattr(client, "close", lambda: closed.append(True))
+    monkeypatch.setattr(nodes, "get_match_backend", lambda pool_size=None: client)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("writer failed")
+
+    monkeypatch.setattr(nodes, "write_result", fail)
+    with pytest.raises(RuntimeError, match="writer failed"):
+        build_nodes(concurrency=1)
+    assert closed == [True]
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from src.common import polyline
+
+
+def scalar_decode(encoded: str):
+    # The pure-Python decoder that the vectorized codec replaced
+    inv = 1.0 / 1e6
+    decoded = []
+    previous = [0, 0]
+    i = 0
+    while i < len(encoded):
+        ll = [0, 0]
+        for j in [0, 1]:
+            shift = 0
+            byte = 0x20
+            while byte >= 0x20:
+                byte = ord(encoded[i]) - 63
+                i += 1
+                ll[j] |= (byte & 0x1f) << shift
+                shift += 5
+            ll[j] = previous[j] + (~(ll[j] >> 1) if ll[j] & 1 else (ll[j] >> 1))
+            previous[j] = ll[j]
+        decoded.append((float('%.6f' % (ll[0] * inv)), float('%.6f' % (ll[1] * inv))))
+    return decoded
+
+
+def random_shape(rng: np.random.Generator, n: int) -> np.ndarray:
+    # Steps of both signs and very different magnitudes, so values need from
+    # one to several 5-bit chunks
+    steps = rng.normal(0.0, 1.0, (n, 2)) * rng.choice([1e-6, 1e-4, 1e-2, 1.0], (n, 2))
+    steps[:1] = [42.28, -83.74]
+    return np.round(np.cumsum(steps, axis=0), 6)
+
+
+def test_known_polyline():
+    # Google's reference shape, here at precision 5
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    assert polyline.encode(points, precision=5) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    np.testing.assert_allclose(polyline.decode("_p~iF~ps|U_ulLnnqC_mqNvxq`@", precision=5), points)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_decode_matches_scalar_decoder(seed):
+    rng = np.random.default_rng(seed)
+    points = random_shape(rng, 500)
+    encoded = polyline.encode(points)
+    decoded = polyline.decode(encoded)
+    assert decoded.shape == (500, 2)
+    np.testing.assert_array_equal(decoded, np.array(scalar_decode(encoded)))
+    np.testing.assert_allclose(decoded, points, atol=1e-9)
+
+
+def test_empty_and_single_point():
+    assert polyline.encode([]) == ""
+    assert polyline.decode("").shape == (0, 2)
+
+    encoded = polyline.encode([(-33.868820, 151.209296)])
+    assert scalar_decode(encoded) == [(-33.86882, 151.209296)]
+    np.testing.assert_allclose(polyline.decode(encoded), [(-33.86882, 151.209296)])
+
+
+def test_negative_deltas():
+    points = [(1.0, 1.0), (0.5, 0.25), (-0.5, -1.75), (-0.500001, -1.750001)]
+    encoded = polyline.encode(points)
+    np.testing.assert_allclose(scalar_decode(encoded), points, atol=1e-9)
+    np.testing.assert_allclose(polyline.decode(encoded), points, atol=1e-9)
+
+
+def test_decode_many_matches_decode():
+    rng = np.random.default_rng(11)
+    shapes = [random_shape(rng, n) for n in [1, 0, 7, 120, 2]]
+    encoded = [polyline.encode(shape) for shape in shapes]
+    points, offsets = polyline.decode_many(encoded)
+    assert offsets.tolist() == [0, 1, 1, 8, 128, 130]
+    for shape, part in zip(encoded, polyline.split(points, offsets)):
+        np.testing.assert_allclose(part, polyline.decode(shape).reshape(-1, 2), atol=1e-9)
+
+    points, offsets = polyline.decode_many([])
+    assert points.shape == (0, 2) and offsets.tolist() == [0]
+
+
+def test_malformed_polyline():
+    # A lone latitude, without its longitude
+    with pytest.raises(ValueError):
+        polyline.decode("_p~iF", precision=5)
@@ -0,0 +1,33 @@
+from typing import Tuple
+from zipfile import ZipFile
+
+from src.build.signals import build_signals
+from src.db.EvedDb import EvedDb
+
+MANIFEST_SQL = "SELECT member, rows, first_signal_id, last_signal_id FROM signal_manifest ORDER BY first_signal_id"
+
+
+def load(eved_dataset, workers: int) -> Tuple[EvedDb, str]:
+    zip_filename = eved_dataset(4, database={"eved": f"eved_{workers}.db"})
+    build_signals(workers=workers)
+    return EvedDb(), zip_filename
+
+
+def test_parallel_ingest_matches_a_serial_run(eved_dataset):
+    serial, _ = load(eved_dataset, 1)
+    parallel, zip_filename = load(eved_dataset, 2)
+    assert serial.db_name != parallel.db_name
+
+    # Members are written in archive order, one consecutive id range each
+    with ZipFile(zip_filename) as zf:
+        members = zf.namelist()
+    manifest = parallel.query(MANIFEST_SQL)
+    assert [row[0] for row in manifest] == members
+    assert manifest[0][2] == 1
+    assert all(last + 1 == next_first for (_, _, _, last), (_, _, next_first, _) in zip(manifest, manifest[1:]))
+    assert manifest == serial.query(MANIFEST_SQL)
+
+    sql = "SELECT * FROM signal ORDER BY signal_id"
+    assert parallel.query(sql) == serial.query(sql)
+    sql = "SELECT traj_id, vehicle_id, trip_id, length_m, duration_s FROM trajectory ORDER BY traj_id"
+    assert parallel.query(sql) == serial.query(sql)
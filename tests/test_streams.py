@@ -0,0 +1,79 @@
+import io
+
+import pytest
+
+from src.common.streams import StripBytesReader, open_stripped
+
+CSV = (b"DayNum;,VehId;,Trip;\n"
+       b"1.5;,8;,706;\n"
+       b";;;;;;;;;;;;;;;;\n"
+       b"1.75;,8;,706;;\n"
+       b"2.0,9,707")
+
+
+class ShortReads(io.RawIOBase):
+    """
+    Raw stream that returns at most `step` bytes per read, like a
+    decompressing reader does
+    """
+
+    def __init__(self, data: bytes, step: int):
+        self._data = io.BytesIO(data)
+        self._step = step
+        self.closed_raw = False
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        return self._data.read(min(size, self._step) if size >= 0 else self._step)
+
+    def close(self) -> None:
+        self.closed_raw = True
+        super().close()
+
+
+@pytest.mark.parametrize("step", [1, 2, 3, 5, 16, 1000])
+@pytest.mark.parametrize("buffer_size", [1, 4, 7, 64])
+def test_semicolons_across_buffer_boundaries(step, buffer_size):
+    with open_stripped(ShortReads(CSV, step), buffer_size=buffer_size) as stream:
+        assert stream.read() == CSV.replace(b";", b"")
+        assert stream.raw.bytes_read == len(CSV)
+
+
+@pytest.mark.parametrize("buffer_size", [3, 8, 1 << 20])
+def test_readline(buffer_size):
+    with open_stripped(ShortReads(CSV, 5), buffer_size=buffer_size) as stream:
+        assert stream.readline() == b"DayNum,VehId,Trip\n"
+        assert stream.readline() == b"1.5,8,706\n"
+        # A line of semicolons leaves only its line break
+        assert stream.readline() == b"\n"
+        assert list(stream) == [b"1.75,8,706\n", b"2.0,9,707"]
+        assert stream.readline() == b""
+
+
+def test_short_final_read():
+    reader = StripBytesReader(io.BytesIO(b"ab;cd;e;"))
+    buffer = bytearray(4)
+    assert reader.readinto(buffer) == 3
+    assert buffer[:3] == b"abc"
+    # The final "d;e;" is two bytes once the semicolons are dropped
+    assert reader.readinto(buffer) == 2
+    assert buffer[:2] == b"de"
+    assert reader.readinto(buffer) == 0
+    assert reader.bytes_read == 8
+
+
+def test_read_skips_chunks_of_only_semicolons():
+    reader = StripBytesReader(io.BytesIO(b";;;;;;;;x;;"))
+    buffer = bytearray(4)
+    assert reader.readinto(buffer) == 1
+    assert buffer[:1] == b"x"
+    assert reader.readinto(buffer) == 0
+
+
+def test_close_closes_the_source():
+    raw = ShortReads(CSV, 4)
+    stream = open_stripped(raw)
+    stream.close()
+    assert raw.closed_raw and stream.raw.closed
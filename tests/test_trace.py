@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from src.build import nodes
+from src.common.trace import douglas_peucker, seam_points, split_ranges, stitch, thin
+
+
+def straight_line(n: int) -> np.ndarray:
+    # About 11.13 m between consecutive points
+    return np.column_stack([42.2 + 0.0001 * np.arange(n), np.full(n, -83.7)])
+
+
+def test_thin_short_traces_are_kept():
+    for n in range(3):
+        points = straight_line(n)
+        assert thin(points[:, 0], points[:, 1], np.zeros(n), 10.0, 30.0).tolist() == list(range(n))
+
+
+def test_thin_keeps_a_point_per_distance_step():
+    points = straight_line(10)
+    keep = thin(points[:, 0], points[:, 1], np.zeros(10), 25.0, 30.0)
+    assert keep.tolist() == [0, 3, 5, 7, 9]
+
+
+def test_thin_keeps_a_point_per_interval_while_stopped():
+    lats = np.full(10, 42.2)
+    lons = np.full(10, -83.7)
+    keep = thin(lats, lons, 10.0 * np.arange(10), 10.0, 30.0)
+    assert keep.tolist() == [0, 3, 6, 9]
+
+
+def test_douglas_peucker_drops_collinear_points():
+    points = straight_line(50)
+    assert douglas_peucker(points[:, 0], points[:, 1], 1.0).tolist() == [0, 49]
+
+
+def test_douglas_peucker_keeps_corners():
+    north = straight_line(10)
+    west = np.column_stack([np.full(10, north[-1, 0]), north[-1, 1] - 0.0001 * np.arange(1, 11)])
+    points = np.concatenate([north, west])
+    assert douglas_peucker(points[:, 0], points[:, 1], 1.0).tolist() == [0, 9, 19]
+
+
+def test_douglas_peucker_tolerance():
+    points = straight_line(11)
+    # About 8.2 m off the line
+    points[5, 1] += 0.0001
+    assert douglas_peucker(points[:, 0], points[:, 1], 7.0).tolist() == [0, 5, 10]
+    assert douglas_peucker(points[:, 0], points[:, 1], 10.0).tolist() == [0, 10]
+
+
+def test_douglas_peucker_closed_loop():
+    # First and last points coincide, so distances are taken to the start
+    out = straight_line(6)
+    points = np.concatenate([out, out[-2::-1]])
+    assert douglas_peucker(points[:, 0], points[:, 1], 1.0).tolist() == [0, 5, 10]
+
+
+def test_split_ranges():
+    assert split_ranges(0, 4, 1) == [(0, 0)]
+    assert split_ranges(4, 4, 1) == [(0, 4)]
+    assert split_ranges(10, 4, 1) == [(0, 4), (3, 7), (6, 10)]
+    assert split_ranges(11, 4, 1) == [(0, 4), (3, 7), (6, 10), (9, 11)]
+
+
+@pytest.mark.parametrize("overlap", [1, 2, 7, 14])
+def test_split_ranges_cover_every_point(overlap):
+    for n in range(31, 200, 7):
+        ranges = split_ranges(n, 30, overlap)
+        assert ranges[0][0] == 0 and ranges[-1][1] == n
+        assert all(end - start <= 30 for start, end in ranges)
+        assert all(end - next_start == overlap for (_, end), (next_start, _) in zip(ranges[:-1], ranges[1:]))
+
+
+def test_seam_points():
+    points = straight_line(11)
+    ranges = [(0, 4), (3, 7), (6, 10), (9, 11)]
+    np.testing.assert_array_equal(seam_points(points, ranges), points[[3, 6, 9]])
+    assert seam_points(points, [(0, 11)]).shape == (0, 2)
+
+
+@pytest.mark.parametrize("overlap", range(1, 15))
+def test_stitch_rebuilds_the_trace(overlap):
+    # Chunks matched onto their own points join back without gaps or repeats
+    points = straight_line(437)
+    ranges = split_ranges(len(points), 30, overlap)
+    parts = [points[start:end] for start, end in ranges]
+    np.testing.assert_array_equal(stitch(parts, seam_points(points, ranges)), points)
+
+
+def test_stitch_single_and_empty_parts():
+    points = straight_line(20)
+    np.testing.assert_array_equal(stitch([points], np.empty((0, 2))), points)
+
+    # A chunk that failed to match is skipped without cutting its neighbours
+    seams = points[[9, 15]]
+    stitched = stitch([points[:10], np.empty((0, 2)), points[10:]], seams)
+    np.testing.assert_array_equal(stitched, points)
+
+
+def test_stitch_does_not_cut_at_an_earlier_pass_over_the_seam():
+    # Out and back, so the seam is passed at nodes 4 and 15 of the first chunk
+    out = straight_line(10)
+    first = np.concatenate([out, out[::-1]])
+    second = np.concatenate([first[15:], straight_line(30)[10:20] * [1.0, 1.0001]])
+    stitched = stitch([first, second], first[15:16])
+    np.testing.assert_array_equal(stitched, np.concatenate([first[:15], second]))
+
+
+@pytest.mark.parametrize("max_points, overlap", [(1, 0), (30, 0), (30, 15), (30, 29), (30, 40)])
+def test_trace_options_reject_bad_overlaps(monkeypatch, max_points, overlap):
+    monkeypatch.setattr(nodes, "load_config", lambda: {"matching": {"max_points": max_points, "overlap": overlap}})
+    with pytest.raises(ValueError, match="max_points"):
+        nodes.get_trace_options()
+
+
+def test_trace_options_accept_valid_overlaps(monkeypatch):
+    monkeypatch.setattr(nodes, "load_config", lambda: {"matching": {"max_points": 30, "overlap": 14}})
+    options = nodes.get_trace_options()
+    assert (options.max_points, options.overlap) == (30, 14)